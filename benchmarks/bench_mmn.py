@@ -0,0 +1,59 @@
+"""Benchmark the MMN reader against a block-by-block parse of the file
+
+Usage: python bench_mmn.py [nkpts] [nntot] [nbnds]
+
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from w90utils import io as w90io
+
+
+def read_mmn_per_block(fname):
+    # the previous implementation, which parses the file one block at a time
+    with open(fname, 'r') as f:
+        contents = f.readlines()
+
+    [nbnds, nkpts, nntot] = np.fromstring(contents[1], sep=' ', dtype=int)
+    blk_len = nbnds**2 + 1
+
+    mmn = np.zeros((nkpts, nntot, nbnds, nbnds), dtype=complex)
+    for (iblk, istart) in enumerate(range(2, len(contents), blk_len)):
+        (ikpt, inn) = divmod(iblk, nntot)
+        block = contents[istart:(istart+blk_len)]
+        s = ''.join(block[1:])
+        mmn[ikpt, inn] = np.fromstring(s, sep='\n').view(complex).reshape((nbnds, nbnds), order='F')
+
+    return mmn
+
+
+def main(nkpts=1000, nntot=8, nbnds=8):
+    rng = np.random.RandomState(0)
+    mmn = rng.uniform(-1, 1, (nkpts, nntot, nbnds, nbnds)) + 1j*rng.uniform(-1, 1, (nkpts, nntot, nbnds, nbnds))
+    kpb_kidx = rng.randint(0, nkpts, (nkpts, nntot))
+    kpb_g = rng.randint(-1, 2, (nkpts, nntot, 3))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, 'bench.mmn')
+        w90io.write_mmn(fname, mmn, kpb_kidx, kpb_g)
+        size = os.path.getsize(fname) / 2**20
+
+        timings = {}
+        for (label, reader) in [('per-block', read_mmn_per_block), ('read_mmn', w90io.read_mmn)]:
+            t0 = time.perf_counter()
+            m = reader(fname)
+            timings[label] = time.perf_counter() - t0
+            assert np.allclose(m, mmn)
+
+    print('nkpts=%d nntot=%d nbnds=%d (%.1f MiB)' % (nkpts, nntot, nbnds, size))
+    for (label, t) in timings.items():
+        print('%-10s %8.3f s %8.1f MiB/s' % (label, t, size/t))
+    print('speedup    %8.1fx' % (timings['per-block']/timings['read_mmn']))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,49 @@
+"""Benchmark rotate_mmn against a block-by-block rotation
+
+Usage: python bench_rotate_mmn.py [nkpts] [nntot] [nbnds] [nproj]
+
+"""
+import sys
+import time
+
+import numpy as np
+
+import w90utils
+
+
+def rotate_mmn_per_block(mmn, umn, kpb_kidx):
+    # the previous implementation, which rotates the matrices one block at a time
+    (nkpts, nntot, nbnds, nbnds) = mmn.shape
+    nproj = umn[0].shape[1]
+
+    mmn_rotated = np.empty((nkpts, nntot, nproj, nproj), dtype=complex)
+    for ikpt in range(nkpts):
+        for inn in range(nntot):
+            ikpb = kpb_kidx[ikpt][inn]
+            mmn_rotated[ikpt][inn] = np.dot(np.dot(umn[ikpt].conj().T, mmn[ikpt][inn]), umn[ikpb])
+
+    return mmn_rotated
+
+
+def main(nkpts=1000, nntot=8, nbnds=16, nproj=8):
+    rng = np.random.RandomState(0)
+    mmn = rng.uniform(-1, 1, (nkpts, nntot, nbnds, nbnds)) + 1j*rng.uniform(-1, 1, (nkpts, nntot, nbnds, nbnds))
+    umn = rng.uniform(-1, 1, (nkpts, nbnds, nproj)) + 1j*rng.uniform(-1, 1, (nkpts, nbnds, nproj))
+    kpb_kidx = rng.randint(0, nkpts, (nkpts, nntot))
+
+    timings = {}
+    results = {}
+    for (label, rotate) in [('per-block', rotate_mmn_per_block), ('rotate_mmn', w90utils.rotate_mmn)]:
+        t0 = time.perf_counter()
+        results[label] = rotate(mmn, umn, kpb_kidx)
+        timings[label] = time.perf_counter() - t0
+    assert np.allclose(results['per-block'], results['rotate_mmn'])
+
+    print('nkpts=%d nntot=%d nbnds=%d nproj=%d' % (nkpts, nntot, nbnds, nproj))
+    for (label, t) in timings.items():
+        print('%-10s %8.3f s' % (label, t))
+    print('speedup    %8.1fx' % (timings['per-block']/timings['rotate_mmn']))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -1,7 +1,15 @@
 """Wannier90 utility library"""
 
+from . import disentangle
+from . import interp
 from . import io
+from . import localize
+from . import orbitals
+from . import plot
 from . import sprd
+from . import ws
 from ._amn import expand_amn
 from ._mmn import rotate_mmn
+from ._mmn import update_mmn
+from ._utils import expm_antihermitian
 from ._utils import unitarize
@@ -1,36 +1,113 @@
 import numpy as np
 
 
-def rotate_mmn(mmn, umn, kpb_kidx, window=None):
+# number of (k, b) blocks rotated at a time
+_CHUNK_BLOCKS = 2**12
+
+
+def _expand_window(umn, window, nbnds):
+    # embed the rows of each U(k) for the bands inside the window into the
+    # full band basis, with zeros for the bands outside of the window, so that
+    # the windowed rotation is a rotation with the full overlap matrices
+    nkpts = len(umn)
+    nproj = umn[0].shape[1]
+
+    umn_full = np.zeros((nkpts, nbnds, nproj), dtype=complex)
+    for ikpt in range(nkpts):
+        bands = np.arange(nbnds)[window[ikpt]]
+        umn_full[ikpt, bands] = umn[ikpt][:len(bands)]
+
+    return umn_full
+
+
+def _full_umn(umn, window, nbnds):
+    if window is not None:
+        return _expand_window(umn, window, nbnds)
+    else:
+        return np.asarray(umn)
+
+
+def _rotate_blocks(mmn, umn_k, umn_kpb, out=None):
+    # mmn: (nkpts, nntot, nbnds, nbnds), umn_k: (nkpts, nbnds, nproj),
+    # umn_kpb: (nkpts, nntot, nbnds, nproj)
+    tmp = np.matmul(umn_k.conj().swapaxes(1, 2)[:, np.newaxis], mmn)
+    return np.matmul(tmp, umn_kpb, out=out)
+
+
+def rotate_mmn(mmn, umn, kpb_kidx, window=None, out=None, chunk_size=None):
     """
     Rotate the overlap matrices according to
     :math:`U^{(\mathbf{k})\dagger}M^{(\mathbf{k},\mathbf{b})}U^{(\mathbf{k}+\mathbf{b})}`
 
+    Parameters
+    ----------
+    mmn : ndarray, shape (nkpts, nntot, nbnds, nbnds)
+    umn : ndarray, shape (nkpts, nbnds, nproj), or sequence of ndarray
+        with a window, the rows of each matrix are the bands inside the window
+        at that k-point, and any trailing rows are ignored
+    kpb_kidx : ndarray, shape (nkpts, nntot)
+    window : ndarray, shape (nkpts, nbnds), or sequence of ndarray, optional
+        boolean masks or indices of the bands inside the window at each k-point
+    out : ndarray, shape (nkpts, nntot, nproj, nproj), optional
+        array in which to store the result
+    chunk_size : int, optional
+        number of k-points rotated at a time
+
+    Returns
+    -------
+    ndarray, shape (nkpts, nntot, nproj, nproj)
+
     """
     (nkpts, nntot, nbnds, nbnds) = mmn.shape
-    nproj = umn[0].shape[1]
+    kpb_kidx = np.asarray(kpb_kidx)
 
-    mmn_rotated = np.empty((nkpts, nntot, nproj, nproj), dtype=complex)
+    umn = _full_umn(umn, window, nbnds)
+    nproj = umn.shape[2]
 
-    if window is not None:
-        for ikpt in range(nkpts):
-            for inn in range(nntot):
-                ikpb = kpb_kidx[ikpt][inn]
-                mmn_rotated[ikpt][inn] = (
-                    np.dot(
-                        np.dot(
-                            umn[ikpt].conj().T, mmn[ikpt][inn][window[ikpt]][:, window[ikpb]],
-                        ),
-                        umn[ikpb]
-                    )
-                )
-    else:
-        for ikpt in range(nkpts):
-            for inn in range(nntot):
-                ikpb = kpb_kidx[ikpt][inn]
-                mmn_rotated[ikpt][inn] = np.dot(np.dot(umn[ikpt].conj().T, mmn[ikpt][inn]), umn[ikpb])
+    if out is None:
+        out = np.empty((nkpts, nntot, nproj, nproj), dtype=complex)
+    if chunk_size is None:
+        chunk_size = max(1, _CHUNK_BLOCKS // nntot)
+
+    for start in range(0, nkpts, chunk_size):
+        stop = min(start+chunk_size, nkpts)
+        _rotate_blocks(mmn[start:stop], umn[start:stop], umn[kpb_kidx[start:stop]], out=out[start:stop])
+
+    return out
+
+
+def update_mmn(mmn, expw, kpb_kidx, out=None, chunk_size=None):
+    """
+    Update rotated overlap matrices after a unitary rotation of the gauge
+    :math:`U^{(\mathbf{k})} \rightarrow U^{(\mathbf{k})}\exp(dW^{(\mathbf{k})})`
+
+    Unlike :func:`rotate_mmn` applied to the original overlap matrices, only
+    the matrices of size nwann are rotated, and the update is done in place
+    by default.
+
+    Parameters
+    ----------
+    mmn : ndarray, shape (nkpts, nntot, nwann, nwann)
+        the overlap matrices in the current gauge
+    expw : ndarray, shape (nkpts, nwann, nwann)
+        the unitary matrices :math:`\exp(dW^{(\mathbf{k})})`, see
+        :func:`w90utils.expm_antihermitian`
+    kpb_kidx : ndarray, shape (nkpts, nntot)
+    out : ndarray, shape (nkpts, nntot, nwann, nwann), optional
+        array in which to store the result, by default ``mmn``
+    chunk_size : int, optional
+        number of k-points rotated at a time
+
+    Returns
+    -------
+    ndarray, shape (nkpts, nntot, nwann, nwann)
+
+    """
+    if out is None:
+        out = mmn
 
-    return mmn_rotated
+    # each chunk of mmn is read into a temporary before out is written to
+    return rotate_mmn(mmn, expw, kpb_kidx, out=out, chunk_size=chunk_size)
 
 
 # def change_gauge_k(m, u, setup_file):
@@ -4,3 +4,23 @@ import numpy as np
 def unitarize(a):
     u, _, v = np.linalg.svd(a, full_matrices=False)
     return np.einsum('...ik,...kj->...ij', u, v)
+
+
+def expm_antihermitian(w):
+    """
+    Compute the exponentials of a stack of anti-Hermitian matrices
+
+    Parameters
+    ----------
+    w : ndarray, shape (..., n, n)
+        anti-Hermitian matrices
+
+    Returns
+    -------
+    ndarray, shape (..., n, n)
+        the unitary matrices :math:`\exp(W)`
+
+    """
+    # exp(W) = V exp(-iD) V^dagger, for the Hermitian iW = V D V^dagger
+    (d, v) = np.linalg.eigh(1j * np.asarray(w))
+    return np.matmul(v * np.exp(-1j * d)[..., np.newaxis, :], v.conj().swapaxes(-1, -2))
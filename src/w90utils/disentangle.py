@@ -0,0 +1,215 @@
+"""Disentanglement of an optimally-connected subspace from entangled bands"""
+import collections
+
+import numpy as np
+
+from ._utils import unitarize
+
+
+__all__ = ['DisentanglementResult', 'window_masks', 'disentangle']
+
+
+# number of k-points for which the overlap matrices are projected at a time
+_CHUNK_KPTS = 2**8
+
+
+DisentanglementResult = collections.namedtuple(
+    'DisentanglementResult',
+    ['umat_opt', 'windows', 'ndimwin', 'eig_opt', 'omega_i', 'history', 'converged']
+)
+DisentanglementResult.__doc__ = """\
+Result of the minimization of the invariant spread
+
+umat_opt : ndarray, shape (nkpts, nbnds, nwann)
+    the optimal subspace, with the rows of each matrix for the bands inside the
+    outer window followed by zeros, as in the wannier90 checkpoint file
+windows : ndarray, shape (nkpts, nbnds)
+    boolean masks of the bands inside the outer window
+ndimwin : ndarray, shape (nkpts,)
+    number of bands inside the outer window
+eig_opt : ndarray, shape (nkpts, nwann)
+    eigenvalues of the Hamiltonian projected onto the optimal subspace
+omega_i : float
+history : ndarray, shape (niter,)
+    the invariant spread at each iteration
+converged : bool
+"""
+
+
+def window_masks(eig, win_min=None, win_max=None, froz_min=None, froz_max=None):
+    """
+    Find the bands inside the outer and frozen energy windows
+
+    Parameters
+    ----------
+    eig : ndarray, shape (nkpts, nbnds)
+    win_min, win_max : float, optional
+        the outer window, by default all bands
+    froz_min, froz_max : float, optional
+        the frozen window, by default no bands are frozen unless ``froz_max``
+        is given, and ``froz_min`` defaults to ``win_min``
+
+    Returns
+    -------
+    outer : ndarray, shape (nkpts, nbnds)
+    frozen : ndarray, shape (nkpts, nbnds)
+
+    """
+    eig = np.asarray(eig)
+
+    if win_min is None:
+        win_min = np.min(eig)
+    if win_max is None:
+        win_max = np.max(eig)
+    outer = (eig >= win_min) & (eig <= win_max)
+
+    if froz_max is None:
+        frozen = np.zeros_like(outer)
+    else:
+        if froz_min is None:
+            froz_min = win_min
+        frozen = outer & (eig >= froz_min) & (eig <= froz_max)
+
+    return outer, frozen
+
+
+def _free_subspace(z, free, frozen, nwann):
+    # the subspace spanned by the frozen bands and the eigenvectors of z
+    # restricted to the free bands with the largest eigenvalues
+    (nkpts, nbnds, _) = z.shape
+
+    z = z * (free[:, :, np.newaxis] & free[:, np.newaxis, :])
+    # the bands that are not free are decoupled, and sorted below all others
+    z[:, np.arange(nbnds), np.arange(nbnds)] -= np.where(free, 0, 1 + np.max(np.abs(z)))
+    (_, v) = np.linalg.eigh(z)
+    top = v[:, :, nbnds-nwann:]
+
+    ndimfroz = np.sum(frozen, axis=1)
+    (ik, ib) = np.nonzero(frozen)
+    iw = np.arange(len(ik)) - np.repeat(np.cumsum(ndimfroz) - ndimfroz, ndimfroz)
+    u_froz = np.zeros((nkpts, nbnds, nwann), dtype=complex)
+    u_froz[ik, ib, iw] = 1
+
+    return np.where((np.arange(nwann) < ndimfroz[:, np.newaxis])[:, np.newaxis, :], u_froz, top)
+
+
+def _projected_z(mmn, umn, kpb_kidx, bweights, chunk_size):
+    # Z(k) = sum_b w_b M(k,b) U(k+b) U(k+b)^dagger M(k,b)^dagger
+    (nkpts, nntot, nbnds, _) = mmn.shape
+
+    z = np.empty((nkpts, nbnds, nbnds), dtype=complex)
+    for start in range(0, nkpts, chunk_size):
+        stop = min(start+chunk_size, nkpts)
+        c = np.matmul(mmn[start:stop], umn[kpb_kidx[start:stop]])
+        wc = c * bweights[:, np.newaxis, np.newaxis]
+        z[start:stop] = np.sum(np.matmul(wc, c.conj().swapaxes(2, 3)), axis=1)
+
+    return z
+
+
+def disentangle(mmn, amn, eig, kpb_kidx, bweights, outer=None, frozen=None, maxiter=200, tol=1e-10,
+                conv_window=3, mix_ratio=0.5, chunk_size=None):
+    """
+    Find the optimal subspace by minimization of the invariant spread
+
+    The subspace at each k-point is found iteratively as in the method of
+    Souza, Marzari, and Vanderbilt, with the eigenvalue problems of all
+    k-points solved together at each iteration, following wannier90.
+
+    Parameters
+    ----------
+    mmn : ndarray, shape (nkpts, nntot, nbnds, nbnds)
+        the overlap matrices
+    amn : ndarray, shape (nkpts, nbnds, nwann)
+        the projections, from which the initial subspace is found
+    eig : ndarray, shape (nkpts, nbnds)
+    kpb_kidx : ndarray, shape (nkpts, nntot)
+    bweights : ndarray, shape (nntot,)
+    outer : ndarray, shape (nkpts, nbnds), optional
+        boolean masks of the bands inside the outer window, by default all
+        bands, see :func:`window_masks`
+    frozen : ndarray, shape (nkpts, nbnds), optional
+        boolean masks of the bands inside the frozen window, by default none
+    maxiter : int, optional
+        maximum number of iterations
+    tol : float, optional
+        the minimization is converged when the relative change in the
+        invariant spread is less than ``tol`` for ``conv_window`` consecutive
+        iterations
+    conv_window : int, optional
+    mix_ratio : float, optional
+        the fraction of :math:`Z^{(\\mathbf{k})}` from the current iteration
+        mixed with that of the previous iteration
+    chunk_size : int, optional
+        number of k-points for which the overlap matrices are projected at a
+        time
+
+    Returns
+    -------
+    DisentanglementResult
+
+    """
+    (nkpts, nntot, nbnds, _) = mmn.shape
+    nwann = amn.shape[2]
+    kpb_kidx = np.asarray(kpb_kidx)
+    bweights = np.asarray(bweights, dtype=float)
+
+    if outer is None:
+        outer = np.ones((nkpts, nbnds), dtype=bool)
+    if frozen is None:
+        frozen = np.zeros((nkpts, nbnds), dtype=bool)
+    outer = np.asarray(outer, dtype=bool)
+    frozen = np.asarray(frozen, dtype=bool) & outer
+    free = outer & ~frozen
+
+    ndimwin = np.sum(outer, axis=1)
+    ndimfroz = np.sum(frozen, axis=1)
+    if np.any(ndimwin < nwann):
+        raise ValueError('fewer bands inside the outer window than Wannier functions')
+    if np.any(ndimfroz > nwann):
+        raise ValueError('more bands inside the frozen window than Wannier functions')
+
+    if maxiter < 1:
+        raise ValueError('maxiter must be at least 1')
+    if chunk_size is None:
+        chunk_size = _CHUNK_KPTS
+
+    # the projections onto the bands inside the outer window, with the frozen
+    # bands replacing the projected states with the least weight on them
+    umn = unitarize(amn * outer[:, :, np.newaxis])
+    if np.any(ndimfroz > 0):
+        umn = _free_subspace(np.matmul(umn, umn.conj().swapaxes(1, 2)), free, frozen, nwann)
+
+    history = []
+    nsmall = 0
+    converged = False
+    z_in = None
+    for it in range(maxiter):
+        z = _projected_z(mmn, umn, kpb_kidx, bweights, chunk_size)
+
+        # Omega_I = sum_k (nwann sum_b w_b - tr[U(k)^dagger Z(k) U(k)]) / nkpts
+        tr = np.einsum('kmi,kmn,kni->', umn.conj(), z, umn).real
+        omega_i = (nkpts * nwann * np.sum(bweights) - tr) / nkpts
+        if history:
+            nsmall = nsmall + 1 if abs(history[-1] / omega_i - 1) < tol else 0
+        history.append(omega_i)
+        if nsmall >= conv_window:
+            converged = True
+            break
+        if it == maxiter - 1:
+            # the subspace returned is the one for which omega_i was evaluated
+            break
+
+        z_in = z if z_in is None else mix_ratio * z + (1 - mix_ratio) * z_in
+        umn = _free_subspace(z_in, free, frozen, nwann)
+
+    # rotate to the eigenstates of the Hamiltonian projected onto the subspace
+    ham = np.matmul(umn.conj().swapaxes(1, 2) * eig[:, np.newaxis, :], umn)
+    (eig_opt, v) = np.linalg.eigh(ham)
+    umn = np.matmul(umn, v)
+
+    umat_opt = np.zeros((nkpts, nbnds, nwann), dtype=complex)
+    rows = np.arange(nbnds) < ndimwin[:, np.newaxis]
+    umat_opt[rows] = umn[outer]
+
+    return DisentanglementResult(umat_opt, outer, ndimwin, eig_opt, history[-1], np.array(history), converged)
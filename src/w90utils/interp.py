@@ -0,0 +1,578 @@
+"""Wannier interpolation of operators from their real-space representation"""
+import concurrent.futures
+
+import numpy as np
+import scipy.constants
+import scipy.fft
+
+from .ws import wigner_seitz
+
+__all__ = [
+    'grid_kpoints', 'hamiltonian', 'hamiltonian_grid', 'eigvals', 'eigh',
+    'velocities', 'inverse_effective_masses', 'hamiltonian_from_chk',
+    'position_matrix', 'position',
+]
+
+
+# default bound, in bytes, on the temporaries held for each chunk of k-points
+_MEMORY_BUDGET = 2**27
+
+# hbar^2/m_e, in eV Angstrom^2
+_HBAR2_ME = scipy.constants.hbar**2 / scipy.constants.m_e / scipy.constants.e * 1e20
+
+
+class _FourierSum(object):
+    # sum_R w_R exp(2 pi i k.R) X(R), for k-points in chunks, with the phases
+    # built from per-axis tables instead of one exponential per (k, R)
+
+    def __init__(self, xr, Rvectors, Rweights, dtype=complex):
+        Rvectors = np.asarray(Rvectors)
+        self.dtype = np.dtype(dtype)
+        self.shape = xr.shape[1:]
+        self.xr = (xr * np.reshape(Rweights, (-1,) + (1,)*(xr.ndim-1))).reshape((len(xr), -1)).astype(self.dtype)
+
+        self.axes = []
+        for i in range(3):
+            (values, inverse) = np.unique(Rvectors[:, i], return_inverse=True)
+            self.axes.append((values, inverse.ravel()))
+
+    def phases(self, kpoints):
+        phases = None
+        for (i, (values, inverse)) in enumerate(self.axes):
+            table = np.exp(2j*np.pi*np.outer(kpoints[:, i], values)).astype(self.dtype)
+            phases = table[:, inverse] if phases is None else phases * table[:, inverse]
+
+        return phases
+
+    def __call__(self, kpoints, phases=None, out=None):
+        if phases is None:
+            phases = self.phases(kpoints)
+        if out is not None:
+            out = out.reshape((len(phases), -1))
+
+        return np.matmul(phases, self.xr, out=out).reshape((len(phases),) + self.shape)
+
+    def derivatives(self, kpoints, Rcart, order):
+        # X(k) and its derivatives up to the given order with respect to the
+        # Cartesian components of k, from a single product with the phases
+        # multiplied by the components of R
+        phases = self.phases(kpoints)
+        nkpts = len(kpoints)
+
+        factors = [1j*Rcart[:, i] for i in range(3)]
+        if order > 1:
+            factors += [-1*Rcart[:, i]*Rcart[:, j] for i in range(3) for j in range(3)]
+        stacked = np.concatenate([phases] + [(phases * f).astype(self.dtype) for f in factors])
+
+        x = self(None, phases=stacked)
+        derivatives = [x[:nkpts], np.moveaxis(x[nkpts:4*nkpts].reshape((3, nkpts) + self.shape), 0, 1)]
+        if order > 1:
+            derivatives.append(np.moveaxis(x[4*nkpts:].reshape((3, 3, nkpts) + self.shape), (0, 1), (1, 2)))
+
+        return derivatives
+
+    def chunk_size(self, nextra=0, memory=None, workers=None):
+        # the phases, the result, and nextra arrays the size of the result
+        if memory is None:
+            memory = _MEMORY_BUDGET
+        (nrpts, nelems) = self.xr.shape
+        per_kpoint = (nrpts + (1 + nextra) * nelems) * self.dtype.itemsize
+
+        return max(1, memory // (per_kpoint * (workers or 1)))
+
+
+def _map_chunks(func, nkpts, chunk_size, workers=None):
+    # calls func(start, stop) for chunks of k-points, in a thread pool if
+    # workers is given, since the GEMM and eigensolvers release the GIL
+    chunks = [(start, min(start+chunk_size, nkpts)) for start in range(0, nkpts, chunk_size)]
+
+    if workers is None or workers == 1 or len(chunks) == 1:
+        for chunk in chunks:
+            func(*chunk)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(func, *chunk) for chunk in chunks]:
+                future.result()
+
+
+def _real_dtype(dtype):
+    return np.empty(0, dtype=dtype).real.dtype
+
+
+def grid_kpoints(grid):
+    """
+    Return the k-points of a uniform grid including the origin
+
+    Parameters
+    ----------
+    grid : tuple of int
+        the number of k-points along each reciprocal lattice vector
+
+    Returns
+    -------
+    ndarray, shape (nk1*nk2*nk3, 3)
+        the k-points, in crystal coordinates, with the last index running
+        fastest, as in the ``kmesh.pl`` utility of wannier90
+
+    """
+    grid = np.asarray(grid, dtype=int)
+    idx = np.indices(grid).reshape((3, -1)).T
+
+    return idx / grid
+
+
+def _find_grid(kpoints, tol=1e-8):
+    # the uniform grid, including the origin, formed by the k-points, and the
+    # index of each k-point on the grid, or None if they do not form one
+    nkpts = len(kpoints)
+    frac = np.mod(kpoints, 1)
+
+    grid = []
+    for i in range(3):
+        values = np.unique(np.round(frac[:, i] / tol))
+        if values[-1] * tol > 1 - 2*tol:
+            values = values[:-1]
+        grid.append(len(values))
+    if np.prod(grid) != nkpts:
+        return None
+
+    idx = frac * grid
+    if not np.allclose(idx, np.round(idx), rtol=0, atol=np.max(grid)*tol):
+        return None
+    flat = np.ravel_multi_index((np.round(idx).astype(int) % grid).T, grid)
+    if len(np.unique(flat)) != nkpts:
+        return None
+
+    return tuple(grid), flat
+
+
+def hamiltonian_grid(hr, Rvectors, Rweights, grid, dtype=complex, workers=None):
+    """
+    Interpolate the Hamiltonian on a uniform grid of k-points by FFT
+
+    :math:`w_\\mathbf{R}H(\\mathbf{R})` is accumulated on a grid of lattice
+    vectors modulo the k-point grid, and transformed with a single FFT over
+    the three axes of the grid for all matrix elements.
+
+    Parameters
+    ----------
+    hr : ndarray, shape (nrpts, nwann, nwann)
+    Rvectors : ndarray, shape (nrpts, 3)
+        lattice vectors, in crystal coordinates
+    Rweights : ndarray, shape (nrpts,)
+    grid : tuple of int
+        the number of k-points along each reciprocal lattice vector
+    dtype : dtype, optional
+        complex dtype of the computation
+    workers : int, optional
+        number of threads used for the FFT
+
+    Returns
+    -------
+    ndarray, shape (nk1*nk2*nk3, nwann, nwann)
+        the Hamiltonian at the k-points of :func:`grid_kpoints`
+
+    """
+    grid = tuple(int(n) for n in grid)
+    (nrpts, nwann, _) = hr.shape
+
+    hr_grid = np.zeros(grid + (nwann, nwann), dtype=dtype)
+    idx = tuple((np.asarray(Rvectors) % grid).T)
+    np.add.at(hr_grid, idx, hr * np.reshape(Rweights, (-1, 1, 1)))
+
+    hk = scipy.fft.ifftn(hr_grid, axes=(0, 1, 2), norm='forward', overwrite_x=True, workers=workers)
+
+    return hk.reshape((-1, nwann, nwann))
+
+
+def hamiltonian(hr, Rvectors, Rweights, kpoints, dtype=complex, memory=None, workers=None, method='auto'):
+    """
+    Interpolate the Hamiltonian at arbitrary k-points
+
+    Computes :math:`H(\\mathbf{k}) = \\sum_\\mathbf{R} w_\\mathbf{R}
+    e^{2\\pi i\\mathbf{k}\\cdot\\mathbf{R}} H(\\mathbf{R})` as one matrix
+    product for each chunk of k-points, or, if the k-points form a uniform grid
+    including the origin, by FFT with :func:`hamiltonian_grid`.
+
+    Parameters
+    ----------
+    hr : ndarray, shape (nrpts, nwann, nwann)
+    Rvectors : ndarray, shape (nrpts, 3)
+        lattice vectors, in crystal coordinates
+    Rweights : ndarray, shape (nrpts,)
+    kpoints : ndarray, shape (nkpts, 3)
+        k-points, in crystal coordinates
+    dtype : dtype, optional
+        complex dtype of the computation, ``np.complex64`` halves the memory
+        used and is faster, at the cost of precision
+    memory : int, optional
+        bound in bytes on the temporaries held for each chunk of k-points
+    workers : int, optional
+        number of threads working on chunks of k-points concurrently
+    method : {'auto', 'fft', 'direct'}, optional
+        by default the FFT is used when the k-points form a uniform grid, and
+        the direct sum otherwise
+
+    Returns
+    -------
+    ndarray, shape (nkpts, nwann, nwann)
+
+    """
+    kpoints = np.asarray(kpoints, dtype=float).reshape((-1, 3))
+
+    if method not in ('auto', 'fft', 'direct'):
+        raise ValueError('unknown method: %s' % method)
+    if method != 'direct':
+        found = _find_grid(kpoints)
+        if found is not None:
+            (grid, idx) = found
+            return hamiltonian_grid(hr, Rvectors, Rweights, grid, dtype=dtype, workers=workers)[idx]
+        elif method == 'fft':
+            raise ValueError('the k-points do not form a uniform grid')
+
+    fsum = _FourierSum(hr, Rvectors, Rweights, dtype)
+
+    hk = np.empty((len(kpoints),) + fsum.shape, dtype=fsum.dtype)
+
+    def func(start, stop):
+        fsum(kpoints[start:stop], out=hk[start:stop])
+
+    _map_chunks(func, len(kpoints), fsum.chunk_size(memory=memory, workers=workers), workers)
+
+    return hk
+
+
+def eigvals(hr, Rvectors, Rweights, kpoints, dtype=complex, memory=None, workers=None):
+    """
+    Interpolate the band energies at arbitrary k-points
+
+    The Hamiltonian is interpolated and diagonalized one chunk of k-points at
+    a time, so that only the band energies are held for all k-points.
+
+    Parameters
+    ----------
+    See :func:`hamiltonian`.
+
+    Returns
+    -------
+    ndarray, shape (nkpts, nwann)
+
+    """
+    kpoints = np.asarray(kpoints, dtype=float).reshape((-1, 3))
+    fsum = _FourierSum(hr, Rvectors, Rweights, dtype)
+    nwann = fsum.shape[0]
+
+    w = np.empty((len(kpoints), nwann), dtype=_real_dtype(fsum.dtype))
+
+    def func(start, stop):
+        w[start:stop] = np.linalg.eigvalsh(fsum(kpoints[start:stop]))
+
+    _map_chunks(func, len(kpoints), fsum.chunk_size(memory=memory, workers=workers), workers)
+
+    return w
+
+
+def eigh(hr, Rvectors, Rweights, kpoints, dtype=complex, memory=None, workers=None):
+    """
+    Interpolate the band energies and eigenvectors at arbitrary k-points
+
+    Parameters
+    ----------
+    See :func:`hamiltonian`.
+
+    Returns
+    -------
+    w : ndarray, shape (nkpts, nwann)
+    v : ndarray, shape (nkpts, nwann, nwann)
+        the eigenvectors, as the columns of each matrix
+
+    """
+    kpoints = np.asarray(kpoints, dtype=float).reshape((-1, 3))
+    fsum = _FourierSum(hr, Rvectors, Rweights, dtype)
+    nwann = fsum.shape[0]
+
+    w = np.empty((len(kpoints), nwann), dtype=_real_dtype(fsum.dtype))
+    v = np.empty((len(kpoints), nwann, nwann), dtype=fsum.dtype)
+
+    def func(start, stop):
+        (w[start:stop], v[start:stop]) = np.linalg.eigh(fsum(kpoints[start:stop]))
+
+    _map_chunks(func, len(kpoints), fsum.chunk_size(nextra=1, memory=memory, workers=workers), workers)
+
+    return w, v
+
+
+def _degenerate_groups(w, degen_thr):
+    # (ikpt, start, stop) for each set of more than one degenerate band
+    if degen_thr is None:
+        return []
+
+    close = np.diff(w, axis=1) < degen_thr
+    groups = []
+    for (ikpt, ibnd) in zip(*np.nonzero(close & ~np.pad(close, ((0, 0), (1, 0)))[:, :-1])):
+        stop = ibnd + 1
+        while stop < close.shape[1] and close[ikpt, stop]:
+            stop += 1
+        groups.append((int(ikpt), int(ibnd), int(stop)+1))
+
+    return groups
+
+
+def _band_derivatives(fsum, kpoints, Rcart, order, degen_thr):
+    (hk, *dhk) = fsum.derivatives(kpoints, Rcart, order)
+    (w, v) = np.linalg.eigh(hk)
+    vh = v.conj().swapaxes(-1, -2)
+
+    # dH/dk_a in the eigenbasis
+    dh = np.matmul(np.matmul(vh[:, np.newaxis], dhk[0]), v[:, np.newaxis])
+    vel = np.diagonal(dh, axis1=2, axis2=3).real.swapaxes(1, 2).copy()
+
+    # within degenerate subspaces, the derivatives are the eigenvalues of
+    # dH/dk_a restricted to the subspace, for each direction separately
+    groups = _degenerate_groups(w, degen_thr)
+    for (ikpt, start, stop) in groups:
+        vel[ikpt, start:stop] = np.linalg.eigvalsh(dh[ikpt, :, start:stop, start:stop]).T
+
+    if order == 1:
+        return w, vel
+
+    # second-order perturbation theory, excluding degenerate bands
+    de = w[:, :, np.newaxis] - w[:, np.newaxis, :]
+    with np.errstate(divide='ignore'):
+        inv_de = np.where(np.abs(de) < (degen_thr or 0) + np.finfo(float).tiny, 0, 1 / de)
+    d2h = np.matmul(np.matmul(vh[:, np.newaxis, np.newaxis], dhk[1]), v[:, np.newaxis, np.newaxis])
+    d2e = np.diagonal(d2h, axis1=3, axis2=4).real.transpose((0, 3, 1, 2))
+    d2e = d2e + 2 * np.einsum('kanm,kbmn,knm->knab', dh, dh, inv_de).real
+
+    return w, vel, d2e
+
+
+def velocities(hr, Rvectors, Rweights, kpoints, dlv, degen_thr=1e-4, dtype=complex, memory=None, workers=None):
+    """
+    Interpolate the band energies and their first derivatives with respect to
+    :math:`\\mathbf{k}`
+
+    The derivatives of the Hamiltonian,
+    :math:`\\partial_a H(\\mathbf{k}) = \\sum_\\mathbf{R} iR_a w_\\mathbf{R}
+    e^{2\\pi i\\mathbf{k}\\cdot\\mathbf{R}} H(\\mathbf{R})`, are interpolated
+    together with the Hamiltonian, using the same phases, and rotated into
+    the eigenbasis.
+
+    Parameters
+    ----------
+    hr : ndarray, shape (nrpts, nwann, nwann)
+        the Hamiltonian, in eV
+    Rvectors : ndarray, shape (nrpts, 3)
+        lattice vectors, in crystal coordinates
+    Rweights : ndarray, shape (nrpts,)
+    kpoints : ndarray, shape (nkpts, 3)
+        k-points, in crystal coordinates
+    dlv : ndarray, shape (3, 3)
+        direct lattice vectors, in Angstrom
+    degen_thr : float, optional
+        bands closer in energy than ``degen_thr`` are treated as degenerate,
+        and their derivatives are found by degenerate perturbation theory,
+        or None to use the diagonal of :math:`\\partial_a H` in the eigenbasis
+    dtype, memory, workers : optional
+        see :func:`hamiltonian`
+
+    Returns
+    -------
+    w : ndarray, shape (nkpts, nwann)
+        the band energies, in eV
+    v : ndarray, shape (nkpts, nwann, 3)
+        the derivatives :math:`\\partial E_n/\\partial k_a` with respect to the
+        Cartesian components of k, in eV Angstrom, as in the output of
+        ``geninterp``
+
+    """
+    kpoints = np.asarray(kpoints, dtype=float).reshape((-1, 3))
+    Rcart = np.dot(Rvectors, dlv)
+    fsum = _FourierSum(hr, Rvectors, Rweights, dtype)
+    nwann = fsum.shape[0]
+
+    w = np.empty((len(kpoints), nwann))
+    vel = np.empty((len(kpoints), nwann, 3))
+
+    def func(start, stop):
+        (w[start:stop], vel[start:stop]) = _band_derivatives(fsum, kpoints[start:stop], Rcart, 1, degen_thr)
+
+    _map_chunks(func, len(kpoints), fsum.chunk_size(nextra=12, memory=memory, workers=workers), workers)
+
+    return w, vel
+
+
+def inverse_effective_masses(hr, Rvectors, Rweights, kpoints, dlv, degen_thr=1e-4, dtype=complex, memory=None,
+                             workers=None):
+    """
+    Interpolate the band energies, their first derivatives, and the inverse
+    effective mass tensors
+
+    The second derivatives of the band energies are found by second-order
+    perturbation theory from the interpolated first and second derivatives of
+    the Hamiltonian, with the terms of bands degenerate within ``degen_thr``
+    left out.
+
+    Parameters
+    ----------
+    See :func:`velocities`.
+
+    Returns
+    -------
+    w : ndarray, shape (nkpts, nwann)
+        the band energies, in eV
+    v : ndarray, shape (nkpts, nwann, 3)
+        the derivatives :math:`\\partial E_n/\\partial k_a`, in eV Angstrom
+    minv : ndarray, shape (nkpts, nwann, 3, 3)
+        the inverse effective mass tensors
+        :math:`\\hbar^{-2}\\partial^2 E_n/\\partial k_a\\partial k_b`, in units of
+        the inverse electron mass
+
+    """
+    kpoints = np.asarray(kpoints, dtype=float).reshape((-1, 3))
+    Rcart = np.dot(Rvectors, dlv)
+    fsum = _FourierSum(hr, Rvectors, Rweights, dtype)
+    nwann = fsum.shape[0]
+
+    w = np.empty((len(kpoints), nwann))
+    vel = np.empty((len(kpoints), nwann, 3))
+    minv = np.empty((len(kpoints), nwann, 3, 3))
+
+    def func(start, stop):
+        (w[start:stop], vel[start:stop], d2e) = _band_derivatives(fsum, kpoints[start:stop], Rcart, 2, degen_thr)
+        minv[start:stop] = d2e / _HBAR2_ME
+
+    _map_chunks(func, len(kpoints), fsum.chunk_size(nextra=40, memory=memory, workers=workers), workers)
+
+    return w, vel, minv
+
+
+def hamiltonian_from_chk(chk, eig):
+    """
+    Compute the Hamiltonian in the Wannier representation from a checkpoint
+
+    The Hamiltonian :math:`U^{(\\mathbf{k})\\dagger}E^{(\\mathbf{k})}U^{(\\mathbf{k})}`
+    is computed for all k-points at once, with :math:`U^{(\\mathbf{k})}` the
+    product of the optimal subspace and the gauge for disentangled bands, and
+    Fourier transformed to the lattice vectors of the Wigner-Seitz supercell,
+    as in wannier90.
+
+    Parameters
+    ----------
+    chk : CheckpointIO
+    eig : ndarray, shape (nkpts, nbnds)
+        the band energies, excluding the bands excluded in the checkpoint
+
+    Returns
+    -------
+    hr : ndarray, shape (nrpts, nwann, nwann)
+    Rvectors : ndarray, shape (nrpts, 3)
+    Rweights : ndarray, shape (nrpts,)
+        the same as returned by :func:`w90utils.io.read_hr`
+
+    """
+    umn = chk.umat
+    if chk.disentanglement:
+        # expand the rows of the optimal subspace for the bands inside the
+        # window to the full band basis
+        (nkpts, nbnds, nwann) = chk.umat_opt.shape
+        umat_opt = np.zeros((nkpts, nbnds, nwann), dtype=complex)
+        rows = np.arange(nbnds) < np.sum(chk.windows, axis=1)[:, np.newaxis]
+        umat_opt[chk.windows] = chk.umat_opt[rows]
+        umn = np.matmul(umat_opt, umn)
+
+    hk = np.matmul(umn.conj().swapaxes(1, 2) * eig[:, np.newaxis, :], umn)
+
+    (Rvectors, ndegen) = wigner_seitz(chk.grid_dims, chk.dlv)
+
+    phases = np.exp(-2j*np.pi*np.dot(Rvectors, chk.kpoints.T)) / len(hk)
+    hr = np.dot(phases, hk.reshape((len(hk), -1))).reshape((len(Rvectors),) + hk.shape[1:])
+
+    return hr, Rvectors, 1 / ndegen
+
+
+def position_matrix(mmn, bvectors, bweights, Rvectors, kpoints):
+    """
+    Compute the position operator in the Wannier representation
+
+    The matrix elements :math:`\\mathbf{r}_{mn}(\\mathbf{k})` are computed
+    from the overlap matrices in the gauge of the Wannier functions, for all
+    k-points at once, as in wannier90,
+
+    .. math::
+
+        \\mathbf{r}_{mn}(\\mathbf{k}) = \\begin{cases}
+            -\\sum_\\mathbf{b} w_b \\mathbf{b}\\,\\mathrm{Im}\\ln M_{nn}^{(\\mathbf{k},\\mathbf{b})} & m = n \\\\
+            i\\sum_\\mathbf{b} w_b \\mathbf{b}\\,M_{mn}^{(\\mathbf{k},\\mathbf{b})} & m \\neq n
+        \\end{cases}
+
+    and Fourier transformed to
+    :math:`\\langle\\mathbf{0}m|\\mathbf{r}|\\mathbf{R}n\\rangle = \\frac{1}{N}
+    \\sum_\\mathbf{k} e^{-2\\pi i\\mathbf{k}\\cdot\\mathbf{R}}
+    \\mathbf{r}_{mn}(\\mathbf{k})`.
+
+    Parameters
+    ----------
+    mmn : ndarray, shape (nkpts, nntot, nwann, nwann)
+        the overlap matrices in the gauge of the Wannier functions, as returned
+        by :func:`w90utils.rotate_mmn`
+    bvectors : ndarray, shape (nkpts, nntot, 3)
+    bweights : ndarray, shape (nntot,)
+    Rvectors : ndarray, shape (nrpts, 3)
+        lattice vectors, in crystal coordinates, for example from
+        :func:`w90utils.ws.wigner_seitz`
+    kpoints : ndarray, shape (nkpts, 3)
+        k-points, in crystal coordinates
+
+    Returns
+    -------
+    rr : ndarray, shape (nrpts, nwann, nwann, 3)
+        in the units of ``1/bvectors``
+
+    """
+    (nkpts, nntot, nwann, _) = mmn.shape
+    wb = np.broadcast_to(bweights, (nkpts, nntot))[:, :, np.newaxis] * np.asarray(bvectors)
+
+    mii = mmn.diagonal(axis1=2, axis2=3)
+    rk = 1j * np.einsum('kbi,kbmn->kmni', wb, mmn)
+    idx = np.arange(nwann)
+    rk[:, idx, idx, :] = -1 * np.einsum('kbi,kbn->kni', wb, np.imag(np.log(mii)))
+
+    phases = np.exp(-2j*np.pi*np.dot(Rvectors, np.transpose(kpoints))) / nkpts
+    rr = np.dot(phases, rk.reshape((nkpts, -1)))
+
+    return rr.reshape((len(Rvectors), nwann, nwann, 3))
+
+
+def position(rr, Rvectors, Rweights, kpoints, dtype=complex, memory=None, workers=None):
+    """
+    Interpolate the position operator at arbitrary k-points
+
+    Parameters
+    ----------
+    rr : ndarray, shape (nrpts, nwann, nwann, 3)
+        as returned by :func:`position_matrix` or :func:`w90utils.io.read_r`
+    Rvectors : ndarray, shape (nrpts, 3)
+    Rweights : ndarray, shape (nrpts,)
+    kpoints : ndarray, shape (nkpts, 3)
+    dtype : dtype, optional
+    memory : int, optional
+    workers : int, optional
+
+    Returns
+    -------
+    ndarray, shape (nkpts, nwann, nwann, 3)
+
+    """
+    kpoints = np.asarray(kpoints, dtype=float).reshape((-1, 3))
+
+    fsum = _FourierSum(rr, Rvectors, Rweights, dtype)
+
+    rk = np.empty((len(kpoints),) + fsum.shape, dtype=fsum.dtype)
+
+    def func(start, stop):
+        fsum(kpoints[start:stop], out=rk[start:stop])
+
+    _map_chunks(func, len(kpoints), fsum.chunk_size(memory=memory, workers=workers), workers)
+
+    return rk
@@ -1,9 +1,23 @@
+import concurrent.futures
+import os
+
 import numpy as np
 
+from ..orbitals import radial
+from ..orbitals import trial_orbital
+from ._unk import _read_header as _read_unk_header
+from ._unk import read_unk
+from .cache import cached
+
+
+__all__ = ['read_amn', 'write_amn', 'compute_amn']
 
-__all__ = ['read_amn', 'write_amn']
 
+# approximate number of values of the trial orbitals evaluated at a time
+_CHUNK_VALUES = 2**22
 
+
+@cached()
 def read_amn(fname):
     """
     Read AMN file.
@@ -48,3 +62,180 @@ def write_amn(fname, amn, header='HEADER'):
         print(header, file=f)
         print('%13d%13d%13d' % (nbnds, nkpts, nproj), file=f)
         np.savetxt(f, data_out, fmt='%5d%5d%5d%18.12f%18.12f')
+
+
+def _cutoff_radius(ir, zona, tol):
+    # the radius outside of which the fraction tol of the integral of the
+    # magnitude of the radial part lies
+    r = np.linspace(0, 60 * ir / zona, 6001)
+    weights = r**2 * np.abs(radial(r, zona, ir))
+    tail = np.cumsum(weights[::-1])[::-1]
+
+    return r[np.argmax(tail <= tol * tail[0])]
+
+
+def _validate_projections(projections):
+    # the projections of an NNKP or WIN file, with the trial orbitals that
+    # compute_amn supports
+    for (iproj, proj) in enumerate(projections, 1):
+        if proj.get('spin') is not None:
+            raise ValueError('projection %d is a spinor projection, which is not supported' % iproj)
+        if proj['r'] not in (1, 2, 3):
+            raise ValueError('projection %d has an unknown radial function: %d' % (iproj, proj['r']))
+        if not proj['zona'] > 0:
+            raise ValueError('projection %d has a non-positive zona: %g' % (iproj, proj['zona']))
+        try:
+            if proj['mr'] < 1:
+                raise IndexError
+            trial_orbital(np.zeros((1, 3)), proj['l'], proj['mr'])
+        except (IndexError, ValueError):
+            raise ValueError('projection %d has an unknown orbital: l=%d, mr=%d' % (iproj, proj['l'], proj['mr']))
+
+
+def _bloch_sums(projections, dlv, grid, kpoints, tol):
+    # sum_R exp(-ik.R) g_n(r+R) on the grid of the unit cell, as the real and
+    # imaginary parts, for the unit cells R that the trial orbitals overlap;
+    # the orbitals are evaluated a chunk of unit cells at a time, and each
+    # chunk is added to the sums of all the k-points at once
+    dlv = np.asarray(dlv, dtype=float)
+    points_cart = np.dot(np.indices(grid).reshape((3, -1)).T / grid, dlv)
+    (nkpts, ngtot, nproj) = (len(kpoints), len(points_cart), len(projections))
+
+    radii = np.array([_cutoff_radius(proj['r'], proj['zona'], tol) for proj in projections])
+    cell_radius = np.max(np.linalg.norm(np.dot(np.indices((2, 2, 2)).reshape((3, -1)).T - 0.5, dlv), axis=1))
+    spacing = 1 / np.linalg.norm(np.linalg.inv(dlv), axis=0)
+    nmax = np.ceil((np.max(radii) + cell_radius) / spacing).astype(int) + 1
+    cells = np.indices(2*nmax + 1).reshape((3, -1)).T - nmax
+
+    # the unit cells that each trial orbital overlaps
+    centers = np.array([proj['center'] for proj in projections], dtype=float)
+    dist = np.linalg.norm(np.dot(cells[:, np.newaxis, :] + 0.5 - centers, dlv), axis=2)
+    overlaps = dist <= radii + cell_radius
+    (cells, overlaps) = (cells[np.any(overlaps, axis=1)], overlaps[np.any(overlaps, axis=1)])
+
+    re = np.zeros((nkpts, ngtot*nproj))
+    im = np.zeros((nkpts, ngtot*nproj))
+    work = np.empty((nkpts, ngtot*nproj))
+    chunk_size = max(1, _CHUNK_VALUES // (ngtot*nproj))
+    orbitals = np.empty((chunk_size, ngtot, nproj))
+    for start in range(0, len(cells), chunk_size):
+        stop = min(start+chunk_size, len(cells))
+        xyz = np.dot(cells[start:stop], dlv)[:, np.newaxis, :] + points_cart
+        for (iproj, proj) in enumerate(projections):
+            if not np.any(overlaps[start:stop, iproj]):
+                orbitals[:(stop-start), :, iproj] = 0
+                continue
+            orbitals[:(stop-start), :, iproj] = trial_orbital(
+                xyz - np.dot(proj['center'], dlv), proj['l'], proj['mr'], proj['r'], proj['zona'],
+                proj['z-axis'], proj['x-axis'])
+
+        chunk = orbitals[:(stop-start)].reshape((stop-start, -1))
+        k_dot_R = 2*np.pi*np.dot(kpoints, cells[start:stop].T)
+        np.add(re, np.dot(np.cos(k_dot_R), chunk, out=work), out=re)
+        np.subtract(im, np.dot(np.sin(k_dot_R), chunk, out=work), out=im)
+
+    return re.reshape((nkpts, ngtot, nproj)), im.reshape((nkpts, ngtot, nproj))
+
+
+def compute_amn(unk_dir, projections, kpoints, dlv, fname=None, spin=1, tol=1e-6, memory=2**30, workers=None):
+    """
+    Compute :math:`A^{(\\mathbf{k})}_{mn}` from UNK files and trial orbitals
+
+    The projections :math:`\\langle\\psi_{m\\mathbf{k}}|g_n\\rangle` are
+    computed on the real-space grid of the ``UNKnnnnn.s`` files, with the trial
+    orbitals :math:`g_n` of :mod:`w90utils.orbitals` folded into the unit cell
+    as :math:`\\sum_\\mathbf{R}e^{-i\\mathbf{k}\\cdot(\\mathbf{r}+\\mathbf{R})}
+    g_n(\\mathbf{r}+\\mathbf{R})`. The trial orbitals are evaluated a chunk of
+    the unit cells they overlap at a time, and each chunk is added to the
+    Bloch sums of a batch of k-points as a matrix product, so that the memory
+    used is bounded by ``memory`` rather than by the number of unit cells.
+    The projections at each k-point are then one matrix product over the grid
+    for all bands and projections, and the k-points of a batch are processed
+    concurrently by ``workers`` threads.
+
+    The Bloch functions are taken to be normalized in the unit cell, so the
+    projections are comparable to those computed by ``pw2wannier90``, up to
+    the phases of the Bloch functions.
+
+    Parameters
+    ----------
+    unk_dir : str
+        directory of the ``UNKnnnnn.s`` files
+    projections : list of dict
+        as returned by :func:`w90utils.io.nnkp.read_projections` or
+        :func:`w90utils.io.win.read_projections`, with the centers in crystal
+        coordinates, and ``zona`` in inverse Angstrom
+    kpoints : ndarray, shape (nkpts, 3)
+        k-points, in crystal coordinates
+    dlv : ndarray, shape (3, 3)
+        direct lattice vectors, in Angstrom
+    fname : str, optional
+        if given, the projections are also written to this AMN file
+    spin : int, optional
+        the spin channel ``s`` in the names of the files
+    tol : float, optional
+        the trial orbitals are neglected beyond the radius outside of which
+        this fraction of the integral of the magnitude of their radial part
+        lies
+    memory : int, optional
+        bound in bytes on the memory of the Bloch sums of a batch of
+        k-points; the trial orbitals are evaluated once for each batch
+    workers : int, optional
+        number of threads processing k-points concurrently
+
+    Returns
+    -------
+    ndarray, shape (nkpts, nbnds, nproj)
+
+    Raises
+    ------
+    ValueError
+        if a projection is a spinor projection, which is not supported, or
+        has an unknown trial orbital
+
+    """
+    _validate_projections(projections)
+
+    kpoints = np.asarray(kpoints, dtype=float)
+    nkpts = len(kpoints)
+    nproj = len(projections)
+
+    def unk_fname(ikpt):
+        return os.path.join(unk_dir, 'UNK%05d.%d' % (ikpt+1, spin))
+
+    (grid, _, nbnds) = _read_unk_header(unk_fname(0))
+    ngtot = int(np.prod(grid))
+    points = np.indices(grid).reshape((3, -1)).T / grid
+
+    # the UNK files are read normalized on the grid, so the integral over the
+    # unit cell is a sum over the grid times sqrt(dV)
+    scale = np.sqrt(abs(np.linalg.det(dlv)) / ngtot)
+
+    # the real and imaginary parts of the Bloch sums, and the product of a
+    # chunk with the phases
+    per_kpoint = 3 * ngtot * nproj * np.dtype(float).itemsize
+    batch_size = max(1, min(nkpts, memory // per_kpoint))
+
+    amn = np.empty((nkpts, nbnds, nproj), dtype=complex)
+    for kstart in range(0, nkpts, batch_size):
+        kstop = min(kstart+batch_size, nkpts)
+        (re, im) = _bloch_sums(projections, dlv, grid, kpoints[kstart:kstop], tol)
+
+        def project(ikpt):
+            unk = read_unk(unk_fname(ikpt)).reshape((nbnds, ngtot))
+            phase = scale * np.exp(-2j*np.pi*np.dot(points, kpoints[ikpt]))
+            bloch = (re[ikpt-kstart] + 1j*im[ikpt-kstart]) * phase[:, np.newaxis]
+            np.dot(unk.conj(), bloch, out=amn[ikpt])
+
+        if workers is None or workers == 1:
+            for ikpt in range(kstart, kstop):
+                project(ikpt)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                for future in [executor.submit(project, ikpt) for ikpt in range(kstart, kstop)]:
+                    future.result()
+
+    if fname is not None:
+        write_amn(fname, amn)
+
+    return amn
@@ -1,44 +1,206 @@
 import contextlib
 import io as StringIO
+import os
+import tempfile
 
 import numpy as np
-from scipy.io import FortranFile
 
 
 __all__ = ['CheckpointIO']
 
 
+# dtype of the record markers, as written by gfortran and read by
+# scipy.io.FortranFile by default
+_MARKER = np.dtype(np.uint32)
+
+# the records of the checkpoint file, in order, with their kind
+_RECORDS_HEAD = [
+    ('header', 'c'), ('nbnds', 'i'), ('nbnds_excl', 'i'), ('bands_excl', 'i'), ('dlv', 'd'), ('rlv', 'd'),
+    ('nkpts', 'i'), ('grid_dims', 'i'), ('kpoints', 'd'), ('nntot', 'i'), ('nwann', 'i'), ('chkpt', 'c'),
+    ('disentanglement', 'i'),
+]
+_RECORDS_DIS = [('omega_invariant', 'd'), ('windows', 'i'), ('ndimwin', 'i'), ('umat_opt', 'z')]
+_RECORDS_TAIL = [('umat', 'z'), ('mmat', 'z'), ('wannier_centers', 'd'), ('wannier_spreads', 'd')]
+
+_DTYPES = {'c': np.dtype('S1'), 'i': np.dtype(np.int32), 'd': np.dtype(np.float64), 'z': np.dtype(np.complex128)}
+
+# the length of the character records, for checkpoints not read from a file
+_CHARS = {'header': 33, 'chkpt': 20}
+
+
+def _index_records(fname):
+    # (offset, nbytes) of the data of each record
+    records = []
+    with open(fname, 'rb') as f:
+        while True:
+            head = f.read(_MARKER.itemsize)
+            if not head:
+                break
+            nbytes = int(np.frombuffer(head, dtype=_MARKER)[0])
+            offset = f.tell()
+            f.seek(nbytes, 1)
+            tail = f.read(_MARKER.itemsize)
+            if len(tail) != _MARKER.itemsize or int(np.frombuffer(tail, dtype=_MARKER)[0]) != nbytes:
+                raise IOError('%s is not a valid checkpoint file' % fname)
+            records.append((offset, nbytes))
+
+    return records
+
+
+class _lazy_record(object):
+    # decoded from the memory-mapped file on first access, and then stored in
+    # the instance, like functools.cached_property of Python 3.8
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.name] = obj._decode(self.name)
+        return value
+
+
 class CheckpointIO(object):
+    """
+    The wannier90 checkpoint file
+
+    The records of the file are indexed when it is read, and only the small
+    records are decoded right away. The large arrays, ``windows``,
+    ``umat_opt``, ``umat``, ``mmat``, and the centers and spreads, are
+    decoded on first access from the memory-mapped file, as copy-on-write
+    views, so that the file is never loaded into memory as a whole.
+
+    """
+    windows = _lazy_record('windows')
+    umat_opt = _lazy_record('umat_opt')
+    umat = _lazy_record('umat')
+    mmat = _lazy_record('mmat')
+    wannier_centers = _lazy_record('wannier_centers')
+    wannier_spreads = _lazy_record('wannier_spreads')
+
     def __init__(self, fname=None, auto_read=True):
+        self._buffer = None
+        self._records = {}
+        self._extra = []
         if fname and auto_read:
             self.from_file(fname)
 
+    def _raw(self, name):
+        (offset, nbytes) = self._records[name]
+        return self._buffer[offset:(offset+nbytes)]
+
+    def _values(self, name, kind):
+        return self._raw(name).view(_DTYPES[kind])
+
+    def _decode(self, name):
+        if name not in self._records:
+            raise AttributeError(name)
+
+        if name == 'windows':
+            return self._values(name, 'i').reshape((self.nbnds, self.nkpts), order='F').T.astype(bool)
+        elif name == 'umat_opt':
+            return np.transpose(self._values(name, 'z').reshape((self.nbnds, self.nwann, self.nkpts), order='F'), axes=(2, 0, 1))
+        elif name == 'umat':
+            return np.transpose(self._values(name, 'z').reshape((self.nwann, self.nwann, self.nkpts), order='F'), axes=(2, 0, 1))
+        elif name == 'mmat':
+            mmat = self._values(name, 'z').reshape((self.nwann, self.nwann, self.nntot, self.nkpts), order='F')
+            return np.transpose(mmat, axes=(3, 2, 0, 1))
+        elif name == 'wannier_centers':
+            return self._values(name, 'd').reshape((-1, 3))
+        elif name == 'wannier_spreads':
+            return self._values(name, 'd')
+
+    def _encode(self, name, kind):
+        value = getattr(self, name)
+
+        if kind == 'c':
+            nbytes = self._records[name][1] if name in self._records else _CHARS[name]
+            return value.ljust(nbytes).encode('ascii')
+
+        # the arrays in the layout of wannier90
+        if name in ('kpoints', 'windows', 'wannier_centers'):
+            value = np.transpose(value)
+        elif name in ('umat_opt', 'umat'):
+            value = np.transpose(value, axes=(1, 2, 0))
+        elif name == 'mmat':
+            value = np.transpose(value, axes=(2, 3, 1, 0))
+
+        return np.ravel(value, order='F').astype(_DTYPES[kind]).tobytes()
+
     def from_file(self, fname):
-        with FortranFile(fname, 'r') as f:
-            self.header = ''.join(map(str, f.read_record('c')))
-            self.nbnds = f.read_ints()[0]
-            self.nbnds_excl = f.read_ints()[0]
-            self.bands_excl = f.read_ints()
-            self.dlv = f.read_reals().reshape((3, 3), order='F')
-            self.rlv = f.read_reals().reshape((3, 3), order='F')
-            self.nkpts = f.read_ints()[0]
-            self.grid_dims = f.read_ints()
-            self.kpoints = f.read_reals().reshape((-1, 3))
-            self.nntot = f.read_ints()[0]
-            self.nwann = f.read_ints()[0]
-            self.chkpt = f.read_record('c')
-            self.disentanglement = bool(f.read_ints()[0])
-
-            if self.disentanglement:
-                self.omega_invariant = f.read_reals()[0]
-                self.windows = f.read_ints().reshape((self.nbnds, self.nkpts), order='F').transpose
-                f.read_ints()
-                self.umat_opt = np.transpose(f.read_reals().view(complex).reshape((self.nbnds, self.nwann, self.nkpts), order='F'), axes=(2, 0, 1))
-
-            self.umat = np.transpose(f.read_reals().view(complex).reshape((self.nwann, self.nwann, self.nkpts), order='F'), axes=(2, 0, 1))
-            self.mmat = np.transpose(f.read_reals().view(complex).reshape((self.nwann, self.nwann, self.nntot, self.nkpts), order='F'), axes=(3, 2, 0, 1))
-            self.wannier_centers = f.read_reals().reshape((-1, 3))
-            self.wannier_spreads = f.read_reals()
+        records = _index_records(fname)
+        self._buffer = np.memmap(fname, dtype=np.uint8, mode='c').view(np.ndarray)
+
+        names = list(_RECORDS_HEAD)
+        self._records = dict(zip([name for (name, _) in names], records))
+        self.disentanglement = bool(self._values('disentanglement', 'i')[0])
+        if self.disentanglement:
+            names += _RECORDS_DIS
+        names += _RECORDS_TAIL
+        self._records = dict(zip([name for (name, _) in names], records))
+        self._extra = records[len(names):]
+
+        # forget the records decoded from a previous file
+        for name in ['windows', 'umat_opt', 'umat', 'mmat', 'wannier_centers', 'wannier_spreads']:
+            self.__dict__.pop(name, None)
+
+        self.header = self._raw('header').tobytes().decode('ascii').rstrip()
+        self.nbnds = int(self._values('nbnds', 'i')[0])
+        self.nbnds_excl = int(self._values('nbnds_excl', 'i')[0])
+        self.bands_excl = np.array(self._values('bands_excl', 'i'))
+        self.dlv = np.array(self._values('dlv', 'd').reshape((3, 3), order='F'))
+        self.rlv = np.array(self._values('rlv', 'd').reshape((3, 3), order='F'))
+        self.nkpts = int(self._values('nkpts', 'i')[0])
+        self.grid_dims = np.array(self._values('grid_dims', 'i'))
+        self.kpoints = np.array(self._values('kpoints', 'd').reshape((-1, 3)))
+        self.nntot = int(self._values('nntot', 'i')[0])
+        self.nwann = int(self._values('nwann', 'i')[0])
+        self.chkpt = self._raw('chkpt').tobytes().decode('ascii').rstrip()
+
+        if self.disentanglement:
+            self.omega_invariant = float(self._values('omega_invariant', 'd')[0])
+            self.ndimwin = np.array(self._values('ndimwin', 'i'))
+
+    def to_file(self, fname):
+        """
+        Write the checkpoint file
+
+        The records that were never decoded are copied from the file that was
+        read, so that a checkpoint written without changes is identical to
+        the original, byte for byte.
+
+        Parameters
+        ----------
+        fname : str
+
+        """
+        names = list(_RECORDS_HEAD)
+        if self.disentanglement:
+            names += _RECORDS_DIS
+        names += _RECORDS_TAIL
+
+        # the records are copied from the memory-mapped file, which may be the
+        # file that is written, so they are written to a temporary file that
+        # then replaces it
+        (fd, tmp_fname) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fname)), prefix='.chk')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for (name, kind) in names:
+                    lazy = name in type(self).__dict__
+                    if lazy and name not in self.__dict__ and name in self._records:
+                        data = self._raw(name).tobytes()
+                    else:
+                        data = self._encode(name, kind)
+                    marker = np.array([len(data)], dtype=_MARKER).tobytes()
+                    f.write(marker + data + marker)
+                for (offset, nbytes) in self._extra:
+                    marker = np.array([nbytes], dtype=_MARKER).tobytes()
+                    f.write(marker + self._buffer[offset:(offset+nbytes)].tobytes() + marker)
+            os.chmod(tmp_fname, os.stat(fname).st_mode if os.path.exists(fname) else 0o644)
+            os.replace(tmp_fname, fname)
+        except BaseException:
+            os.remove(tmp_fname)
+            raise
 
     def __str__(self):
         with contextlib.closing(StringIO.StringIO()) as sio:
@@ -0,0 +1,296 @@
+import collections.abc
+import concurrent.futures
+import functools
+import sys
+
+import numpy as np
+
+from . import _utils
+from . import cache
+from . import nnkp
+from ._amn import read_amn
+from ._eig import read_eig
+from ._mmn import read_mmn
+
+
+__all__ = ['Wannier90Data', 'read_data']
+
+
+class Wannier90Data(collections.abc.Sequence):
+    """
+    Wannier90 input data, with each field loaded the first time it is accessed
+
+    Fields are accessed as attributes, and the object behaves as the tuple of
+    the fields in the order of ``Wannier90Data._fields``, like the namedtuple
+    it replaces: it can be indexed, sliced, iterated over and unpacked, and has
+    the ``_fields``, ``_make``, ``_asdict``, and ``_replace`` of a namedtuple.
+    Iterating over the object, or indexing it, loads the fields that are
+    accessed.
+
+    The object can be pickled, with the fields that are loaded, and the others
+    are loaded from the files when they are first accessed after unpickling.
+
+    Parameters
+    ----------
+    loaders : dict, optional
+        functions that take this object and return the value of a field; they
+        must be picklable for the object to be picklable
+    **values
+        values of fields that are known in advance
+
+    """
+    _fields = (
+        'dlv', 'rlv',
+        'amn', 'mmn', 'eig',
+        'kpoints', 'kpb_kidx', 'kpb_g',
+        'bv', 'bw',
+        'length_unit', 'energy_unit',
+    )
+
+    def __init__(self, loaders=None, **values):
+        unknown = (set(values) | set(loaders or {})) - set(self._fields)
+        if unknown:
+            raise TypeError('unknown fields: %s' % ', '.join(sorted(unknown)))
+        self._loaders = dict(loaders or {})
+        self._values = values
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self._fields:
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        try:
+            loader = self._loaders[name]
+        except KeyError:
+            raise AttributeError('field "%s" has been released and cannot be reloaded' % name)
+        value = self._values[name] = loader(self)
+
+        return value
+
+    def is_loaded(self, name):
+        return name in self._values
+
+    def release(self, *names):
+        """
+        Release fields, for example to free the memory of ``mmn``
+
+        Fields with a loader, which are those that ``read_data`` reads from
+        files, are read from disk again on the next access, so they reflect
+        any change to the files in the meantime. Fields without a loader,
+        such as those given as values, cannot be accessed after they are
+        released.
+
+        """
+        for name in names:
+            if name not in self._fields:
+                raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+            self._values.pop(name, None)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self._fields)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return tuple(getattr(self, name) for name in self._fields[idx])
+        return getattr(self, self._fields[idx])
+
+    @classmethod
+    def _make(cls, iterable):
+        values = tuple(iterable)
+        if len(values) != len(cls._fields):
+            raise TypeError('expected %d arguments, got %d' % (len(cls._fields), len(values)))
+        return cls(**dict(zip(cls._fields, values)))
+
+    def _asdict(self):
+        return {name: getattr(self, name) for name in self._fields}
+
+    def _replace(self, **values):
+        # the replaced fields are not reloaded from the files when released
+        loaders = {name: loader for (name, loader) in self._loaders.items() if name not in values}
+        data = Wannier90Data(loaders=loaders, **self._values)
+        data._values.update(values)
+        return data
+
+    def __repr__(self):
+        fields = ', '.join('%s=%s' % (name, ('<loaded>' if self.is_loaded(name) else '<not loaded>')) for name in self._fields)
+        return '%s(%s)' % (type(self).__name__, fields)
+
+
+# the loaders of read_data, which are module-level functions so that the data
+# can be pickled
+def _from_file(reader, fname, data, **kwargs):
+    return reader(fname, **kwargs)
+
+
+def _from_nnkpts(fname, idx, data):
+    return nnkp.read_nnkpts(fname)[idx]
+
+
+def _bweights(data):
+    return _utils.bweights(data.bv)
+
+
+_readers = {
+    'amn': read_amn,
+    'mmn': read_mmn,
+    'eig': read_eig,
+}
+
+
+def _read_nnkp(fname):
+    kpb_kidx, kpb_g = nnkp.read_nnkpts(fname)
+    return {
+        'dlv': nnkp.read_dlv(fname, units='angstrom'),
+        'rlv': nnkp.read_rlv(fname, units='angstrom'),
+        'kpoints': nnkp.read_kpoints(fname),
+        'kpb_kidx': kpb_kidx,
+        'kpb_g': kpb_g,
+        'bv': nnkp.read_bvectors(fname, units='angstrom'),
+    }
+
+
+def _read_to_shared_memory(name, fname, cache_settings):
+    # runs in a worker process, and returns the array in a shared memory block
+    # so that it is not pickled on the way back; the parent process owns the
+    # block from then on, and unlinks it
+    from multiprocessing import shared_memory
+
+    cache._settings.update(cache_settings)
+    a = np.ascontiguousarray(_readers[name](fname))
+    shm = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+    try:
+        np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)[...] = a
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    shm.close()
+
+    return shm.name, a.shape, a.dtype.str
+
+
+def _from_shared_memory(shm_name, shape, dtype):
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        a = np.array(np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    finally:
+        shm.close()
+
+    return a
+
+
+def _unlink_shared_memory(shm_name):
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    shm.close()
+    shm.unlink()
+
+
+def _load_concurrently(data, seedname, workers, processes):
+    names = [name for name in _readers if not data.is_loaded(name)]
+    nnkp_names = [name for name in ['dlv', 'rlv', 'kpoints', 'kpb_kidx', 'kpb_g', 'bv'] if not data.is_loaded(name)]
+
+    if processes:
+        # the workers share the resource tracker of this process, which then
+        # tracks the blocks they create until they are unlinked here
+        from multiprocessing import resource_tracker
+        resource_tracker.ensure_running()
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    # all the files are read before any result is collected, so that the
+    # shared memory blocks of all the workers are unlinked even if one fails
+    with executor:
+        futures = {}
+        for name in names:
+            if processes:
+                futures[name] = executor.submit(_read_to_shared_memory, name, seedname+'.'+name, dict(cache._settings))
+            else:
+                futures[name] = executor.submit(_readers[name], seedname+'.'+name)
+        if nnkp_names:
+            futures['nnkp'] = executor.submit(_read_nnkp, seedname+'.nnkp')
+
+    try:
+        values = {}
+        for (name, future) in futures.items():
+            if name == 'nnkp':
+                nnkp_values = future.result()
+                values.update({key: nnkp_values[key] for key in nnkp_names})
+            elif processes:
+                values[name] = _from_shared_memory(*future.result())
+            else:
+                values[name] = future.result()
+    finally:
+        if processes:
+            for name in names:
+                if futures[name].exception() is None:
+                    _unlink_shared_memory(futures[name].result()[0])
+
+    data._values.update(values)
+
+
+def read_data(seedname='wannier', workers=None, processes=False, **kwargs):
+    """
+    Read all Wannier90 input data files from the current directory.
+
+    Each field is read only when it is first accessed, unless given as a
+    keyword argument, or unless ``workers`` is given, in which case the AMN,
+    MMN, EIG, and NNKP files are read concurrently before returning.
+
+    Parameters
+    ----------
+    seedname : str, optional
+        seedname for the Wannier90 files, the default is "wannier"
+    workers : int, optional
+        number of workers used to read the files concurrently
+    processes : bool, optional
+        read the files in worker processes instead of threads; the arrays are
+        passed back through shared memory rather than pickled, which requires
+        Python 3.8 or later, and a RuntimeError is raised otherwise
+
+    Returns
+    -------
+    Wannier90Data
+
+    """
+    if processes and sys.version_info < (3, 8):
+        raise RuntimeError('reading the files in worker processes requires Python 3.8 or later')
+
+    nnkp_fname = seedname + '.nnkp'
+
+    loaders = {
+        'dlv': functools.partial(_from_file, nnkp.read_dlv, nnkp_fname, units='angstrom'),
+        'rlv': functools.partial(_from_file, nnkp.read_rlv, nnkp_fname, units='angstrom'),
+        'amn': functools.partial(_from_file, read_amn, seedname+'.amn'),
+        'mmn': functools.partial(_from_file, read_mmn, seedname+'.mmn'),
+        'eig': functools.partial(_from_file, read_eig, seedname+'.eig'),
+        'kpoints': functools.partial(_from_file, nnkp.read_kpoints, nnkp_fname),
+        'kpb_kidx': functools.partial(_from_nnkpts, nnkp_fname, 0),
+        'kpb_g': functools.partial(_from_nnkpts, nnkp_fname, 1),
+        'bv': functools.partial(_from_file, nnkp.read_bvectors, nnkp_fname, units='angstrom'),
+        'bw': _bweights,
+    }
+    # the fields given as values are not reloaded from the files when released
+    for name in kwargs:
+        loaders.pop(name, None)
+
+    data = Wannier90Data(
+        loaders=loaders,
+        length_unit='angstrom',
+        energy_unit='eV',
+        **kwargs)
+
+    if workers is not None:
+        _load_concurrently(data, seedname, workers, processes)
+
+    return data
@@ -1,9 +1,12 @@
 import numpy as np
 
+from .cache import cached
+
 
 __all__ = ['read_eig', 'write_eig', 'read_hamiltonian']
 
 
+@cached()
 def read_eig(fname):
     """
     Read EIG file.
@@ -0,0 +1,128 @@
+import numpy as np
+
+from . import _utils
+
+
+__all__ = ['write_xsf', 'write_cube']
+
+
+# number of values formatted at a time
+_CHUNK_VALUES = 2**18
+
+
+def _write_values(f, values, nvalues_per_line, fmt):
+    # values in lines of nvalues_per_line, formatted a chunk of lines at a time
+    chunk_size = _CHUNK_VALUES - _CHUNK_VALUES % nvalues_per_line
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:(start+chunk_size)]
+        (nlines, nrest) = divmod(len(chunk), nvalues_per_line)
+        text = ((fmt * nvalues_per_line + '\n') * nlines + (fmt * nrest + '\n' if nrest else ''))
+        f.write(text % tuple(chunk.tolist()))
+
+
+def write_xsf(fname, data, origin, voxel, dlv=None, symbols=None, positions=None, comment=None):
+    """
+    Write volumetric data to an XCrySDen ``.xsf`` file
+
+    Parameters
+    ----------
+    fname : str
+    data : ndarray, shape (nx, ny, nz)
+        the real part is written
+    origin : ndarray, shape (3,)
+        the first point of the grid, in Angstrom
+    voxel : ndarray, shape (3, 3)
+        the steps between the points of the grid along each axis, in Angstrom,
+        for example from :func:`w90utils.plot.supercell_grid`
+    dlv : ndarray, shape (3, 3), optional
+        direct lattice vectors, in Angstrom, written as the crystal structure
+    symbols : list of str, optional
+    positions : ndarray, shape (natoms, 3), optional
+        positions of the atoms, in Angstrom
+    comment : str, optional
+
+    """
+    data = np.real(data)
+    voxel = np.asarray(voxel, dtype=float)
+    if symbols is None:
+        (symbols, positions) = ([], np.zeros((0, 3)))
+
+    with open(fname, 'w') as f:
+        if comment is not None:
+            print('# %s' % comment, file=f)
+        if dlv is not None:
+            print('CRYSTAL', file=f)
+            print('PRIMVEC', file=f)
+            for v in np.asarray(dlv):
+                print('%14.8f%14.8f%14.8f' % tuple(v), file=f)
+            print('PRIMCOORD', file=f)
+            print('%6d%6d' % (len(symbols), 1), file=f)
+        else:
+            print('ATOMS', file=f)
+        for (symbol, position) in zip(symbols, positions):
+            print('%-4s%14.8f%14.8f%14.8f' % ((symbol,) + tuple(position)), file=f)
+
+        print('', file=f)
+        print('BEGIN_BLOCK_DATAGRID_3D', file=f)
+        print('3D_field', file=f)
+        print('BEGIN_DATAGRID_3D_UNKNOWN', file=f)
+        print('%6d%6d%6d' % data.shape, file=f)
+        print('%14.8f%14.8f%14.8f' % tuple(origin), file=f)
+        # the grid is not periodic, so it spans one step less than the supercell
+        for (n, v) in zip(data.shape, voxel):
+            print('%14.8f%14.8f%14.8f' % tuple((n - 1) * v), file=f)
+        # the first index runs fastest
+        _write_values(f, data.ravel(order='F'), 6, '%13.5e')
+        print('END_DATAGRID_3D', file=f)
+        print('END_BLOCK_DATAGRID_3D', file=f)
+
+
+def write_cube(fname, data, origin, voxel, numbers=None, positions=None, comment=None):
+    """
+    Write volumetric data to a Gaussian ``.cube`` file
+
+    The lengths are converted to Bohr, as required by the format.
+
+    Parameters
+    ----------
+    fname : str
+    data : ndarray, shape (nx, ny, nz)
+        the real part is written
+    origin : ndarray, shape (3,)
+        the first point of the grid, in Angstrom
+    voxel : ndarray, shape (3, 3)
+        the steps between the points of the grid along each axis, in Angstrom,
+        for example from :func:`w90utils.plot.supercell_grid`
+    numbers : list of int, optional
+        atomic numbers of the atoms
+    positions : ndarray, shape (natoms, 3), optional
+        positions of the atoms, in Angstrom
+    comment : str, optional
+
+    """
+    data = np.real(data)
+    (nx, ny, nz) = data.shape
+    if numbers is None:
+        (numbers, positions) = ([], np.zeros((0, 3)))
+
+    origin = np.asarray(origin, dtype=float) * _utils.angstrom2bohr
+    voxel = np.asarray(voxel, dtype=float) * _utils.angstrom2bohr
+    positions = np.asarray(positions, dtype=float) * _utils.angstrom2bohr
+
+    with open(fname, 'w') as f:
+        print(comment if comment is not None else 'written by w90utils', file=f)
+        print('outer loop: x, middle loop: y, inner loop: z', file=f)
+        print('%5d%12.6f%12.6f%12.6f' % ((len(numbers),) + tuple(origin)), file=f)
+        for (n, v) in zip(data.shape, voxel):
+            print('%5d%12.6f%12.6f%12.6f' % ((n,) + tuple(v)), file=f)
+        for (number, position) in zip(numbers, positions):
+            print('%5d%12.6f%12.6f%12.6f%12.6f' % ((number, 0) + tuple(position)), file=f)
+
+        # the last index runs fastest, with the values for each (x, y) in
+        # lines of six
+        row_fmt = ''.join('%13.5E' + ('\n' if (i % 6 == 5 or i == nz-1) else '') for i in range(nz))
+        rows = data.reshape((nx*ny, nz))
+        chunk_size = max(1, _CHUNK_VALUES // nz)
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:(start+chunk_size)]
+            f.write((row_fmt * len(chunk)) % tuple(chunk.ravel().tolist()))
@@ -1,7 +1,13 @@
+import datetime
+
 import numpy as np
 
 
-__all__ = ['read_hr']
+__all__ = ['read_hr', 'write_hr', 'save_hr', 'load_hr']
+
+
+# number of lines formatted at a time by write_hr
+_CHUNK_LINES = 2**16
 
 
 def read_hr(fname):
@@ -32,3 +38,81 @@ def read_hr(fname):
     Rweights = 1 / rdegen
 
     return hr, Rvectors, Rweights
+
+
+def write_hr(fname, hr, Rvectors, Rweights, header=None):
+    """
+    Write the Hamiltonian in the Wannier representation to ``_hr.dat`` file
+
+    Parameters
+    ----------
+    fname : str
+    hr : ndarray, shape (nrpts, nwann, nwann)
+    Rvectors : ndarray, shape (nrpts, 3)
+    Rweights : ndarray, shape (nrpts,)
+        the inverse of the degeneracies of the lattice vectors, as returned by
+        :func:`read_hr`
+    header : str, optional
+
+    """
+    (nrpts, nwann, _) = np.shape(hr)
+    ndegen = np.rint(1 / np.asarray(Rweights)).astype(int)
+
+    if header is None:
+        header = ' written on %s' % datetime.datetime.now().strftime('%d%b%Y at %H:%M:%S')
+
+    # the row index runs fastest, followed by the column index
+    (irpt, icol, irow) = np.indices((nrpts, nwann, nwann)).reshape((3, -1))
+    data = np.empty((nrpts*nwann**2, 7))
+    data[:, :3] = np.asarray(Rvectors)[irpt]
+    data[:, 3] = irow + 1
+    data[:, 4] = icol + 1
+    data[:, 5:] = np.ascontiguousarray(np.transpose(hr, (0, 2, 1)), dtype=complex).view(float).reshape((-1, 2))
+
+    with open(fname, 'w') as f:
+        print(header, file=f)
+        print('%12d' % nwann, file=f)
+        print('%12d' % nrpts, file=f)
+        for start in range(0, nrpts, 15):
+            print(''.join('%5d' % n for n in ndegen[start:(start+15)]), file=f)
+        for start in range(0, len(data), _CHUNK_LINES):
+            chunk = data[start:(start+_CHUNK_LINES)]
+            f.write(('%5d%5d%5d%5d%5d%12.6f%12.6f\n' * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+
+def save_hr(fname, hr, Rvectors, Rweights):
+    """
+    Save the Hamiltonian in the Wannier representation in binary format
+
+    The arrays are saved without loss of precision in NumPy ``.npz`` format,
+    and are read back with :func:`load_hr`.
+
+    Parameters
+    ----------
+    fname : str
+    hr : ndarray, shape (nrpts, nwann, nwann)
+    Rvectors : ndarray, shape (nrpts, 3)
+    Rweights : ndarray, shape (nrpts,)
+
+    """
+    with open(fname, 'wb') as f:
+        np.savez(f, hr=hr, Rvectors=Rvectors, Rweights=Rweights)
+
+
+def load_hr(fname):
+    """
+    Load the Hamiltonian in the Wannier representation saved by :func:`save_hr`
+
+    Parameters
+    ----------
+    fname : str
+
+    Returns
+    -------
+    hr : ndarray, shape (nrpts, nwann, nwann)
+    Rvectors : ndarray, shape (nrpts, 3)
+    Rweights : ndarray, shape (nrpts,)
+
+    """
+    with np.load(fname) as data:
+        return data['hr'], data['Rvectors'], data['Rweights']
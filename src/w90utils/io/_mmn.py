@@ -1,61 +1,384 @@
+import collections
+import itertools
+import os
+import zipfile
+
 import numpy as np
 
+from ._unk import _read_header as _read_unk_header
+from ._unk import read_unk
+from .cache import cached
+
+
+__all__ = ['read_mmn', 'write_mmn', 'compute_mmn', 'iter_mmn_blocks', 'iter_mmn_chunks', 'MmnFile']
+
+
+# approximate number of lines of an MMN file that are tokenized at once
+_CHUNK_LINES = 2**14
+
+
+def _read_mmn_header(f):
+    header = f.readline()
+    [nbnds, nkpts, nntot] = np.fromstring(f.readline(), sep=' ', dtype=int)
+
+    return header, nbnds, nkpts, nntot
+
 
-__all__ = ['read_mmn', 'write_mmn']
+def iter_mmn_blocks(fname):
+    """
+    Iterate over the blocks of an MMN file, one block at a time
+
+    Only a single block is held in memory at any time, so this can be used to
+    process MMN files that are too large to be read in full.
 
+    Parameters
+    ----------
+    fname : str
 
-def _process_mmn_file(fname):
+    Yields
+    ------
+    ikpt : int
+        k-point index
+    inn : int
+        nearest-neighbor index
+    kpb_kidx : int
+        index of the k-point at k+b
+    kpb_g : ndarray, shape (3,)
+        reciprocal lattice vector that brings k+b into the first Brillouin zone
+    block : ndarray, shape (nbnds, nbnds)
+
+    """
     with open(fname, 'r') as f:
-        contents = f.readlines()
+        (_, nbnds, nkpts, nntot) = _read_mmn_header(f)
+        for ikpt in range(nkpts):
+            for inn in range(nntot):
+                block_header = f.readline().split()
+                kpb_kidx = int(block_header[1]) - 1
+                kpb_g = np.array(block_header[2:5], dtype=int)
+                s = ''.join(itertools.islice(f, nbnds**2))
+                block = np.fromstring(s, sep='\n').view(complex).reshape((nbnds, nbnds), order='F')
+                yield ikpt, inn, kpb_kidx, kpb_g, block
+
+
+def _fixed_width_layout(header_line, data_line):
+    # determine the layout of a block from its header and first data line, or
+    # return None if the data is not written with a fixed-point format such
+    # as the (2f18.12) of pw2wannier90
+    body = data_line[:-1]
+    if not data_line.endswith(b'\n') or not header_line.endswith(b'\n'):
+        return None
+
+    dots = [i for (i, c) in enumerate(body) if c == ord('.')]
+    if len(dots) != 2:
+        return None
+
+    fields = []
+    start = 0
+    for dot in dots:
+        stop = dot + 1
+        while stop < len(body) and body[stop:stop+1].isdigit():
+            stop += 1
+        (nint, ndec) = (dot - start, stop - dot - 1)
+        if not (0 < nint <= 8 and 0 < ndec <= 16 and nint + ndec <= 19):
+            return None
+        fields.append((start, dot, stop))
+        start = stop
+    if start != len(body):
+        return None
+
+    return len(header_line), len(data_line), fields
+
+
+_ASCII_ZEROS = np.uint64(0x3030303030303030)
+_ASCII_BLANKS = np.uint64(0x2020202020202020)
+_LOW_BITS = np.uint64(0x7F7F7F7F7F7F7F7F)
+_HIGH_BITS = np.uint64(0x8080808080808080)
+
+
+def _swar_keep(nchars):
+    # mask of the last nchars characters of 8-byte little-endian windows
+    return np.uint64((2**64 - 1) ^ (2**(8*(8-nchars)) - 1))
+
+
+def _swar_nondigits(d, out):
+    # flag, by the high bit, the bytes of d not less than 10, which is either
+    # set in d or by adding 0x76 to the rest, so that for d = c ^ '0' these
+    # are the characters c that are not digits
+    np.bitwise_and(d, _LOW_BITS, out=out)
+    np.add(out, np.uint64(0x7676767676767676), out=out)
+    np.bitwise_or(out, d, out=out)
+    np.bitwise_and(out, _HIGH_BITS, out=out)
+
+
+def _swar_integer_part(v, digits, sign, work):
+    # check that 8-byte little-endian windows padded with blanks are blanks,
+    # an optional sign, and at least one digit, in that order, returning False
+    # otherwise, and set the digit values, with zeros in place of the blanks
+    # and sign, in digits, and the sign bit of a float64 in sign
+    (other, tmp, w, top, is_blank, is_plus, is_minus) = work
+
+    np.bitwise_xor(v, _ASCII_ZEROS, out=digits)
+    _swar_nondigits(digits, other)
+
+    # the other characters are a prefix, and the last one is a digit
+    np.right_shift(other, np.uint64(63), out=w)
+    np.right_shift(other, np.uint64(7), out=other)
+    np.multiply(other, np.uint64(0xFF), out=other)
+    np.add(other, np.uint64(1), out=tmp)
+    np.bitwise_and(tmp, other, out=tmp)
+    np.bitwise_or(tmp, w, out=tmp)
+    if tmp.any():
+        return False
+
+    # the other characters are all blanks, except for a sign in the last one
+    np.bitwise_xor(v, _ASCII_BLANKS, out=w)
+    np.bitwise_and(w, other, out=w)
+    np.right_shift(other, np.uint64(8), out=top)
+    np.bitwise_xor(top, other, out=top)
+    np.bitwise_and(top, np.uint64(0x0B0B0B0B0B0B0B0B), out=tmp)
+    np.bitwise_and(top, np.uint64(0x0D0D0D0D0D0D0D0D), out=top)
+    np.equal(w, 0, out=is_blank)
+    np.equal(w, tmp, out=is_plus)
+    np.equal(w, top, out=is_minus)
+    np.logical_or(is_plus, is_blank, out=is_plus)
+    np.logical_or(is_plus, is_minus, out=is_plus)
+    if not is_plus.all():
+        return False
+    np.greater(is_minus, is_blank, out=is_minus)
+    np.multiply(is_minus, np.uint64(2**63), out=sign)
+
+    np.invert(other, out=other)
+    np.bitwise_and(digits, other, out=digits)
 
-    header = contents[0]
+    return True
 
-    [nbnds, nkpts, nntot] = np.fromstring(contents[1], sep=' ', dtype=int)
 
+def _swar_combine(v):
+    # combine 8-byte little-endian windows of digit values, most significant
+    # first, into integers in place, by adding each lane times 10**n to the
+    # next one, with n the number of digits per lane, and keeping every other
+    # lane, which cannot carry into its neighbours
+    for (shift, mask) in [(8, 0x00FF00FF00FF00FF), (16, 0x0000FFFF0000FFFF), (32, 0x00000000FFFFFFFF)]:
+        np.multiply(v, np.uint64(1 + (10**(shift//8) << shift)), out=v)
+        np.right_shift(v, np.uint64(shift), out=v)
+        if shift < 32:
+            np.bitwise_and(v, np.uint64(mask), out=v)
+
+
+def _swar_digits(v, nchars, work):
+    # convert the last nchars characters of 8-byte little-endian windows of
+    # ASCII digits to integers in place, returning False if any is not a digit
+    np.bitwise_xor(v, _ASCII_ZEROS, out=v)
+    if nchars < 8:
+        np.bitwise_and(v, _swar_keep(nchars), out=v)
+    _swar_nondigits(v, work)
+    if work.any():
+        return False
+    _swar_combine(v)
+
+    return True
+
+
+def _parse_fixed_width_chunk(buf, nblks, nbnds, layout, scratch):
+    # scratch is a (11, n) array of np.uint64 with n at least nblks*nbnds**2,
+    # which is reused between chunks to avoid touching fresh pages each time,
+    # and so the values returned are only valid until the next chunk
+    (hdr_len, line_len, fields) = layout
+    blk_len = hdr_len + nbnds**2 * line_len
+
+    def column(col, dtype=np.uint8):
+        return np.ndarray(
+            (nblks, nbnds**2), dtype=dtype, buffer=buf, offset=hdr_len+col, strides=(blk_len, line_len))
+
+    if hdr_len + fields[0][1] < 8:
+        return None
+    hdr_ends = np.ndarray((nblks,), dtype=np.uint8, buffer=buf, offset=hdr_len-1, strides=(blk_len,))
+    if not (np.all(hdr_ends == ord('\n')) and np.all(column(line_len-1) == ord('\n'))):
+        return None
+
+    size = nblks * nbnds**2
+    rows = [a[:size].reshape((nblks, nbnds**2)) for a in scratch]
+    (mantissa, sign, v, work) = rows[:4]
+    checks = rows[4:8] + [a[:size].reshape((nblks, nbnds**2)) for a in scratch[8].view(bool).reshape((8, -1))[:3]]
+    values = [x.view(np.float64) for x in rows[9:]]
+
+    for ((start, dot, stop), x) in zip(fields, values):
+        if not np.all(column(dot) == ord('.')):
+            return None
+
+        # the integer part, in the window ending at the point, is validated,
+        # and any other layout is left to the tokenizer
+        v[...] = column(dot-8, '<u8')
+        if dot - start < 8:
+            keep = _swar_keep(dot-start)
+            np.bitwise_and(v, keep, out=v)
+            np.bitwise_or(v, _ASCII_BLANKS & ~keep, out=v)
+        if not _swar_integer_part(v, mantissa, sign, checks):
+            return None
+        _swar_combine(mantissa)
+
+        # fractional part, in windows of up to 8 digits
+        ndec = stop - dot - 1
+        for i in range(-(-ndec // 8)):
+            ndigits = min(8, ndec - 8*i)
+            v[...] = column(dot+1+8*i+ndigits-8, '<u8')
+            if not _swar_digits(v, ndigits, work):
+                return None
+            np.multiply(mantissa, np.uint64(10**ndigits), out=mantissa)
+            np.add(mantissa, v, out=mantissa)
+
+        np.divide(mantissa, 10.0**ndec, out=x)
+        np.bitwise_or(x.view(np.uint64), sign, out=x.view(np.uint64))
+
+    header = np.ndarray((nblks, hdr_len), dtype=np.uint8, buffer=buf, strides=(blk_len, 1))
+    header = np.fromstring(header.tobytes(), sep=' ', dtype=int)
+    if header.size != 5 * nblks:
+        return None
+
+    return header.reshape((nblks, 5)), values[0], values[1]
+
+
+def _parse_chunk(f, nblks, nbnds):
+    # each block is a header line with 5 integers followed by nbnds**2 lines
+    # with 2 reals, so the tokens of a chunk of blocks form a fixed-stride
+    # table that is tokenized in one bulk operation
+    blk_ntok = 5 + 2*nbnds**2
+
+    s = b''.join(itertools.islice(f, nblks * (nbnds**2 + 1)))
+    tokens = np.fromstring(s, sep=' ')
+    if tokens.size != nblks * blk_ntok:
+        raise ValueError('unexpected number of entries in MMN file "%s"' % f.name)
+    tokens = tokens.reshape((nblks, blk_ntok))
+
+    return tokens[:, :5].astype(int), tokens[:, 5::2], tokens[:, 6::2]
+
+
+def _default_chunk_size(nbnds, nntot):
+    return max(1, _CHUNK_LINES // (nntot * (nbnds**2 + 1)))
+
+
+def _iter_parsed_chunks(f, nbnds, nkpts, nntot, chunk_size):
+    # files with a fixed-width layout are parsed directly from the raw bytes,
+    # and otherwise by tokenizing each chunk
+    pos = f.tell()
+    layout = _fixed_width_layout(f.readline(), f.readline())
+    f.seek(pos)
+
+    (buf, scratch) = (None, None)
+    for kstart in range(0, nkpts, chunk_size):
+        kstop = min(kstart+chunk_size, nkpts)
+        nblks = (kstop - kstart) * nntot
+
+        chunk = None
+        if layout is not None:
+            pos = f.tell()
+            nbytes = nblks * (layout[0] + nbnds**2 * layout[1])
+            if buf is None:
+                buf = bytearray(nbytes)
+                scratch = np.empty((11, nblks * nbnds**2), dtype=np.uint64)
+            if f.readinto(memoryview(buf)[:nbytes]) == nbytes:
+                chunk = _parse_fixed_width_chunk(buf, nblks, nbnds, layout, scratch)
+            if chunk is None:
+                layout = None
+                f.seek(pos)
+        if chunk is None:
+            chunk = _parse_chunk(f, nblks, nbnds)
+
+        yield (kstart, kstop) + tuple(chunk)
+
+
+def _fill_chunk(mmn, kpb_kidx, kpb_g, header, re, im):
+    (nkpts, nntot, nbnds) = mmn.shape[:3]
     nblks = nkpts * nntot
-    # a block consists of the header line and the following nbnds**2 lines
-    blk_len = nbnds**2 + 1
-    # indices of the starting line of each block
-    blk_start_idx = list(range(2, len(contents), blk_len))
-
-    kpb_kidx = np.zeros((nkpts, nntot), dtype=int)
-    kpb_g = np.zeros((nkpts, nntot, 3), dtype=int)
-    mmn = np.zeros((nkpts, nntot, nbnds, nbnds), dtype=complex)
-    for (iblk, istart) in enumerate(blk_start_idx):
-        # determine kpoint-index and nearest-neighbor index
-        # based on the index of the block
-        # --------------------------------------------------
-        ikpt = iblk // nntot
-        if iblk % nntot == 0:
-            inn = 0
+
+    kpb_kidx[...] = header[:, 1].reshape((-1, nntot)) - 1
+    kpb_g[...] = header[:, 2:5].reshape((-1, nntot, 3))
+
+    blocks = mmn.reshape((nblks, nbnds, nbnds))
+    blocks.real = re.reshape((nblks, nbnds, nbnds)).transpose((0, 2, 1))
+    blocks.imag = im.reshape((nblks, nbnds, nbnds)).transpose((0, 2, 1))
+
+
+def _process_mmn_file(fname, out=None, chunk_size=None):
+    with open(fname, 'rb') as f:
+        (_, nbnds, nkpts, nntot) = _read_mmn_header(f)
+
+        if out is None:
+            mmn = np.empty((nkpts, nntot, nbnds, nbnds), dtype=complex)
         else:
-            inn += 1
-        # --------------------------------------------------
-        block = contents[istart:(istart+blk_len)]
-        block_header = block[0]
-        kpb_kidx[ikpt][inn] = int(block_header.split()[1]) - 1
-        kpb_g[ikpt][inn] = list(map(int, block_header.split()[2:]))
-        s = ''.join(block[1:])
-        a = np.fromstring(s, sep='\n').view(complex)
-        mmn[ikpt, inn, :, :] = a.reshape((nbnds, nbnds), order='F')
+            if out.shape != (nkpts, nntot, nbnds, nbnds):
+                raise ValueError('out has shape %s, expected %s' % (out.shape, (nkpts, nntot, nbnds, nbnds)))
+            mmn = out
+
+        if chunk_size is None:
+            chunk_size = _default_chunk_size(nbnds, nntot)
+
+        kpb_kidx = np.zeros((nkpts, nntot), dtype=int)
+        kpb_g = np.zeros((nkpts, nntot, 3), dtype=int)
+        for (kstart, kstop, header, re, im) in _iter_parsed_chunks(f, nbnds, nkpts, nntot, chunk_size):
+            _fill_chunk(mmn[kstart:kstop], kpb_kidx[kstart:kstop], kpb_g[kstart:kstop], header, re, im)
 
     return mmn, kpb_kidx, kpb_g
 
 
-def read_mmn(fname):
+def iter_mmn_chunks(fname, chunk_size=None):
+    """
+    Iterate over the overlap matrices in an MMN file a chunk of k-points at a time
+
+    Only one chunk is held in memory at a time, so this can be used to process
+    files whose overlap matrices do not fit in memory.
+
+    Parameters
+    ----------
+    fname : str
+    chunk_size : int, optional
+        number of k-points in each chunk, by default chosen to bound the
+        amount of text held in memory
+
+    Yields
+    ------
+    kstart : int
+        index of the first k-point in the chunk
+    mmn : ndarray, shape (nkpts_chunk, nntot, nbnds, nbnds)
+    kpb_kidx : ndarray, shape (nkpts_chunk, nntot)
+    kpb_g : ndarray, shape (nkpts_chunk, nntot, 3)
+
+    """
+    with open(fname, 'rb') as f:
+        (_, nbnds, nkpts, nntot) = _read_mmn_header(f)
+
+        if chunk_size is None:
+            chunk_size = _default_chunk_size(nbnds, nntot)
+
+        for (kstart, kstop, header, re, im) in _iter_parsed_chunks(f, nbnds, nkpts, nntot, chunk_size):
+            mmn = np.empty((kstop-kstart, nntot, nbnds, nbnds), dtype=complex)
+            kpb_kidx = np.empty((kstop-kstart, nntot), dtype=int)
+            kpb_g = np.empty((kstop-kstart, nntot, 3), dtype=int)
+            _fill_chunk(mmn, kpb_kidx, kpb_g, header, re, im)
+
+            yield kstart, mmn, kpb_kidx, kpb_g
+
+
+@cached(bypass=('out',))
+def read_mmn(fname, out=None, chunk_size=None):
     """
     Read MMN file
 
     Parameters
     ----------
     fname : str
+    out : ndarray, shape (nkpts, nntot, nbnds, nbnds), optional
+        array in which to place the overlap matrices
+    chunk_size : int, optional
+        number of k-points parsed at once, by default chosen to bound the
+        amount of text held in memory
 
     Returns
     -------
     ndarray, shape (nkpts, nntot, nbnds, nbnds)
 
     """
-    return _process_mmn_file(fname)[0]
+    return _process_mmn_file(fname, out=out, chunk_size=chunk_size)[0]
 
 
 def write_mmn(fname, mmn, kpb_kidx, kpb_g):
@@ -65,16 +388,245 @@ def write_mmn(fname, mmn, kpb_kidx, kpb_g):
     Parameters
     ----------
     fname : str
-    mmn : ndarray, shape (nkpts, nntot, nbnds, nbnds)
+    mmn : ndarray, shape (nkpts, nntot, nbnds, nbnds), or iterable
+        the overlap matrices, or an iterable of the overlap matrices at each
+        k-point, with shape (nntot, nbnds, nbnds), which are written as they
+        are produced
+    kpb_kidx : ndarray, shape (nkpts, nntot)
+    kpb_g : ndarray, shape (nkpts, nntot, 3)
 
     """
-    nkpts = mmn.shape[0]
-    nntot = mmn.shape[1]
-    nbnds = mmn.shape[2]
+    (nkpts, nntot) = np.shape(kpb_kidx)
+    blocks = iter(mmn)
+    first = np.asarray(next(blocks))
+    nbnds = first.shape[1]
+
+    block_fmt = '%5d%5d%5d%5d%5d\n' + '%18.12f%18.12f\n' * nbnds**2
     with open(fname, 'w') as f:
         print('DUMMY HEADER', file=f)
         print('%12d%12d%12d' % (nbnds, nkpts, nntot), file=f)
-        for ikpt in range(nkpts):
-            for inn in range(nntot):
-                print('%5d%5d%5d%5d%5d' % ((ikpt+1, kpb_kidx[ikpt][inn]+1) + tuple(kpb_g[ikpt][inn])), file=f)
-                np.savetxt(f, mmn[ikpt][inn].flatten(order='F').view(float).reshape(-1, 2), fmt='%18.12f%18.12f')
+        for (ikpt, mmn_k) in enumerate(itertools.chain([first], blocks)):
+            mmn_k = np.asarray(mmn_k, dtype=complex)
+            data = np.empty((nntot, 5 + 2*nbnds**2))
+            data[:, 0] = ikpt + 1
+            data[:, 1] = np.asarray(kpb_kidx[ikpt]) + 1
+            data[:, 2:5] = kpb_g[ikpt]
+            data[:, 5:] = np.ascontiguousarray(mmn_k.swapaxes(1, 2)).view(float).reshape((nntot, -1))
+            f.write((block_fmt * nntot) % tuple(data.ravel().tolist()))
+
+
+def _overlaps(unk_k, unk_kpb):
+    # <u_mk|u_nk+b> for all b, as one batched matrix product over the grid
+    (nntot, nbnds) = unk_kpb.shape[:2]
+    return np.matmul(unk_k.reshape((nbnds, -1)).conj(), unk_kpb.reshape((nntot, nbnds, -1)).swapaxes(1, 2))
+
+
+def _iter_overlaps(unk_dir, kpb_kidx, kpb_g, spin, cache_size, memory):
+    (grid, _, nbnds) = _read_unk_header(os.path.join(unk_dir, 'UNK%05d.%d' % (1, spin)))
+    (nkpts, nntot) = np.shape(kpb_kidx)
+
+    if cache_size is None:
+        # the UNK files of all the neighbors of consecutive k-points, so that
+        # each file is read only once for the usual ordering of the k-points,
+        # unless they take more than the memory budget
+        span = np.max(np.abs(np.asarray(kpb_kidx) - np.arange(nkpts)[:, np.newaxis]))
+        per_kpoint = nbnds * int(np.prod(grid)) * np.dtype(complex).itemsize
+        cache_size = min(2*span + 1, max(nntot + 1, memory // per_kpoint))
+    cache = collections.OrderedDict()
+
+    def unk(ikpt):
+        if ikpt in cache:
+            cache.move_to_end(ikpt)
+        else:
+            if len(cache) >= cache_size:
+                cache.popitem(last=False)
+            cache[ikpt] = read_unk(os.path.join(unk_dir, 'UNK%05d.%d' % (ikpt+1, spin)))
+        return cache[ikpt]
+
+    # exp(-iG.r) on the grid, for each G in kpb_g, since u_{k+G}(r) = exp(-iG.r) u_k(r)
+    phases = {}
+    for g in set(map(tuple, np.reshape(kpb_g, (-1, 3)))):
+        factors = [np.exp(-2j*np.pi*g[i]*np.arange(grid[i])/grid[i]) for i in range(3)]
+        phases[g] = factors[0][:, np.newaxis, np.newaxis] * factors[1][:, np.newaxis] * factors[2]
+
+    unk_kpb = np.empty((nntot, nbnds) + tuple(grid), dtype=complex)
+    for ikpt in range(nkpts):
+        for inn in range(nntot):
+            np.multiply(unk(kpb_kidx[ikpt][inn]), phases[tuple(kpb_g[ikpt][inn])], out=unk_kpb[inn])
+        yield _overlaps(unk(ikpt), unk_kpb)
+
+
+def compute_mmn(unk_dir, kpb_kidx, kpb_g, fname=None, spin=1, cache_size=None, memory=2**30):
+    """
+    Compute :math:`M^{(\mathbf{k},\mathbf{b})}_{mn}` from UNK files
+
+    The overlaps :math:`\langle u_{m\mathbf{k}}|u_{n\mathbf{k}+\mathbf{b}}\rangle`
+    are computed on the real-space grid of the ``UNKnnnnn.s`` files, with
+    :math:`u_{n\mathbf{k}+\mathbf{b}}` found from the periodic part at the
+    k-point ``kpb_kidx`` in the first Brillouin zone as
+    :math:`e^{-i\mathbf{G}\cdot\mathbf{r}}u_{n\mathbf{k}'}(\mathbf{r})`,
+    with :math:`\mathbf{G}` from ``kpb_g``. The overlaps at each k-point are
+    computed as one batched matrix product over the grid.
+
+    The k-points are processed one at a time, with the UNK files held in a
+    least-recently-used cache of ``cache_size`` k-points, so that the memory
+    used is bounded independently of the number of k-points.
+
+    Parameters
+    ----------
+    unk_dir : str
+        directory of the ``UNKnnnnn.s`` files
+    kpb_kidx : ndarray, shape (nkpts, nntot)
+    kpb_g : ndarray, shape (nkpts, nntot, 3)
+        as returned by :func:`w90utils.io.nnkp.read_nnkpts`
+    fname : str, optional
+        if given, the overlaps are written to this MMN file with
+        :func:`write_mmn` as they are computed, instead of being returned
+    spin : int, optional
+        the spin channel ``s`` in the names of the files
+    cache_size : int, optional
+        number of k-points for which the UNK files are held in memory, by
+        default enough that each file is read once, within ``memory``
+    memory : int, optional
+        bound in bytes on the memory of the cache, if ``cache_size`` is not
+        given
+
+    Returns
+    -------
+    mmn : ndarray, shape (nkpts, nntot, nbnds, nbnds)
+        unless ``fname`` is given
+
+    """
+    overlaps = _iter_overlaps(unk_dir, kpb_kidx, kpb_g, spin, cache_size, memory)
+
+    if fname is not None:
+        write_mmn(fname, overlaps, kpb_kidx, kpb_g)
+        return
+
+    first = next(overlaps)
+    mmn = np.empty((len(kpb_kidx),) + first.shape, dtype=complex)
+    mmn[0] = first
+    for (ikpt, mmn_k) in enumerate(overlaps, 1):
+        mmn[ikpt] = mmn_k
+
+    return mmn
+
+
+class MmnFile(object):
+    """
+    Random access to the blocks of an MMN file
+
+    The byte offset of every block is determined in a single scan of the file
+    and saved next to it, so that later instances only read the index.
+    Indexing with ``mmn[ikpt, inn]`` reads and parses only the requested
+    blocks; the k-point and nearest-neighbor indices may be integers, slices,
+    or index arrays, and are applied to each axis independently.
+
+    Parameters
+    ----------
+    fname : str
+    index_fname : str, optional
+        path of the saved index, the default is ``fname + '.idx'``
+
+    """
+    def __init__(self, fname, index_fname=None):
+        self.fname = fname
+        self.index_fname = index_fname if index_fname is not None else fname + '.idx'
+
+        stat = os.stat(fname)
+        if not self._load_index(stat):
+            self._build_index()
+            try:
+                self._save_index(stat)
+            except OSError:
+                pass
+
+    @property
+    def shape(self):
+        return (self.nkpts, self.nntot, self.nbnds, self.nbnds)
+
+    def __len__(self):
+        return self.nkpts
+
+    def _load_index(self, stat):
+        # an index that is stale, truncated, or not an index at all is
+        # ignored, and nothing is set unless all of it could be read
+        try:
+            with np.load(self.index_fname, allow_pickle=False) as index:
+                if index['size'] != stat.st_size or index['mtime'] != stat.st_mtime_ns:
+                    return False
+                (nbnds, nkpts, nntot) = map(int, index['dims'])
+                (offsets, kpb_kidx, kpb_g) = (index['offsets'], index['kpb_kidx'], index['kpb_g'])
+        except (OSError, EOFError, KeyError, TypeError, ValueError, zipfile.BadZipFile):
+            return False
+        if offsets.shape != (nkpts*nntot + 1,) or kpb_kidx.shape != (nkpts, nntot) or kpb_g.shape != (nkpts, nntot, 3):
+            return False
+
+        (self.nbnds, self.nkpts, self.nntot) = (nbnds, nkpts, nntot)
+        (self.offsets, self.kpb_kidx, self.kpb_g) = (offsets, kpb_kidx, kpb_g)
+
+        return True
+
+    def _save_index(self, stat):
+        with open(self.index_fname, 'wb') as f:
+            np.savez(
+                f,
+                size=stat.st_size, mtime=stat.st_mtime_ns,
+                dims=[self.nbnds, self.nkpts, self.nntot],
+                offsets=self.offsets, kpb_kidx=self.kpb_kidx, kpb_g=self.kpb_g)
+
+    def _build_index(self):
+        with open(self.fname, 'rb') as f:
+            (self.nbnds, self.nkpts, self.nntot) = map(int, _read_mmn_header(f)[1:])
+            nblks = self.nkpts * self.nntot
+
+            # the header of block i is the line 2 + i*(nbnds**2 + 1), so the
+            # block offsets follow from the positions of the newlines, of
+            # which only those ending the line before a header are kept
+            hdr_lines = 2 + np.arange(nblks+1) * (self.nbnds**2 + 1)
+            self.offsets = np.empty(nblks+1, dtype=np.int64)
+            (pos, nlines, nfound) = (0, 0, 0)
+            f.seek(0)
+            while nfound <= nblks:
+                buf = f.read(_CHUNK_LINES * 64)
+                if not buf:
+                    break
+                newlines = np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) == ord('\n'))
+                # the lines starting after the newlines of this chunk
+                stop = np.searchsorted(hdr_lines, nlines + len(newlines), side='right')
+                self.offsets[nfound:stop] = pos + 1 + newlines[hdr_lines[nfound:stop] - nlines - 1]
+                (pos, nlines, nfound) = (pos + len(buf), nlines + len(newlines), stop)
+            if nfound <= nblks:
+                raise ValueError('unexpected number of lines in MMN file "%s"' % self.fname)
+
+            self.kpb_kidx = np.zeros((self.nkpts, self.nntot), dtype=int)
+            self.kpb_g = np.zeros((self.nkpts, self.nntot, 3), dtype=int)
+            for (iblk, offset) in enumerate(self.offsets[:-1]):
+                f.seek(offset)
+                header = f.readline().split()
+                (ikpt, inn) = divmod(iblk, self.nntot)
+                self.kpb_kidx[ikpt, inn] = int(header[1]) - 1
+                self.kpb_g[ikpt, inn] = list(map(int, header[2:5]))
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 2:
+            raise IndexError('too many indices for MmnFile')
+        key = key + (slice(None),) * (2 - len(key))
+
+        kidx = np.arange(self.nkpts)[key[0]]
+        bidx = np.arange(self.nntot)[key[1]]
+        iblks = np.add.outer(kidx * self.nntot, bidx)
+
+        nbnds = self.nbnds
+        blocks = np.empty(iblks.shape + (nbnds, nbnds), dtype=complex)
+        with open(self.fname, 'rb') as f:
+            for idx in np.ndindex(*iblks.shape):
+                (start, stop) = self.offsets[iblks[idx]:iblks[idx]+2]
+                f.seek(start)
+                buf = f.read(stop - start)
+                data = np.fromstring(buf[buf.index(b'\n')+1:], sep=' ')
+                blocks[idx] = data.view(complex).reshape((nbnds, nbnds), order='F')
+
+        return blocks
@@ -0,0 +1,77 @@
+import datetime
+
+import numpy as np
+
+
+__all__ = ['read_r', 'write_r']
+
+
+# number of lines formatted at a time by write_r
+_CHUNK_LINES = 2**16
+
+
+def read_r(fname):
+    """
+    Read the position operator in the Wannier representation from ``_r.dat`` file
+
+    Parameters
+    ----------
+    fname : str
+
+    Returns
+    -------
+    rr : ndarray, shape (nrpts, nwann, nwann, 3)
+        the matrix elements :math:`\\langle\\mathbf{0}m|\\mathbf{r}|\\mathbf{R}n\\rangle`
+    Rvectors : ndarray, shape (nrpts, 3)
+
+    """
+    with open(fname, 'r') as f:
+        contents = f.readlines()
+
+    # header = contents[0]
+    nwann = int(contents[1].strip())
+    nrpts = int(contents[2].strip())
+
+    raw_data = np.fromstring(''.join(contents[3:]), sep='\n').reshape((-1, 11))
+
+    rr = raw_data[:, 5::2] + 1j*raw_data[:, 6::2]
+    rr = rr.reshape((nrpts, nwann, nwann, 3)).transpose((0, 2, 1, 3))
+    rr = np.copy(rr, order='C')
+
+    Rvectors = np.copy(raw_data[:, :3].astype(int)[::nwann**2], order='C')
+
+    return rr, Rvectors
+
+
+def write_r(fname, rr, Rvectors, header=None):
+    """
+    Write the position operator in the Wannier representation to ``_r.dat`` file
+
+    Parameters
+    ----------
+    fname : str
+    rr : ndarray, shape (nrpts, nwann, nwann, 3)
+    Rvectors : ndarray, shape (nrpts, 3)
+    header : str, optional
+
+    """
+    (nrpts, nwann, _, _) = rr.shape
+
+    if header is None:
+        header = ' written on %s' % datetime.datetime.now().strftime('%d%b%Y at %H:%M:%S')
+
+    # the row index runs fastest, followed by the column index
+    (irpt, icol, irow) = np.indices((nrpts, nwann, nwann)).reshape((3, -1))
+    data = np.empty((nrpts*nwann**2, 11))
+    data[:, :3] = np.asarray(Rvectors)[irpt]
+    data[:, 3] = irow + 1
+    data[:, 4] = icol + 1
+    data[:, 5:] = np.ascontiguousarray(rr.transpose((0, 2, 1, 3)), dtype=complex).view(float).reshape((-1, 6))
+
+    with open(fname, 'w') as f:
+        print(header, file=f)
+        print('%12d' % nwann, file=f)
+        print('%12d' % nrpts, file=f)
+        for start in range(0, len(data), _CHUNK_LINES):
+            chunk = data[start:(start+_CHUNK_LINES)]
+            f.write(('%5d%5d%5d%5d%5d' + '%12.6f'*6 + '\n') * len(chunk) % tuple(chunk.ravel().tolist()))
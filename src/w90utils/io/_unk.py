@@ -1,33 +1,178 @@
+import concurrent.futures
+import glob
+import os
+
 import numpy as np
-from scipy.io import FortranFile
+import scipy.fft
+
+
+__all__ = ['read_unk', 'write_unk', 'read_unk_all']
+
+
+# dtype of the record markers, as written by gfortran
+_MARKER = np.dtype(np.uint32)
+
+# the first record: ngx, ngy, ngz, ikpt, nbnds
+_HEADER = np.dtype([('head', _MARKER), ('data', np.int32, (5,)), ('tail', _MARKER)])
+
+
+def _band_dtype(ngtot):
+    # one record for each band
+    return np.dtype([('head', _MARKER), ('data', np.complex128, (ngtot,)), ('tail', _MARKER)])
+
+
+def _read_header(fname):
+    header = np.fromfile(fname, dtype=_HEADER, count=1)[0]
+    if header['head'] != header['tail'] or header['head'] != _HEADER['data'].itemsize:
+        raise IOError('%s is not a valid UNK file' % fname)
+    [ngx, ngy, ngz, ikpt, nbnds] = header['data'].tolist()
+
+    return (ngx, ngy, ngz), ikpt, nbnds
+
+
+def _grid_view(records, grid):
+    # the bands on the real-space grid, as views of the records, which hold
+    # the grid in Fortran order
+    (ngx, ngy, ngz) = grid
+    return records['data'].reshape((-1, ngz, ngy, ngx)).transpose((0, 3, 2, 1))
+
+
+def _to_gspace(unk, workers=None):
+    return scipy.fft.fftn(unk, axes=(-3, -2, -1), norm='ortho', overwrite_x=True, workers=workers)
+
+
+def read_unk(fname, gspace=False, out=None, workers=None):
+    """
+    Read the periodic part of the Bloch functions from an ``UNKnnnnn.s`` file
+
+    The records of the file are memory-mapped, and the bands are copied
+    directly into the result, normalized on the real-space grid.
+
+    Parameters
+    ----------
+    fname : str
+    gspace : bool, optional
+        return the Fourier components on the grid of G-vectors instead
+    out : ndarray, shape (nbnds, ngx, ngy, ngz), optional
+        array into which the bands are read
+    workers : int, optional
+        number of threads of the FFT
+
+    Returns
+    -------
+    unk : ndarray, shape (nbnds, ngx, ngy, ngz)
+
+    """
+    (grid, _, nbnds) = _read_header(fname)
+    ngtot = int(np.prod(grid))
+
+    records = np.memmap(fname, dtype=_band_dtype(ngtot), mode='r', offset=_HEADER.itemsize, shape=(nbnds,))
+    if np.any(records['head'] != records.dtype['data'].itemsize) or np.any(records['tail'] != records['head']):
+        raise IOError('%s is not a valid UNK file' % fname)
+
+    if out is None:
+        out = np.empty((nbnds,) + grid, dtype=complex)
+    np.divide(_grid_view(records, grid), np.sqrt(ngtot), out=out)
+
+    if gspace:
+        out[...] = _to_gspace(out, workers=workers)
+
+    return out
+
+
+def write_unk(fname, unk, ikpt):
+    """
+    Write the periodic part of the Bloch functions to an ``UNKnnnnn.s`` file
+
+    The bands are written directly into the memory-mapped file, without
+    intermediate copies.
+
+    Parameters
+    ----------
+    fname : str
+    unk : ndarray, shape (nbnds, ngx, ngy, ngz)
+        normalized on the real-space grid, as returned by :func:`read_unk`
+    ikpt : int
+        the index of the k-point, starting from zero
+
+    """
+    (nbnds, ngx, ngy, ngz) = unk.shape
+    ngtot = ngx * ngy * ngz
+
+    header = np.zeros(1, dtype=_HEADER)
+    header['head'] = header['tail'] = _HEADER['data'].itemsize
+    header['data'] = [ngx, ngy, ngz, ikpt+1, nbnds]
+    with open(fname, 'wb') as f:
+        header.tofile(f)
+
+    dtype = _band_dtype(ngtot)
+    records = np.memmap(fname, dtype=dtype, mode='r+', offset=_HEADER.itemsize, shape=(nbnds,))
+    records['head'] = records['tail'] = dtype['data'].itemsize
+    np.multiply(unk, np.sqrt(ngtot), out=_grid_view(records, (ngx, ngy, ngz)))
+    records.flush()
+
+
+def read_unk_all(directory='.', spin=1, gspace=False, workers=None):
+    """
+    Read the periodic part of the Bloch functions at all k-points
 
+    The files ``UNKnnnnn.s`` in ``directory`` are read concurrently into one
+    preallocated array, ordered by the index of the k-point in each file.
 
-__all__ = []
+    Parameters
+    ----------
+    directory : str, optional
+    spin : int, optional
+        the spin channel ``s`` in the names of the files
+    gspace : bool, optional
+        return the Fourier components on the grid of G-vectors instead
+    workers : int, optional
+        number of threads reading the files, and computing their FFT
 
+    Returns
+    -------
+    unk : ndarray, shape (nkpts, nbnds, ngx, ngy, ngz)
 
-# def read_unk(fname, gspace=False):
-#     with FortranFile(fname) as f:
-#         [ngx, ngy, ngz, ikpt, nbnds] = f.read_ints()
+    Raises
+    ------
+    ValueError
+        if the k-points of the files are not 1 to the number of files, each
+        in exactly one file
 
-#         ngtot = ngx * ngy * ngz
-#         unk_r = np.zeros((nbnds, ngtot), dtype=complex)
-#         for ibnd in range(nbnds):
-#             unk_r[ibnd, :] = f.read_reals().view(complex)
+    """
+    fnames = sorted(glob.glob(os.path.join(directory, 'UNK[0-9][0-9][0-9][0-9][0-9].%d' % spin)))
+    if not fnames:
+        raise IOError('no UNK files found in %s' % directory)
 
-#     unk_r = unk_r.reshape((nbnds, ngx, ngy, ngz), order='F') / np.sqrt(ngtot)
+    (grid, _, nbnds) = _read_header(fnames[0])
 
-#     if gspace:
-#         unk_g = np.fft.fftn(unk_r, axes=(1, 2, 3)).reshape((nbnds, ngtot), order='F') / np.sqrt(ngtot)
-#         return unk_g
-#     else:
-#         return unk_r
+    # the k-point of each file, each of which must be found in exactly one
+    # file, since the result is not initialized
+    files = [None] * len(fnames)
+    for fname in fnames:
+        (grid_k, ikpt, nbnds_k) = _read_header(fname)
+        if grid_k != grid or nbnds_k != nbnds:
+            raise IOError('%s is not consistent with %s' % (fname, fnames[0]))
+        if not 0 < ikpt <= len(fnames):
+            raise ValueError('%s is for k-point %d, but there are %d UNK files' % (fname, ikpt, len(fnames)))
+        if files[ikpt-1] is not None:
+            raise ValueError('%s and %s are both for k-point %d' % (files[ikpt-1], fname, ikpt))
+        files[ikpt-1] = fname
+    missing = [ikpt+1 for (ikpt, fname) in enumerate(files) if fname is None]
+    if missing:
+        raise ValueError('no UNK file for k-points %s' % ', '.join(map(str, missing)))
 
+    unk = np.empty((len(fnames), nbnds) + grid, dtype=complex)
 
-# def write_unk(fname, unk, ikpt):
-#     (nbnds, ngx, ngy, ngz) = unk.shape
+    def read(ikpt):
+        read_unk(files[ikpt], gspace=gspace, out=unk[ikpt], workers=1)
 
-#     with FortranFile(fname, 'w') as f:
-#         f.write_record(np.array([ngx, ngy, ngz, ikpt+1, nbnds], dtype=np.int32))
+    if workers is None or workers == 1:
+        for ikpt in range(len(files)):
+            read(ikpt)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(read, ikpt) for ikpt in range(len(files))]:
+                future.result()
 
-#         for ibnd in range(nbnds):
-#             f.write_record(unk[ibnd].ravel(order='F').view(float))
+    return unk
@@ -0,0 +1,226 @@
+"""Opt-in cache of parsed Wannier90 input files
+
+When enabled, the arrays returned by the readers of AMN, MMN, EIG, and NNKP
+files are saved in ``.npy`` format the first time a file is parsed, and are
+returned as memory-mapped arrays on subsequent reads. Cache entries are keyed
+by the path of the file, the reader, and its arguments, and are validated
+against the size and modification time of the file, and optionally a hash of
+its contents.
+
+Memory-mapped arrays are opened in copy-on-write mode, so modifying them does
+not modify the cache.
+
+"""
+import functools
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+__all__ = ['enable', 'disable', 'is_enabled', 'invalidate', 'cache_size']
+
+
+_settings = {
+    'enabled': False,
+    'directory': None,
+    'max_size': None,
+    'hash_contents': False,
+}
+
+
+def _default_directory():
+    return os.environ.get('W90UTILS_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'w90utils'))
+
+
+def enable(directory=None, max_size=None, hash_contents=False):
+    """
+    Enable the cache
+
+    Parameters
+    ----------
+    directory : str, optional
+        cache directory, the default is the value of the environment variable
+        ``W90UTILS_CACHE_DIR`` or ``~/.cache/w90utils``
+    max_size : int, optional
+        maximum total size of the cache in bytes, least recently used entries
+        are evicted to satisfy the limit
+    hash_contents : bool, optional
+        also validate cache entries against a hash of the file contents
+
+    """
+    _settings['enabled'] = True
+    _settings['directory'] = directory if directory is not None else _default_directory()
+    _settings['max_size'] = max_size
+    _settings['hash_contents'] = hash_contents
+
+
+def disable():
+    """Disable the cache, leaving existing entries on disk"""
+    _settings['enabled'] = False
+
+
+def is_enabled():
+    return _settings['enabled']
+
+
+def _entries():
+    directory = _settings['directory'] or _default_directory()
+    if not os.path.isdir(directory):
+        return []
+
+    entries = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isfile(os.path.join(path, 'meta.json')):
+            entries.append(path)
+
+    return entries
+
+
+def _entry_size(entry):
+    return sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+
+
+def cache_size():
+    """Return the total size of the cache in bytes"""
+    return sum(_entry_size(entry) for entry in _entries())
+
+
+def invalidate(fname=None):
+    """
+    Remove cache entries
+
+    Parameters
+    ----------
+    fname : str, optional
+        remove only the entries for this file, by default all entries are
+        removed
+
+    """
+    path = os.path.realpath(fname) if fname is not None else None
+    for entry in _entries():
+        if path is not None:
+            try:
+                with open(os.path.join(entry, 'meta.json'), 'r') as f:
+                    if json.load(f)['path'] != path:
+                        continue
+            except (OSError, ValueError, KeyError):
+                pass
+        shutil.rmtree(entry, ignore_errors=True)
+
+
+def _evict():
+    max_size = _settings['max_size']
+    if max_size is None:
+        return
+
+    # the modification time of the metadata is updated on every hit
+    entries = sorted(_entries(), key=lambda entry: os.path.getmtime(os.path.join(entry, 'meta.json')))
+    sizes = [_entry_size(entry) for entry in entries]
+    total = sum(sizes)
+    for (entry, size) in zip(entries, sizes):
+        if total <= max_size:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+def _file_hash(fname):
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def _file_info(fname):
+    stat = os.stat(fname)
+    info = {
+        'path': os.path.realpath(fname),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+    }
+    if _settings['hash_contents']:
+        info['hash'] = _file_hash(fname)
+
+    return info
+
+
+def _load(entry, info):
+    try:
+        with open(os.path.join(entry, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if any(meta['file'].get(key) != info[key] for key in info):
+        shutil.rmtree(entry, ignore_errors=True)
+        return None
+
+    try:
+        arrays = [np.load(os.path.join(entry, '%d.npy' % i), mmap_mode='c') for i in range(meta['narrays'])]
+    except (OSError, ValueError):
+        shutil.rmtree(entry, ignore_errors=True)
+        return None
+    os.utime(os.path.join(entry, 'meta.json'))
+
+    return tuple(arrays) if meta['tuple'] else arrays[0]
+
+
+def _store(entry, info, result):
+    arrays = result if isinstance(result, tuple) else (result,)
+    if not all(isinstance(a, np.ndarray) and a.dtype != object for a in arrays):
+        return
+
+    directory = os.path.dirname(entry)
+    os.makedirs(directory, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=directory, prefix='.tmp-')
+    try:
+        for (i, a) in enumerate(arrays):
+            np.save(os.path.join(tmp, '%d.npy' % i), a)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'path': info['path'], 'file': info, 'narrays': len(arrays), 'tuple': isinstance(result, tuple)}, f)
+        os.replace(tmp, entry)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+
+    _evict()
+
+
+def cached(bypass=()):
+    """
+    Decorator for readers whose first argument is the name of the file read
+
+    Parameters
+    ----------
+    bypass : sequence of str
+        names of keyword arguments for which a value other than None bypasses
+        the cache
+
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(fname, *args, **kwargs):
+            if not _settings['enabled'] or any(kwargs.get(name) is not None for name in bypass):
+                return func(fname, *args, **kwargs)
+
+            info = _file_info(fname)
+            key = repr((func.__module__, func.__name__, info['path'], args, sorted(kwargs.items())))
+            entry = os.path.join(_settings['directory'], hashlib.sha1(key.encode()).hexdigest())
+
+            result = _load(entry, info) if os.path.isdir(entry) else None
+            if result is None:
+                result = func(fname, *args, **kwargs)
+                _store(entry, info, result)
+
+            return result
+
+        return wrapper
+
+    return decorator
@@ -1,133 +1,183 @@
 """Wannier90 I/O routines pertaining to NNKP files"""
+import functools
+import os
 import re
 
 import numpy as np
 
 from ._orbitals import orbitals
 from . import _utils
+from .cache import cached
 
 
-def read_dlv(fname, units='bohr'):
-    pattern = re.compile(r'(?:begin\s+real_lattice)(.+)(?:end\s+real_lattice)', re.IGNORECASE | re.DOTALL)
-    with open(fname, 'r') as f:
-        match = pattern.search(f.read())
-        if match is None:
-            raise Exception
+class NnkpFile(object):
+    """
+    Contents of an NNKP file
 
-    dlv = np.fromstring(match.group(1), sep='\n').reshape((3, 3))
+    The file is read once, all of its ``begin``/``end`` blocks are located in
+    a single scan, and each block is parsed the first time it is used.
 
-    dlv = _utils.convert_units(dlv, 'angstrom', units)
+    Parameters
+    ----------
+    fname : str
 
-    return dlv
+    """
+    _block_regex = re.compile(r'^[ \t]*(begin|end)[ \t]+(\w+)[ \t]*$', re.IGNORECASE | re.MULTILINE)
 
+    def __init__(self, fname):
+        self.fname = fname
 
-def read_rlv(fname, units='bohr'):
-    pattern = re.compile(r'(?:begin\s+recip_lattice)(.+)(?:end\s+recip_lattice)', re.IGNORECASE | re.DOTALL)
-    with open(fname, 'r') as f:
-        match = pattern.search(f.read())
-        if match is None:
-            raise Exception
+        with open(fname, 'r') as f:
+            contents = f.read()
 
-    rlv = np.fromstring(match.group(1), sep='\n').reshape((3, 3))
+        self._blocks = {}
+        self._parsed = {}
+        (name, start) = (None, None)
+        for match in self._block_regex.finditer(contents):
+            if match.group(1).lower() == 'begin':
+                (name, start) = (match.group(2).lower(), match.end())
+            elif name is not None and match.group(2).lower() == name:
+                self._blocks[name] = contents[start:match.start()]
+                name = None
 
-    rlv = _utils.convert_units(rlv, 'angstrom', units, inverse=True)
+    def _parse(self, name, parser):
+        if name not in self._parsed:
+            try:
+                block = self._blocks.pop(name)
+            except KeyError:
+                raise ValueError('block "%s" not found in NNKP file "%s"' % (name, self.fname))
+            self._parsed[name] = parser(block)
 
-    return rlv
+        return self._parsed[name]
 
+    def has_block(self, name):
+        return name.lower() in self._blocks or name.lower() in self._parsed
 
-def read_kpoints(fname, units='crystal'):
-    pattern = re.compile(r'(?:begin\s+kpoints)(?:\s+(?P<nkpts>[0-9]+)\s+)(?P<kpoints>.+)(?:end\s+kpoints)', re.IGNORECASE | re.DOTALL)
-    with open(fname, 'r') as f:
-        match = pattern.search(f.read())
-        if match is None:
-            raise Exception
+    def dlv(self, units='bohr'):
+        dlv = self._parse('real_lattice', lambda s: np.fromstring(s, sep='\n').reshape((3, 3)))
 
-    nkpts = int(match.group('nkpts'))
-    kpoints = np.fromstring(match.group('kpoints'), sep='\n').reshape((nkpts, 3))
+        return _utils.convert_units(dlv, 'angstrom', units)
 
-    if units == 'crystal':
-        pass
-    elif units == 'angstrom' or units == 'bohr':
-        rlv = read_rlv(fname, units)
-        kpoints = np.dot(kpoints, rlv)
+    def rlv(self, units='bohr'):
+        rlv = self._parse('recip_lattice', lambda s: np.fromstring(s, sep='\n').reshape((3, 3)))
 
-    return kpoints
+        return _utils.convert_units(rlv, 'angstrom', units, inverse=True)
 
+    def kpoints(self, units='crystal'):
+        def parser(s):
+            data = np.fromstring(s, sep='\n')
+            return data[1:].reshape((int(data[0]), 3))
 
-def read_projections(fname):
-    pattern = re.compile(r'(?:begin\s+(?P<spinor>spinor_)?projections)(?:\s+(?P<nproj>[0-9]+)\s+)(?P<projections>.+)(?:end\s+(?P=spinor)?projections)', re.IGNORECASE | re.DOTALL)
-    with open(fname, 'r') as f:
-        match = pattern.search(f.read())
-        if match is None:
-            raise Exception
-
-    nproj = int(match.group('nproj'))
-    spinors = match.group('spinor') is not None
-    raw_data = np.fromstring(match.group('projections'), sep='\n')
-
-    if not spinors:
-        raw_data = np.reshape(raw_data, (nproj, 13))
-    else:
-        raw_data = np.reshape(raw_data, (nproj, 17))
-
-    # create list of projections
-    # each projection is a dictionary
-    projections = []
-    for iproj in range(len(raw_data)):
-        proj = {}
-        proj['center'] = raw_data[iproj][:3]
-        proj['l'] = l = int(raw_data[iproj][3])
-        proj['mr'] = mr = int(raw_data[iproj][4])
-        proj['r'] = int(raw_data[iproj][5])
-        proj['z-axis'] = raw_data[iproj][6:9]
-        proj['x-axis'] = raw_data[iproj][9:12]
-        proj['zona'] = raw_data[iproj][12]
-        proj['spin'] = int(raw_data[iproj][13]) if spinors else None
-        proj['spin-axis'] = raw_data[iproj][14:] if spinors else None
-        proj['orbital'] = orbitals[l][mr]
-
-        projections.append(proj)
-
-    return projections
+        kpoints = np.copy(self._parse('kpoints', parser))
 
+        if units == 'crystal':
+            pass
+        elif units == 'angstrom' or units == 'bohr':
+            kpoints = np.dot(kpoints, self.rlv(units))
 
-def read_nnkpts(fname):
-    pattern = re.compile(r'(?:begin\s+nnkpts)(?:\s+(?P<nntot>[0-9]+)\s+)(?P<nnkpts>.+)(?:end\s+nnkpts)', re.IGNORECASE | re.DOTALL)
-    with open(fname, 'r') as f:
-        match = pattern.search(f.read())
-        if match is None:
-            raise Exception
+        return kpoints
 
-    nntot = int(match.group('nntot'))
-    raw_data = np.fromstring(match.group('nnkpts'), sep='\n', dtype=int).reshape((-1, 5))
+    def nnkpts(self):
+        def parser(s):
+            data = np.fromstring(s, sep='\n', dtype=int)
+            nntot = data[0]
+            raw_data = data[1:].reshape((-1, 5))
+            return raw_data[:, 1].reshape((-1, nntot)) - 1, raw_data[:, 2:].reshape((-1, nntot, 3))
 
-    kpb_kidx = raw_data[:, 1].reshape((-1, nntot)) - 1
-    kpb_g = raw_data[:, 2:].reshape((-1, nntot, 3))
+        (kpb_kidx, kpb_g) = self._parse('nnkpts', parser)
 
-    return kpb_kidx, kpb_g
+        return np.copy(kpb_kidx), np.copy(kpb_g)
 
+    def bvectors(self, units='angstrom'):
+        rlv = self.rlv(units=units)
+        kpoints = self.kpoints()
+        kpb_kidx, kpb_g = self.nnkpts()
 
-def read_bvectors(fname, units='angstrom'):
-    rlv = read_rlv(fname, units=units)
-    kpoints = read_kpoints(fname)
-    kpb_kidx, kpb_g = read_nnkpts(fname)
+        kpb = kpoints[kpb_kidx]
 
-    kpb = kpoints[kpb_kidx]
+        bvectors = kpb + kpb_g - kpoints[:, np.newaxis, :]
+        bvectors = np.einsum('kbi,ij->kbj', bvectors, rlv)
 
-    bvectors = kpb + kpb_g - kpoints[:, np.newaxis, :]
-    bvectors = np.einsum('kbi,ij->kbj', bvectors, rlv)
+        return bvectors
 
-    return bvectors
+    def projections(self):
+        spinors = self.has_block('spinor_projections')
+        name = 'spinor_projections' if spinors else 'projections'
+        raw_data = np.fromstring(self._parse(name, lambda s: s), sep='\n')
 
+        nproj = int(raw_data[0])
+        if not spinors:
+            raw_data = np.reshape(raw_data[1:], (nproj, 13))
+        else:
+            raw_data = np.reshape(raw_data[1:], (nproj, 17))
+
+        # create list of projections
+        # each projection is a dictionary
+        projections = []
+        for iproj in range(len(raw_data)):
+            proj = {}
+            proj['center'] = raw_data[iproj][:3]
+            proj['l'] = l = int(raw_data[iproj][3])
+            proj['mr'] = mr = int(raw_data[iproj][4])
+            proj['r'] = int(raw_data[iproj][5])
+            proj['z-axis'] = raw_data[iproj][6:9]
+            proj['x-axis'] = raw_data[iproj][9:12]
+            proj['zona'] = raw_data[iproj][12]
+            proj['spin'] = int(raw_data[iproj][13]) if spinors else None
+            proj['spin-axis'] = raw_data[iproj][14:] if spinors else None
+            proj['orbital'] = orbitals[l][mr]
+
+            projections.append(proj)
+
+        return projections
+
+    def excluded_bands(self):
+        bnd_idx = np.fromstring(self._parse('exclude_bands', lambda s: s), sep='\n')[1:]
+        bnd_idx -= 1
+
+        return bnd_idx
+
+
+@functools.lru_cache(maxsize=4)
+def _cached_nnkp_file(path, size, mtime):
+    return NnkpFile(path)
+
+
+def _nnkp_file(fname):
+    # successive reads of the same, unmodified file share a single NnkpFile
+    stat = os.stat(fname)
+    return _cached_nnkp_file(os.path.realpath(fname), stat.st_size, stat.st_mtime_ns)
+
+
+@cached()
+def read_dlv(fname, units='bohr'):
+    return _nnkp_file(fname).dlv(units)
+
+
+@cached()
+def read_rlv(fname, units='bohr'):
+    return _nnkp_file(fname).rlv(units)
 
-def read_excluded_bands(fname):
-    pattern = re.compile(r'(?:begin\s+exclude_bands)(.+)(?:end\s+exclude_bands)', re.IGNORECASE | re.DOTALL)
-    with open(fname, 'r') as f:
-        match = pattern.search(f.read())
-        if match is None:
-            raise Exception
 
-    bnd_idx = np.fromstring(match.group(1), sep='\n')[1:]
-    bnd_idx -= 1
+@cached()
+def read_kpoints(fname, units='crystal'):
+    return _nnkp_file(fname).kpoints(units)
+
+
+def read_projections(fname):
+    return _nnkp_file(fname).projections()
 
-    return bnd_idx
+
+@cached()
+def read_nnkpts(fname):
+    return _nnkp_file(fname).nnkpts()
+
+
+@cached()
+def read_bvectors(fname, units='angstrom'):
+    return _nnkp_file(fname).bvectors(units)
+
+
+@cached()
+def read_excluded_bands(fname):
+    return _nnkp_file(fname).excluded_bands()
@@ -60,6 +60,10 @@ spinors_regex = re.compile(
     )
 spin_regex = re.compile(r'[(](?P<up>u)?,?(?P<dn>d)?[)]')
 quant_dir_regex = re.compile(r'[\[](?P<quant_dir>.+)[\]]$')
+dis_window_regex = re.compile(
+    r'^\s*(?P<key>dis_(win|froz)_(min|max))\s*[=:]?\s*(?P<value>\S+)',
+    re.VERBOSE | re.IGNORECASE | re.MULTILINE
+    )
 
 
 def remove_comments(s):
@@ -288,6 +292,32 @@ def read_kgrid(fname):
     return kgrid
 
 
+def read_dis_windows(fname):
+    """
+    Read the outer and frozen energy windows for disentanglement from WIN file.
+
+    Parameters
+    ----------
+    fname : str
+        Wannier90 WIN file
+
+    Returns
+    -------
+    dict
+        the values of ``dis_win_min``, ``dis_win_max``, ``dis_froz_min``,
+        and ``dis_froz_max`` that are set in the file, in eV
+
+    """
+    with open(fname, 'r') as f:
+        contents = remove_comments(f.read())
+
+    windows = {}
+    for match in dis_window_regex.finditer(contents):
+        windows[match.group('key').lower()] = float(match.group('value').lower().replace('d', 'e'))
+
+    return windows
+
+
 def read_kpoints(fname):
     with open(fname, 'r') as f:
         match = kpoints_regex.search(f.read())
@@ -0,0 +1,166 @@
+"""Maximal localization of Wannier functions by minimization of the spread"""
+import collections
+
+import numpy as np
+
+from . import sprd
+from ._mmn import rotate_mmn
+from ._mmn import update_mmn
+from ._utils import expm_antihermitian
+
+
+__all__ = ['LocalizationResult', 'localize']
+
+
+LocalizationResult = collections.namedtuple(
+    'LocalizationResult',
+    ['umn', 'mmn', 'centers', 'spreads', 'omega', 'history', 'converged']
+)
+LocalizationResult.__doc__ = """\
+Result of the minimization of the spread
+
+umn : ndarray, shape (nkpts, nbnds, nwann)
+    the optimized gauge
+mmn : ndarray, shape (nkpts, nntot, nwann, nwann)
+    the overlap matrices in the optimized gauge
+centers : ndarray, shape (nwann, 3)
+spreads : ndarray, shape (nwann,)
+omega : float
+history : ndarray, shape (niter+1,)
+    the spread at each iteration, starting from the initial gauge
+converged : bool
+"""
+
+
+def _inner(a, b):
+    # real inner product of anti-Hermitian matrices, summed over k-points
+    return np.vdot(a, b).real
+
+
+def localize(mmn, kpb_kidx, bvectors, bweights, umn, maxiter=200, tol=1e-10, conv_window=3,
+             method='cg', trial_step=2.0, cg_restart=5, recompute_every=10):
+    """
+    Minimize the spread functional with respect to the gauge at each k-point
+
+    The gauge is updated as :math:`U^{(\\mathbf{k})} \\rightarrow
+    U^{(\\mathbf{k})}\\exp(\\alpha D^{(\\mathbf{k})})`, along the gradient
+    :math:`G^{(\\mathbf{k})}` of the spread (steepest descent) or a conjugate
+    direction (conjugate gradient), with the step :math:`\\alpha` from a
+    parabolic fit of the spread along the search direction, as in wannier90.
+
+    The overlap matrices in the current gauge are updated incrementally with
+    :func:`w90utils.update_mmn` after each step, and recomputed from ``mmn``
+    every ``recompute_every`` steps so that rounding errors do not accumulate.
+
+    Parameters
+    ----------
+    mmn : ndarray, shape (nkpts, nntot, nbnds, nbnds)
+        the overlap matrices
+    kpb_kidx : ndarray, shape (nkpts, nntot)
+    bvectors : ndarray, shape (nkpts, nntot, 3)
+    bweights : ndarray, shape (nntot,)
+    umn : ndarray, shape (nkpts, nbnds, nwann)
+        the initial gauge, for example ``unitarize(amn)``
+    maxiter : int, optional
+        maximum number of iterations
+    tol : float, optional
+        the minimization is converged when the change in the spread is less
+        than ``tol`` for ``conv_window`` consecutive iterations
+    conv_window : int, optional
+    method : {'cg', 'sd'}, optional
+        conjugate gradient or steepest descent
+    trial_step : float, optional
+        trial step of the line search, in units of :math:`1/(4\\sum_b w_b)`
+    cg_restart : int, optional
+        number of iterations after which the conjugate gradient is restarted
+        along the gradient
+    recompute_every : int, optional
+        number of steps after which the overlap matrices are recomputed from
+        ``mmn`` instead of updated incrementally
+
+    Returns
+    -------
+    LocalizationResult
+
+    """
+    if method not in ('cg', 'sd'):
+        raise ValueError('unknown method: %s' % method)
+
+    umn = np.array(umn, dtype=complex)
+    calc = sprd.SpreadCalculator(bvectors, bweights)
+    step_unit = 1 / (4 * np.sum(bweights))
+
+    def take_step(alpha, d):
+        expw = expm_antihermitian(alpha * d)
+        return np.matmul(umn, expw), update_mmn(m, expw, kpb_kidx, out=np.empty_like(m))
+
+    m = rotate_mmn(mmn, umn, kpb_kidx)
+    (components, g) = calc.components_and_gradient(m)
+    history = [components.omega]
+
+    d = None
+    gg_prev = None
+    nsmall = 0
+    nsteps = 0
+    converged = False
+    for it in range(maxiter):
+        gg = _inner(g, g)
+
+        # search direction, restarted along the gradient periodically, and
+        # whenever the conjugate direction is not a descent direction
+        if method == 'cg' and d is not None and it % cg_restart != 0:
+            d = g + (gg / gg_prev) * d
+            if _inner(g, d) <= 0:
+                d = g
+        else:
+            d = g
+        gg_prev = gg
+
+        # dOmega/dalpha at alpha = 0, which is negative along d
+        slope = -1 * _inner(g, d)
+        if slope >= 0:
+            converged = True
+            break
+
+        # parabolic fit through the spread at 0 and at the trial step
+        alpha_trial = trial_step * step_unit
+        (u_trial, m_trial) = take_step(alpha_trial, d)
+        omega_trial = calc.components(m_trial).omega
+
+        curvature = (omega_trial - components.omega - slope * alpha_trial) / alpha_trial**2
+        if curvature > 0:
+            alpha = -1 * slope / (2 * curvature)
+            (u_new, m_new) = take_step(alpha, d)
+            (components_new, g_new) = calc.components_and_gradient(m_new)
+            if components_new.omega > omega_trial:
+                (u_new, m_new) = (u_trial, m_trial)
+                (components_new, g_new) = calc.components_and_gradient(m_new)
+        else:
+            (u_new, m_new) = (u_trial, m_trial)
+            (components_new, g_new) = calc.components_and_gradient(m_new)
+
+        # restart along the gradient with a smaller trial step if the spread
+        # did not decrease
+        if components_new.omega > components.omega:
+            d = None
+            trial_step /= 2
+            history.append(components.omega)
+            continue
+
+        delta = components.omega - components_new.omega
+        (umn, m, components, g) = (u_new, m_new, components_new, g_new)
+        history.append(components.omega)
+
+        nsteps += 1
+        if nsteps % recompute_every == 0:
+            m = rotate_mmn(mmn, umn, kpb_kidx)
+            (components, g) = calc.components_and_gradient(m)
+
+        nsmall = nsmall + 1 if delta < tol else 0
+        if nsmall >= conv_window:
+            converged = True
+            break
+
+    return LocalizationResult(
+        umn, m, components.centers, components.spreads, components.omega, np.array(history), converged
+    )
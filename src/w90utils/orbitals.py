@@ -0,0 +1,201 @@
+"""Trial orbitals of the projections, as defined by wannier90"""
+import numpy as np
+
+
+__all__ = ['real_harmonics', 'angular', 'radial', 'trial_orbital']
+
+
+def _harmonics_s(x, y, z):
+    return [np.full_like(x, 1 / np.sqrt(4*np.pi))]
+
+
+def _harmonics_p(x, y, z):
+    c = np.sqrt(3 / (4*np.pi))
+    return [c*z, c*x, c*y]
+
+
+def _harmonics_d(x, y, z):
+    return [
+        np.sqrt(5 / (16*np.pi)) * (3*z**2 - 1),
+        np.sqrt(15 / (4*np.pi)) * x*z,
+        np.sqrt(15 / (4*np.pi)) * y*z,
+        np.sqrt(15 / (16*np.pi)) * (x**2 - y**2),
+        np.sqrt(15 / (16*np.pi)) * 2*x*y,
+    ]
+
+
+def _harmonics_f(x, y, z):
+    return [
+        np.sqrt(7) / (4*np.sqrt(np.pi)) * (5*z**3 - 3*z),
+        np.sqrt(21) / (4*np.sqrt(2*np.pi)) * x*(5*z**2 - 1),
+        np.sqrt(21) / (4*np.sqrt(2*np.pi)) * y*(5*z**2 - 1),
+        np.sqrt(105) / (4*np.sqrt(np.pi)) * z*(x**2 - y**2),
+        np.sqrt(105) / (4*np.sqrt(np.pi)) * 2*x*y*z,
+        np.sqrt(35) / (4*np.sqrt(2*np.pi)) * x*(x**2 - 3*y**2),
+        np.sqrt(35) / (4*np.sqrt(2*np.pi)) * y*(3*x**2 - y**2),
+    ]
+
+
+_harmonics = {0: _harmonics_s, 1: _harmonics_p, 2: _harmonics_d, 3: _harmonics_f}
+
+# the hybrids as combinations of the real harmonics (l, mr), in the order of
+# wannier90 User Guide Table 3.2
+_s3 = 1 / np.sqrt(3)
+_s6 = 1 / np.sqrt(6)
+_s2 = 1 / np.sqrt(2)
+_s12 = 1 / np.sqrt(12)
+_hybrids = {
+    -1: [
+        {(0, 1): _s2, (1, 2): _s2},
+        {(0, 1): _s2, (1, 2): -_s2},
+    ],
+    -2: [
+        {(0, 1): _s3, (1, 2): -_s6, (1, 3): _s2},
+        {(0, 1): _s3, (1, 2): -_s6, (1, 3): -_s2},
+        {(0, 1): _s3, (1, 2): 2*_s6},
+    ],
+    -3: [
+        {(0, 1): 0.5, (1, 2): 0.5, (1, 3): 0.5, (1, 1): 0.5},
+        {(0, 1): 0.5, (1, 2): 0.5, (1, 3): -0.5, (1, 1): -0.5},
+        {(0, 1): 0.5, (1, 2): -0.5, (1, 3): 0.5, (1, 1): -0.5},
+        {(0, 1): 0.5, (1, 2): -0.5, (1, 3): -0.5, (1, 1): 0.5},
+    ],
+    -4: [
+        {(0, 1): _s3, (1, 2): -_s6, (1, 3): _s2},
+        {(0, 1): _s3, (1, 2): -_s6, (1, 3): -_s2},
+        {(0, 1): _s3, (1, 2): 2*_s6},
+        {(1, 1): _s2, (2, 1): _s2},
+        {(1, 1): -_s2, (2, 1): _s2},
+    ],
+    -5: [
+        {(0, 1): _s6, (1, 2): -_s2, (2, 1): -_s12, (2, 4): 0.5},
+        {(0, 1): _s6, (1, 2): _s2, (2, 1): -_s12, (2, 4): 0.5},
+        {(0, 1): _s6, (1, 3): -_s2, (2, 1): -_s12, (2, 4): -0.5},
+        {(0, 1): _s6, (1, 3): _s2, (2, 1): -_s12, (2, 4): -0.5},
+        {(0, 1): _s6, (1, 1): -_s2, (2, 1): 2*_s12},
+        {(0, 1): _s6, (1, 1): _s2, (2, 1): 2*_s12},
+    ],
+}
+
+
+def _unit_vectors(xyz):
+    xyz = np.asarray(xyz, dtype=float)
+    r = np.linalg.norm(xyz, axis=-1)
+    # the direction at the origin is arbitrary, and taken to be zero
+    return xyz / np.where(r > 0, r, 1)[..., np.newaxis], r
+
+
+def real_harmonics(l, xyz):
+    """
+    Evaluate the real spherical harmonics of wannier90 for an angular momentum
+
+    Parameters
+    ----------
+    l : int
+        angular momentum, from 0 to 3
+    xyz : ndarray, shape (..., 3)
+        Cartesian vectors, of which only the direction is used
+
+    Returns
+    -------
+    ndarray, shape (2*l+1, ...)
+        the harmonics, in the order of ``mr`` in wannier90 User Guide
+        Table 3.1
+
+    """
+    if l not in _harmonics:
+        raise ValueError('unknown angular momentum: %d' % l)
+    (u, _) = _unit_vectors(xyz)
+
+    return np.array(_harmonics[l](u[..., 0], u[..., 1], u[..., 2]))
+
+
+def angular(l, mr, xyz):
+    """
+    Evaluate the angular part of a trial orbital
+
+    Parameters
+    ----------
+    l : int
+        angular momentum, or a negative number for the hybrids
+    mr : int
+        the orbital for the angular momentum, starting from one, as in
+        wannier90 User Guide Tables 3.1 and 3.2
+    xyz : ndarray, shape (..., 3)
+
+    Returns
+    -------
+    ndarray, shape (...)
+
+    """
+    if l >= 0:
+        return real_harmonics(l, xyz)[mr-1]
+
+    if l not in _hybrids:
+        raise ValueError('unknown hybrid: %d' % l)
+    coefficients = _hybrids[l][mr-1]
+    harmonics = {l_: real_harmonics(l_, xyz) for l_ in set(l_ for (l_, _) in coefficients)}
+
+    return sum(c * harmonics[l_][mr_-1] for ((l_, mr_), c) in coefficients.items())
+
+
+def radial(r, zona=1.0, ir=1):
+    """
+    Evaluate the hydrogenic radial part of a trial orbital
+
+    Parameters
+    ----------
+    r : ndarray
+        distances from the center
+    zona : float, optional
+        the diffusivity :math:`Z/a`, in the inverse units of ``r``
+    ir : int, optional
+        the radial function, from 1 to 3, as in wannier90 User Guide Table 3.3
+
+    Returns
+    -------
+    ndarray
+
+    """
+    ar = zona * np.asarray(r, dtype=float)
+    if ir == 1:
+        return 2 * zona**1.5 * np.exp(-1 * ar)
+    elif ir == 2:
+        return 1 / (2*np.sqrt(2)) * zona**1.5 * (2 - ar) * np.exp(-1 * ar / 2)
+    elif ir == 3:
+        return np.sqrt(4 / 27) * zona**1.5 * (1 - 2*ar/3 + 2*ar**2/27) * np.exp(-1 * ar / 3)
+    else:
+        raise ValueError('unknown radial function: %d' % ir)
+
+
+def trial_orbital(xyz, l, mr, ir=1, zona=1.0, z_axis=(0, 0, 1), x_axis=(1, 0, 0)):
+    """
+    Evaluate a trial orbital
+
+    Parameters
+    ----------
+    xyz : ndarray, shape (..., 3)
+        Cartesian positions, relative to the center of the orbital
+    l, mr : int
+        see :func:`angular`
+    ir : int, optional
+        see :func:`radial`
+    zona : float, optional
+        in the inverse units of ``xyz``
+    z_axis, x_axis : array_like, shape (3,), optional
+        the axes of the orbital, which are orthogonalized and normalized
+
+    Returns
+    -------
+    ndarray, shape (...)
+
+    """
+    z_axis = np.asarray(z_axis, dtype=float) / np.linalg.norm(z_axis)
+    x_axis = np.asarray(x_axis, dtype=float) - np.dot(x_axis, z_axis) * z_axis
+    x_axis /= np.linalg.norm(x_axis)
+    y_axis = np.cross(z_axis, x_axis)
+
+    # the positions in the frame of the orbital
+    xyz = np.dot(xyz, np.transpose([x_axis, y_axis, z_axis]))
+
+    return radial(np.linalg.norm(xyz, axis=-1), zona, ir) * angular(l, mr, xyz)
@@ -0,0 +1,152 @@
+"""Wannier functions on a real-space supercell grid"""
+import concurrent.futures
+import os
+
+import numpy as np
+
+from ._mmn import _full_umn
+from .io import read_unk
+from .io._unk import _read_header
+
+
+__all__ = ['wannier_functions', 'supercell_grid']
+
+
+def supercell_grid(dlv, grid, supercell):
+    """
+    Find the origin and the steps of the supercell grid of :func:`wannier_functions`
+
+    Parameters
+    ----------
+    dlv : ndarray, shape (3, 3)
+        direct lattice vectors
+    grid : tuple of int
+        the real-space grid of the unit cell, ``(ngx, ngy, ngz)``
+    supercell : tuple of int
+
+    Returns
+    -------
+    origin : ndarray, shape (3,)
+        the first point of the grid, in the units of ``dlv``
+    voxel : ndarray, shape (3, 3)
+        the steps between the points of the grid along each axis
+
+    """
+    dlv = np.asarray(dlv, dtype=float)
+    origin = np.dot(-1 * (np.asarray(supercell) // 2), dlv)
+    voxel = dlv / np.asarray(grid)[:, np.newaxis]
+
+    return origin, voxel
+
+
+def _phase_grid(kpoint, grid):
+    # exp(2 pi i k.r) for the points r of the unit-cell grid, in crystal
+    # coordinates
+    phases = [np.exp(2j*np.pi*kpoint[i]*np.arange(grid[i])/grid[i]) for i in range(3)]
+    return phases[0][:, np.newaxis, np.newaxis] * phases[1][:, np.newaxis] * phases[2]
+
+
+def wannier_functions(unk_dir, umat, umat_opt, kpoints, supercell=(3, 3, 3), wann_idx=None, windows=None, spin=1,
+                      workers=None):
+    """
+    Compute the Wannier functions on a supercell grid
+
+    Computes :math:`w_m(\\mathbf{r}) = \\frac{1}{N}\\sum_\\mathbf{k}
+    e^{i\\mathbf{k}\\cdot\\mathbf{r}}\\sum_n U_{nm}^{(\\mathbf{k})}
+    u_{n\\mathbf{k}}(\\mathbf{r})` on the supercell grid, as in wannier90,
+    with the global phase of each Wannier function chosen so that it is real
+    where its modulus is the largest.
+
+    The UNK files are read one k-point at a time, the next one while the
+    current one is accumulated into the supercell, so that only the Wannier
+    functions and the Bloch functions at two k-points are held in memory. The
+    selected Wannier functions are accumulated in chunks by ``workers``
+    threads.
+
+    Parameters
+    ----------
+    unk_dir : str
+        directory of the ``UNKnnnnn.s`` files
+    umat : ndarray, shape (nkpts, nwann, nwann)
+    umat_opt : ndarray, shape (nkpts, nbnds, nwann)
+        the optimal subspace, or None if there is no disentanglement
+    kpoints : ndarray, shape (nkpts, 3)
+        k-points, in crystal coordinates
+    supercell : tuple of int, optional
+        the number of unit cells of the supercell along each axis, the
+        origin of the grid is given by :func:`supercell_grid`
+    wann_idx : array_like of int, optional
+        the Wannier functions to compute, by default all
+    windows : ndarray, shape (nkpts, nbnds), optional
+        masks of the bands inside the outer window, if the rows of
+        ``umat_opt`` are those of the bands inside the window, as in the
+        checkpoint file
+    spin : int, optional
+        the spin channel ``s`` in the names of the files
+    workers : int, optional
+        number of threads accumulating the Wannier functions
+
+    Returns
+    -------
+    ndarray, shape (nwann_idx, supercell[0]*ngx, supercell[1]*ngy, supercell[2]*ngz)
+
+    """
+    kpoints = np.asarray(kpoints, dtype=float)
+    nkpts = len(kpoints)
+    supercell = tuple(int(n) for n in supercell)
+
+    umn = np.asarray(umat)
+    if umat_opt is not None:
+        umn = np.matmul(_full_umn(umat_opt, windows, np.shape(umat_opt)[1]), umn)
+    if wann_idx is None:
+        wann_idx = np.arange(umn.shape[2])
+    umn = umn[:, :, wann_idx]
+    nsel = umn.shape[2]
+
+    def fname(ikpt):
+        return os.path.join(unk_dir, 'UNK%05d.%d' % (ikpt+1, spin))
+
+    (grid, _, nbnds) = _read_header(fname(0))
+    if nbnds != umn.shape[1]:
+        raise ValueError('the UNK files have %d bands, instead of %d' % (nbnds, umn.shape[1]))
+
+    # the supercell grid, with the unit cells and the points within each unit
+    # cell along separate axes
+    wann = np.zeros((nsel, supercell[0], grid[0], supercell[1], grid[1], supercell[2], grid[2]), dtype=complex)
+    cells = [np.arange(n) - n // 2 for n in supercell]
+
+    chunk_size = -(-nsel // (workers or 1))
+    chunks = [slice(start, min(start+chunk_size, nsel)) for start in range(0, nsel, chunk_size)]
+
+    def accumulate(kpoint, unk, u, chunk):
+        # sum_n U_nm u_nk(r) exp(i k.r) over the unit cell, and its translations
+        wk = np.dot(u[:, chunk].T, unk.reshape((nbnds, -1))).reshape((-1,) + grid) * _phase_grid(kpoint, grid)
+        for (i, ci) in enumerate(cells[0]):
+            for (j, cj) in enumerate(cells[1]):
+                for (k, ck) in enumerate(cells[2]):
+                    phase = np.exp(2j*np.pi*np.dot(kpoint, [ci, cj, ck]))
+                    wann[chunk, i, :, j, :, k, :] += phase * wk
+
+    buffers = [np.empty((nbnds,) + grid, dtype=complex) for _ in range(2)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(chunks)+1) as executor:
+        pending = executor.submit(read_unk, fname(0), out=buffers[0])
+        for ikpt in range(nkpts):
+            unk = pending.result()
+            if ikpt+1 < nkpts:
+                pending = executor.submit(read_unk, fname(ikpt+1), out=buffers[(ikpt+1) % 2])
+            for future in [executor.submit(accumulate, kpoints[ikpt], unk, umn[ikpt], chunk) for chunk in chunks]:
+                future.result()
+
+    wann = wann.reshape((nsel, supercell[0]*grid[0], supercell[1]*grid[1], supercell[2]*grid[2]))
+    # the UNK files are read normalized on the unit-cell grid, and wannier90
+    # uses them as written
+    wann *= np.sqrt(np.prod(grid)) / nkpts
+
+    # the global phase, as in wannier90, which is left as is for Wannier
+    # functions that vanish everywhere
+    imax = np.argmax(np.abs(wann.reshape((nsel, -1))), axis=1)
+    wmax = wann.reshape((nsel, -1))[np.arange(nsel), imax]
+    phase = np.divide(wmax, np.abs(wmax), out=np.ones(nsel, dtype=complex), where=np.abs(wmax) > 0)
+    wann /= phase[:, np.newaxis, np.newaxis, np.newaxis]
+
+    return wann
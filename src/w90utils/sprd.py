@@ -1,25 +1,24 @@
 """Functions for computing Wannier centers and components of the spread"""
+import collections
 
 import numpy as np
 
+from . import io as w90io
+from ._mmn import _full_umn, _rotate_blocks
+from .io._mmn import _read_mmn_header
 
-def wannier_centers(m, bvectors, bweights):
-    (nkpts, nntot, nwann) = m.shape[:-1]
 
-    mii = m.reshape((nkpts*nntot, nwann, nwann)).diagonal(offset=0, axis1=1, axis2=2)
+SpreadComponents = collections.namedtuple(
+    'SpreadComponents',
+    ['centers', 'spreads', 'omega_i', 'omega_d', 'omega_od', 'omega']
+)
+SpreadComponents.__doc__ = """\
+Wannier centers, the spread of each Wannier function, and the components of
+the spread functional"""
 
-    bvectors = np.reshape(bvectors, (-1, 3))
-    bweights = np.tile(bweights, nkpts)
 
-    bwv = bweights[:, np.newaxis] * bvectors
-
-    # Eq. 31
-    rv = np.zeros((nwann, 3))
-    for i in range(nwann):
-        rv[i] = -1 * np.sum(bwv * np.imag(np.log(mii[:, i]))[:, np.newaxis], axis=0)
-    rv /= nkpts
-
-    return rv
+def wannier_centers(m, bvectors, bweights):
+    return SpreadCalculator(bvectors, bweights).centers(m)
 
 
 def omega_d(m, bvectors, bweights, idx=None):   # Eq. 36
@@ -154,7 +153,290 @@ def omega(Mmn, bvectors, bweights):
     bweights: ndarray, shape (nntot,)
 
     """
-    sprd_d = omega_d(Mmn, bvectors, bweights)
-    sprd_iod = omega_iod(Mmn, bweights)
+    return spread_components(Mmn, bvectors, bweights).omega
+
+
+class SpreadCalculator(object):
+    """
+    Compute the Wannier centers and all components of the spread functional
+    together, for overlap matrices on a given k-point mesh
+
+    The weighted b-vectors are computed once, so a calculator can be reused for
+    any number of overlap matrices with the same b-vectors and weights.
+
+    Parameters
+    ----------
+    bvectors: ndarray, shape (nkpts, nntot, 3)
+    bweights: ndarray, shape (nntot,)
+
+    """
+    def __init__(self, bvectors, bweights):
+        bvectors = np.asarray(bvectors, dtype=float)
+        (nkpts, nntot) = bvectors.shape[:2]
+
+        self.nkpts = nkpts
+        self.nntot = nntot
+        self.bvectors = bvectors
+        self.bweights = np.broadcast_to(np.asarray(bweights, dtype=float), (nkpts, nntot))
+        self.bwv = self.bweights[..., np.newaxis] * bvectors
+
+    def _blocks(self, m, kstart=0):
+        (nkpts, nntot, nwann) = m.shape[:-1]
+        kslice = slice(kstart, kstart+nkpts)
+
+        bweights = self.bweights[kslice].reshape(-1)
+        bvectors = self.bvectors[kslice].reshape((-1, 3))
+        bwv = self.bwv[kslice].reshape((-1, 3))
+
+        m = m.reshape((nkpts*nntot, nwann, nwann))
+        mii = m.diagonal(offset=0, axis1=1, axis2=2)
+
+        return (m, mii, -1 * np.imag(np.log(mii)), bweights, bvectors, bwv)
+
+    def centers(self, m):
+        """
+        Compute the Wannier centers
+
+        Parameters
+        ----------
+        m: ndarray, shape (nkpts, nntot, nwann, nwann)
+            the overlap matrix
+
+        Returns
+        -------
+        ndarray, shape (nwann, 3)
+
+        """
+        (_, _, phi, _, _, bwv) = self._blocks(m)
+
+        # Eq. 31
+        return np.dot(phi.T, bwv) / self.nkpts
+
+    def _evaluate(self, m, gradient=False):
+        (nkpts, nntot, nwann) = m.shape[:-1]
+        (m, mii, phi, bweights, bvectors, bwv) = self._blocks(m)
+
+        # Eq. 31
+        rv = np.dot(phi.T, bwv) / self.nkpts
+
+        # Eq. 36
+        phi_d = phi - np.dot(bvectors, rv.T)
+        sprd_d = np.sum(np.dot(bweights, phi_d**2)) / self.nkpts
+
+        # Eq. 43
+        sprd_iod = np.dot(bweights, 1 - np.abs(mii)**2) / self.nkpts
+
+        abs2 = np.einsum('bij,bij->b', m.conj(), m).real
+        sprd_i = (nwann * np.sum(bweights) - np.dot(bweights, abs2)) / self.nkpts
+        sprd_od = np.sum(sprd_iod) - sprd_i
+
+        spreads = sprd_iod + np.dot(bweights, phi**2) / self.nkpts - np.sum(rv**2, axis=1)
+
+        components = SpreadComponents(rv, spreads, sprd_i, sprd_d, sprd_od, sprd_i + sprd_d + sprd_od)
+
+        if not gradient:
+            return components, None
+
+        # Eq. 52, with R_mn = M_mn M_nn^* and T_mn = M_mn / M_nn q_n, where
+        # q_n = Im ln M_nn + b.r_n
+        r = m * mii.conj()[:, np.newaxis, :]
+        t = m * (-1 * phi_d / mii)[:, np.newaxis, :]
+        a_r = (r - r.conj().swapaxes(1, 2)) / 2
+        s_t = (t + t.conj().swapaxes(1, 2)) / 2j
+        g = 4 * np.sum((bweights[:, np.newaxis, np.newaxis] * (a_r - s_t)).reshape((nkpts, nntot, nwann, nwann)), axis=1)
+        g /= self.nkpts
+
+        return components, g
+
+    def components(self, m):
+        """
+        Compute the Wannier centers, the spread of each Wannier function, and
+        the components of the spread functional
+
+        Parameters
+        ----------
+        m: ndarray, shape (nkpts, nntot, nwann, nwann)
+            the overlap matrix
+
+        Returns
+        -------
+        SpreadComponents
+
+        """
+        return self._evaluate(m)[0]
+
+    def gradient(self, m):
+        """
+        Compute the gradient of the spread functional with respect to
+        infinitesimal anti-Hermitian rotations
+        :math:`U^{(\mathbf{k})} \rightarrow U^{(\mathbf{k})}(1 + dW^{(\mathbf{k})})`
+
+        Parameters
+        ----------
+        m: ndarray, shape (nkpts, nntot, nwann, nwann)
+            the overlap matrix
+
+        Returns
+        -------
+        ndarray, shape (nkpts, nwann, nwann)
+            the anti-Hermitian gradient :math:`G^{(\mathbf{k})}` of Eq. 52, such
+            that :math:`d\Omega = \sum_\mathbf{k} \mathrm{Re}\,\mathrm{tr}[G^{(\mathbf{k})} dW^{(\mathbf{k})}]`,
+            so that :math:`dW^{(\mathbf{k})} = \epsilon G^{(\mathbf{k})}` with
+            :math:`\epsilon > 0` lowers the spread
+
+        """
+        return self._evaluate(m, gradient=True)[1]
+
+    def components_and_gradient(self, m):
+        """
+        Compute the components of the spread functional and its gradient
+        together, see :meth:`components` and :meth:`gradient`
+
+        Returns
+        -------
+        SpreadComponents
+        ndarray, shape (nkpts, nwann, nwann)
+
+        """
+        return self._evaluate(m, gradient=True)
 
-    return sprd_d + sprd_iod
+    def _sums(self, m, kstart=0):
+        # sums over the (k, b) blocks of m from which all components of the
+        # spread follow, so that they can be accumulated over chunks of k-points
+        (m, mii, phi, bweights, bvectors, bwv) = self._blocks(m, kstart)
+
+        return (
+            np.sum(bweights),
+            np.dot(bweights, np.einsum('bij,bij->b', m.conj(), m).real),
+            np.dot(bweights, 1 - np.abs(mii)**2),
+            np.dot(bweights, phi**2),
+            np.dot(phi.T, bwv),
+            np.dot(bwv.T, bvectors),
+        )
+
+    def _components_from_sums(self, sums, nwann):
+        (s_w, s_abs2, s_iod, s_phi2, s_bphi, s_bb) = [np.asarray(s) / self.nkpts for s in sums]
+
+        # Eq. 31
+        rv = s_bphi
+
+        # Eq. 36, expanded so that it follows from sums over the blocks alone
+        sprd_d = np.sum(s_phi2) - 2 * np.sum(rv * s_bphi) + np.einsum('ni,ij,nj->', rv, s_bb, rv)
+        sprd_iod = np.sum(s_iod)
+        sprd_i = nwann * s_w - s_abs2
+        sprd_od = sprd_iod - sprd_i
+
+        spreads = s_iod + s_phi2 - np.sum(rv**2, axis=1)
+
+        return SpreadComponents(rv, spreads, sprd_i, sprd_d, sprd_od, sprd_i + sprd_d + sprd_od)
+
+    def components_from_mmn(self, fname, umn=None, window=None, chunk_size=None):
+        """
+        Compute the Wannier centers and the components of the spread functional
+        from an MMN file, without reading all of the overlap matrices into
+        memory
+
+        See :func:`spread_components_from_mmn`.
+
+        """
+        with open(fname, 'r') as f:
+            (_, nbnds, nkpts, nntot) = _read_mmn_header(f)
+        if nkpts * nntot == 0:
+            raise ValueError('MMN file "%s" has no overlap matrices' % fname)
+
+        nwann = nbnds
+        if umn is not None:
+            umn = _full_umn(umn, window, nbnds)
+            nwann = umn.shape[2]
+
+        sums = None
+        for (kstart, m, kpb_kidx, _) in w90io.iter_mmn_chunks(fname, chunk_size=chunk_size):
+            if umn is not None:
+                m = _rotate_blocks(m, umn[kstart:(kstart+len(m))], umn[kpb_kidx])
+
+            chunk_sums = self._sums(m, kstart)
+            sums = chunk_sums if sums is None else [a + b for (a, b) in zip(sums, chunk_sums)]
+
+        return self._components_from_sums(sums, nwann)
+
+
+def spread_components(m, bvectors, bweights):
+    """
+    Compute the Wannier centers, the spread of each Wannier function, and the
+    components of the spread functional in a single pass over the overlap
+    matrices
+
+    Parameters
+    ----------
+    m: ndarray, shape (nkpts, nntot, nwann, nwann)
+        the overlap matrix
+    bvectors: ndarray, shape (nkpts, nntot, 3)
+    bweights: ndarray, shape (nntot,)
+
+    Returns
+    -------
+    SpreadComponents
+
+    """
+    return SpreadCalculator(bvectors, bweights).components(m)
+
+
+def omega_gradient(m, bvectors, bweights):
+    """
+    Compute the gradient of the spread functional with respect to infinitesimal
+    anti-Hermitian rotations of the gauge at each k-point
+
+    Parameters
+    ----------
+    m: ndarray, shape (nkpts, nntot, nwann, nwann)
+        the overlap matrix
+    bvectors: ndarray, shape (nkpts, nntot, 3)
+    bweights: ndarray, shape (nntot,)
+
+    Returns
+    -------
+    ndarray, shape (nkpts, nwann, nwann)
+
+    See Also
+    --------
+    SpreadCalculator.gradient
+
+    """
+    return SpreadCalculator(bvectors, bweights).gradient(m)
+
+
+def spread_components_from_mmn(fname, bvectors, bweights, umn=None, window=None, chunk_size=None):
+    """
+    Compute the Wannier centers and the components of the spread functional
+    from an MMN file, without reading all of the overlap matrices into memory
+
+    The overlap matrices are read from the file a chunk of k-points at a time,
+    and optionally rotated by :math:`U^{(\mathbf{k})}`, so that the memory used
+    is bounded by the size of one chunk.
+
+    Parameters
+    ----------
+    fname : str
+        name of the MMN file
+    bvectors: ndarray, shape (nkpts, nntot, 3)
+    bweights: ndarray, shape (nntot,)
+    umn : ndarray, shape (nkpts, nbnds, nwann), optional
+        the gauge in which to compute the spread, see
+        :func:`w90utils.rotate_mmn`
+    window : ndarray, shape (nkpts, nbnds), optional
+        boolean masks or indices of the bands inside the window at each
+        k-point, see :func:`w90utils.rotate_mmn`
+    chunk_size : int, optional
+        number of k-points read at a time
+
+    Returns
+    -------
+    SpreadComponents
+
+    Raises
+    ------
+    ValueError
+        if the file has no overlap matrices
+
+    """
+    return SpreadCalculator(bvectors, bweights).components_from_mmn(fname, umn=umn, window=window, chunk_size=chunk_size)
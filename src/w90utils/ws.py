@@ -0,0 +1,170 @@
+"""Wigner-Seitz supercell of the k-point grid"""
+import functools
+
+import numpy as np
+
+
+__all__ = ['wigner_seitz', 'ws_distance']
+
+
+# number of lattice vectors tested at a time
+_CHUNK_SIZE = 2**14
+
+
+def _supercell_images(grid, search_size):
+    images = np.indices((2*search_size+1,)*3).reshape((3, -1)).T - search_size
+    return images * grid
+
+
+@functools.lru_cache(maxsize=16)
+def _wigner_seitz(grid, dlv, search_size, tol):
+    grid = np.array(grid, dtype=int)
+    metric = np.dot(np.reshape(dlv, (3, 3)), np.reshape(dlv, (3, 3)).T)
+
+    # the images of the lattice vectors at the edge of the search range are
+    # searched one supercell further, as in wannier90
+    images = _supercell_images(grid, search_size+1)
+    iorigin = len(images) // 2
+    images_metric = np.einsum('ri,ij,rj->r', images, metric, images)
+
+    # all lattice vectors in the search range, with the last index running
+    # fastest, as in the loops of wannier90
+    ranges = [np.arange(-search_size*n, search_size*n+1) for n in grid]
+    nvectors = np.stack(np.meshgrid(*ranges, indexing='ij'), axis=-1).reshape((-1, 3))
+
+    Rvectors = []
+    ndegen = []
+    for start in range(0, len(nvectors), _CHUNK_SIZE):
+        n = nvectors[start:(start+_CHUNK_SIZE)]
+        # |n - T|^2 in the metric, for all supercell lattice vectors T
+        dist = np.einsum('ri,ij,rj->r', n, metric, n)[:, np.newaxis] - 2*np.dot(np.dot(n, metric), images.T) + images_metric
+        dist_min = np.min(dist, axis=1)
+        inside = np.abs(dist[:, iorigin] - dist_min) < tol**2
+        Rvectors.append(n[inside])
+        ndegen.append(np.sum(np.abs(dist[inside] - dist_min[inside, np.newaxis]) < tol**2, axis=1))
+
+    Rvectors = np.concatenate(Rvectors)
+    ndegen = np.concatenate(ndegen)
+
+    if not np.isclose(np.sum(1 / ndegen), np.prod(grid)):
+        raise ValueError(
+            'the degeneracies of the Wigner-Seitz supercell do not sum to the number of k-points, '
+            'increase search_size (currently %d)' % search_size)
+
+    Rvectors.flags.writeable = False
+    ndegen.flags.writeable = False
+
+    return Rvectors, ndegen
+
+
+def wigner_seitz(grid, dlv, search_size=2, tol=1e-5):
+    """
+    Find the lattice vectors in the Wigner-Seitz supercell of the k-point grid
+
+    The lattice vectors are found, and ordered, as in wannier90: a lattice
+    vector belongs to the supercell if it is at least as close to the origin
+    as to any of its images translated by supercell lattice vectors, and its
+    degeneracy is the number of images that are equally close.
+
+    The results are memoized for each grid and lattice, and are returned as
+    read-only arrays.
+
+    Parameters
+    ----------
+    grid : tuple of int
+        the number of k-points along each reciprocal lattice vector, as
+        returned by :func:`w90utils.io.win.read_kgrid`
+    dlv : ndarray, shape (3, 3)
+        direct lattice vectors
+    search_size : int, optional
+        the range, in supercell lattice vectors, of the search
+    tol : float, optional
+        tolerance on the distances, in the units of ``dlv``
+
+    Returns
+    -------
+    Rvectors : ndarray, shape (nrpts, 3)
+        lattice vectors, in crystal coordinates
+    ndegen : ndarray, shape (nrpts,)
+
+    """
+    grid = tuple(int(n) for n in grid)
+    dlv = tuple(np.asarray(dlv, dtype=float).ravel())
+
+    return _wigner_seitz(grid, dlv, int(search_size), float(tol))
+
+
+def ws_distance(xr, Rvectors, Rweights, centers, grid, dlv, search_size=2, tol=1e-5):
+    """
+    Translate the matrix elements between Wannier functions to the minimal
+    images of their separation, as with ``use_ws_distance`` in wannier90
+
+    Each matrix element :math:`X_{mn}(\\mathbf{R})` is moved to the lattice
+    vectors :math:`\\mathbf{R}+\\mathbf{T}`, for the supercell lattice vectors
+    :math:`\\mathbf{T}` that minimize
+    :math:`|\\mathbf{R}+\\mathbf{T}+\\boldsymbol{\\tau}_n-\\boldsymbol{\\tau}_m|`,
+    and shared equally between them if there is more than one. The result can
+    be used in place of the original matrix elements with the functions of
+    :mod:`w90utils.interp`.
+
+    Parameters
+    ----------
+    xr : ndarray, shape (nrpts, nwann, nwann, ...)
+        matrix elements, such as the Hamiltonian returned by
+        :func:`w90utils.io.read_hr`
+    Rvectors : ndarray, shape (nrpts, 3)
+        lattice vectors, in crystal coordinates
+    Rweights : ndarray, shape (nrpts,)
+    centers : ndarray, shape (nwann, 3)
+        Wannier centers, in Cartesian coordinates in the units of ``dlv``
+    grid : tuple of int
+    dlv : ndarray, shape (3, 3)
+    search_size : int, optional
+        the range, in supercell lattice vectors, of the search
+    tol : float, optional
+        tolerance on the distances, in the units of ``dlv``
+
+    Returns
+    -------
+    xr : ndarray, shape (nrpts_ws, nwann, nwann, ...)
+        the matrix elements, including the weights
+    Rvectors : ndarray, shape (nrpts_ws, 3)
+    Rweights : ndarray, shape (nrpts_ws,)
+        ones, since the weights are included in the matrix elements
+
+    """
+    grid = np.asarray(grid, dtype=int)
+    dlv = np.asarray(dlv, dtype=float)
+    Rvectors = np.asarray(Rvectors, dtype=int)
+    nwann = xr.shape[1]
+
+    # search one supercell further, since the separations are not lattice
+    # vectors of the Wigner-Seitz supercell
+    images = _supercell_images(grid, search_size+1)
+    images_cart = np.dot(images, dlv)
+
+    # R + tau_n - tau_m, for all (R, m, n)
+    d = np.dot(Rvectors, dlv)[:, np.newaxis, np.newaxis, :] + centers[np.newaxis, np.newaxis, :, :] - centers[np.newaxis, :, np.newaxis, :]
+    d = d.reshape((-1, 3))
+
+    (irpt, ishift, weights) = ([], [], [])
+    for start in range(0, len(d), _CHUNK_SIZE):
+        dist = np.linalg.norm(d[start:(start+_CHUNK_SIZE), np.newaxis, :] + images_cart, axis=-1)
+        (i, j) = np.nonzero(np.abs(dist - np.min(dist, axis=1)[:, np.newaxis]) < tol)
+        ndeg = np.bincount(i, minlength=len(dist))
+        irpt.append(start + i)
+        ishift.append(j)
+        weights.append(1 / ndeg[i])
+    (irpt, ishift, weights) = (np.concatenate(irpt), np.concatenate(ishift), np.concatenate(weights))
+
+    # accumulate on the unique lattice vectors R + T
+    (ir, imn) = np.divmod(irpt, nwann**2)
+    (Rvectors_ws, inverse) = np.unique(Rvectors[ir] + images[ishift], axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+
+    xr_flat = xr.reshape((len(xr), nwann**2) + xr.shape[3:])
+    xr_ws = np.zeros((len(Rvectors_ws), nwann**2) + xr.shape[3:], dtype=xr.dtype)
+    w = (np.asarray(Rweights)[ir] * weights).reshape((-1,) + (1,)*(xr.ndim-3))
+    np.add.at(xr_ws, (inverse, imn), w * xr_flat[ir, imn])
+
+    return xr_ws.reshape((len(Rvectors_ws),) + xr.shape[1:]), Rvectors_ws, np.ones(len(Rvectors_ws))
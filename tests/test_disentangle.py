@@ -0,0 +1,57 @@
+import os
+
+import pytest
+import numpy as np
+
+import w90utils
+from w90utils import io as w90io
+
+
+@pytest.mark.parametrize('example', ['example03', 'example04'])
+def test_disentangle(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    chkpt = w90io.CheckpointIO('wannier.chk')
+
+    w90dat = w90io.read_data()
+    windows = w90io.win.read_dis_windows('wannier.win')
+    (outer, frozen) = w90utils.disentangle.window_masks(
+        w90dat.eig,
+        windows.get('dis_win_min'), windows.get('dis_win_max'),
+        windows.get('dis_froz_min'), windows.get('dis_froz_max'),
+    )
+
+    result = w90utils.disentangle.disentangle(
+        w90dat.mmn, w90dat.amn, w90dat.eig, w90dat.kpb_kidx, w90dat.bw, outer, frozen, maxiter=2000
+    )
+
+    assert result.converged
+    assert np.all(np.diff(result.history) <= 1e-8)
+    assert np.isclose(result.omega_i, chkpt.omega_invariant, rtol=1e-4)
+
+    for ikpt in range(chkpt.nkpts):
+        u = result.umat_opt[ikpt][:result.ndimwin[ikpt]]
+        u_ref = chkpt.umat_opt[ikpt][:result.ndimwin[ikpt]]
+        assert np.allclose(np.dot(u, u.conj().T), np.dot(u_ref, u_ref.conj().T), atol=1e-4)
+
+
+@pytest.mark.parametrize('maxiter', [1, 3])
+def test_disentangle_maxiter(maxiter):
+    rng = np.random.RandomState(0)
+    (nkpts, nntot, nbnds, nwann) = (4, 2, 5, 2)
+    kpb_kidx = (np.arange(nkpts)[:, np.newaxis] + [1, -1]) % nkpts
+    psi = w90utils.unitarize(rng.randn(nkpts, 8, nbnds) + 1j*rng.randn(nkpts, 8, nbnds))
+    mmn = np.matmul(psi.conj().swapaxes(1, 2)[:, np.newaxis], psi[kpb_kidx])
+    amn = rng.randn(nkpts, nbnds, nwann) + 1j*rng.randn(nkpts, nbnds, nwann)
+    eig = np.sort(rng.randn(nkpts, nbnds), axis=1)
+    bweights = np.array([0.5, 0.5])
+
+    result = w90utils.disentangle.disentangle(mmn, amn, eig, kpb_kidx, bweights, maxiter=maxiter)
+
+    # the invariant spread of the subspace that is returned
+    m = w90utils.rotate_mmn(mmn, result.umat_opt, kpb_kidx)
+    omega_i = w90utils.sprd.omega_i(m, bweights)
+    assert not result.converged
+    assert len(result.history) == maxiter
+    assert np.isclose(result.omega_i, result.history[-1])
+    assert np.isclose(result.omega_i, omega_i)
@@ -0,0 +1,130 @@
+import os
+
+import pytest
+import numpy as np
+
+import w90utils
+from w90utils import interp
+from w90utils import io as w90io
+from w90utils import ws
+
+
+def _read_hr(data_dir):
+    # wannier90 3.x interpolates with use_ws_distance by default
+    (hr, Rvectors, Rweights) = w90io.read_hr('wannier_hr.dat')
+    if 'wannier90-3' not in data_dir:
+        return hr, Rvectors, Rweights
+
+    dlv = w90io.nnkp.read_dlv('wannier.nnkp', units='angstrom')
+    grid = w90io.win.read_kgrid('wannier.win')
+    chk = w90io.CheckpointIO('wannier.chk')
+    # the centers translated to the home unit cell, as in wannier90
+    centers = np.dot(np.mod(np.linalg.solve(dlv.T, chk.wannier_centers.T).T, 1), dlv)
+
+    return ws.ws_distance(hr, Rvectors, Rweights, centers, grid, dlv)
+
+@pytest.mark.parametrize('example', ['example03', 'example04'])
+def test_eigvals(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    bands_ref = w90io.read_bands('wannier_band.dat')
+    kpoints = w90io.read_kpoints('wannier_band.kpt')
+    (hr, Rvectors, Rweights) = _read_hr(data_dir)
+
+    bands = interp.eigvals(hr, Rvectors, Rweights, kpoints)
+    assert np.allclose(bands, bands_ref, rtol=0, atol=1e-4)
+
+    bands = interp.eigvals(hr, Rvectors, Rweights, kpoints, memory=2**12, workers=2)
+    assert np.allclose(bands, bands_ref, rtol=0, atol=1e-4)
+
+    bands = interp.eigvals(hr, Rvectors, Rweights, kpoints, dtype=np.complex64)
+    assert np.allclose(bands, bands_ref, rtol=0, atol=1e-3)
+
+    hk = interp.hamiltonian(hr, Rvectors, Rweights, kpoints)
+    (w, v) = interp.eigh(hr, Rvectors, Rweights, kpoints)
+    assert np.allclose(np.matmul(v * w[:, np.newaxis, :], v.conj().swapaxes(1, 2)), hk)
+    assert np.allclose(w, bands_ref, rtol=0, atol=1e-4)
+
+
+@pytest.mark.parametrize('example', ['example03', 'example04'])
+def test_hamiltonian_grid(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    kpoints = w90io.nnkp.read_kpoints('wannier.nnkp')
+    grid = w90io.win.read_kgrid('wannier.win')
+    (hr, Rvectors, Rweights) = w90io.read_hr('wannier_hr.dat')
+
+    hk_direct = interp.hamiltonian(hr, Rvectors, Rweights, kpoints, method='direct')
+    hk_fft = interp.hamiltonian(hr, Rvectors, Rweights, kpoints, method='fft')
+    assert np.allclose(hk_fft, hk_direct)
+
+    assert np.allclose(interp.grid_kpoints(grid), kpoints)
+    assert np.allclose(interp.hamiltonian_grid(hr, Rvectors, Rweights, grid), hk_direct)
+
+    with pytest.raises(ValueError):
+        interp.hamiltonian(hr, Rvectors, Rweights, kpoints[1:], method='fft')
+
+
+@pytest.mark.parametrize('example', ['example04'])
+def test_velocities(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    dlv = w90io.nnkp.read_dlv('wannier.nnkp', units='angstrom')
+    kpoints = w90io.postw90.read_kpoints('wannier_geninterp.kpt')
+    bands_ref = w90io.postw90.read_bands('wannier_geninterp.dat')
+    vnk_ref = w90io.postw90.read_vnk('wannier_geninterp.dat')
+    (hr, Rvectors, Rweights) = _read_hr(data_dir)
+
+    (bands, vnk) = interp.velocities(hr, Rvectors, Rweights, kpoints, dlv, degen_thr=None)
+    assert np.allclose(bands, bands_ref, rtol=0, atol=1e-4)
+
+    # the derivatives of degenerate bands depend on the gauge
+    nondegen = np.ones(bands.shape, dtype=bool)
+    nondegen[:, 1:] &= np.diff(bands, axis=1) > 1e-3
+    nondegen[:, :-1] &= np.diff(bands, axis=1) > 1e-3
+    assert np.allclose(vnk[nondegen], vnk_ref[nondegen], rtol=0, atol=1e-4)
+
+    (bands, vnk_degen, minv) = interp.inverse_effective_masses(hr, Rvectors, Rweights, kpoints, dlv)
+    assert np.allclose(vnk_degen[nondegen], vnk_ref[nondegen], rtol=0, atol=1e-4)
+    assert np.allclose(minv, minv.swapaxes(2, 3))
+
+
+@pytest.mark.parametrize('example', ['example02', 'example03', 'example04'])
+def test_hamiltonian_from_chk(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    (hr_ref, Rvectors_ref, Rweights_ref) = w90io.read_hr('wannier_hr.dat')
+
+    chk = w90io.CheckpointIO('wannier.chk')
+    eig = w90io.read_eig('wannier.eig')
+    (hr, Rvectors, Rweights) = interp.hamiltonian_from_chk(chk, eig)
+
+    assert np.all(Rvectors == Rvectors_ref)
+    assert np.allclose(Rweights, Rweights_ref)
+    assert np.allclose(hr, hr_ref, rtol=0, atol=1e-5)
+
+
+@pytest.mark.parametrize('example', ['example01', 'example02'])
+def test_position_matrix(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    w90dat = w90io.read_data(eig=None)
+    grid = w90io.win.read_kgrid('wannier.win')
+    umn = w90utils.unitarize(w90dat.amn)
+    mmn = w90utils.rotate_mmn(w90dat.mmn, umn, w90dat.kpb_kidx)
+    centers = w90utils.sprd.wannier_centers(mmn, w90dat.bv, w90dat.bw)
+
+    (Rvectors, ndegen) = ws.wigner_seitz(grid, w90dat.dlv)
+    rr = interp.position_matrix(mmn, w90dat.bv, w90dat.bw, Rvectors, w90dat.kpoints)
+
+    # the diagonal elements at the origin are the Wannier centers
+    iorigin = np.flatnonzero(np.all(Rvectors == 0, axis=1))[0]
+    assert np.allclose(np.diagonal(rr[iorigin]).T, centers)
+
+    rk = interp.position(rr, Rvectors, 1 / ndegen, w90dat.kpoints, memory=2**12, workers=2)
+    assert np.allclose(np.mean(np.diagonal(rk, axis1=1, axis2=2), axis=0).T, centers)
+
+    w90io.write_r('test_r.dat', rr, Rvectors)
+    (rr_io, Rvectors_io) = w90io.read_r('test_r.dat')
+    assert np.allclose(rr_io, rr, rtol=0, atol=1e-6)
+    assert np.all(Rvectors_io == Rvectors)
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+import numpy as np
+
+import w90utils
+from w90utils import io as w90io
+
+
+@pytest.mark.parametrize('example', ['example01', 'example02'])
+@pytest.mark.parametrize('method', ['cg', 'sd'])
+def test_localize(data_dir, example, method):
+    os.chdir(os.path.join(data_dir, example))
+
+    spread_ref = w90io.wout.read_sprd('wannier.wout')
+
+    w90dat = w90io.read_data(eig=None)
+    umn = w90utils.unitarize(w90dat.amn)
+
+    result = w90utils.localize.localize(w90dat.mmn, w90dat.kpb_kidx, w90dat.bv, w90dat.bw, umn, method=method, maxiter=1000)
+
+    assert np.isclose(result.history[0], spread_ref['TOT'][0])
+    assert np.all(np.diff(result.history) <= 1e-12)
+    assert result.omega <= spread_ref['TOT'][-1] + 1e-6
+    assert np.isclose(np.sum(result.spreads), result.omega)
+    assert np.allclose(result.mmn, w90utils.rotate_mmn(w90dat.mmn, result.umn, w90dat.kpb_kidx))
+
+
+@pytest.mark.parametrize('example', ['example01', 'example02'])
+def test_update_mmn(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    w90dat = w90io.read_data(eig=None)
+    umn = w90utils.unitarize(w90dat.amn)
+    mmn = w90utils.rotate_mmn(w90dat.mmn, umn, w90dat.kpb_kidx)
+
+    rng = np.random.RandomState(0)
+    x = rng.uniform(-1, 1, umn.shape[:1] + umn.shape[2:]*2) + 1j*rng.uniform(-1, 1, umn.shape[:1] + umn.shape[2:]*2)
+    expw = w90utils.expm_antihermitian((x - x.conj().swapaxes(1, 2)) / 2)
+    assert np.allclose(np.matmul(expw, expw.conj().swapaxes(1, 2)), np.eye(umn.shape[2]))
+
+    mmn_ref = w90utils.rotate_mmn(w90dat.mmn, np.matmul(umn, expw), w90dat.kpb_kidx)
+    assert w90utils.update_mmn(mmn, expw, w90dat.kpb_kidx) is mmn
+    assert np.allclose(mmn, mmn_ref)
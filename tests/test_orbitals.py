@@ -0,0 +1,51 @@
+import pytest
+import numpy as np
+import scipy.integrate
+
+from w90utils import orbitals
+
+
+def _sphere_quadrature(n=16):
+    # Gauss-Legendre in cos(theta) and uniform in phi, exact for the products
+    # of the harmonics up to l = 3
+    (x, w) = np.polynomial.legendre.leggauss(n)
+    phi = 2*np.pi * np.arange(2*n) / (2*n)
+    (cost, phi) = np.meshgrid(x, phi, indexing='ij')
+    sint = np.sqrt(1 - cost**2)
+    xyz = np.stack([sint*np.cos(phi), sint*np.sin(phi), cost], axis=-1).reshape((-1, 3))
+    weights = np.repeat(w, 2*n) * np.pi / n
+
+    return xyz, weights
+
+
+@pytest.mark.parametrize('l', [0, 1, 2, 3])
+def test_real_harmonics(l):
+    (xyz, weights) = _sphere_quadrature()
+    ylm = orbitals.real_harmonics(l, xyz)
+    assert np.allclose(np.dot(ylm * weights, ylm.T), np.eye(2*l+1))
+
+    # pz, px, py are along z, x, y
+    if l == 1:
+        assert np.allclose(orbitals.real_harmonics(1, np.eye(3)[[2, 0, 1]]), np.sqrt(3 / (4*np.pi)) * np.eye(3))
+
+
+@pytest.mark.parametrize('l,nmr', [(-1, 2), (-2, 3), (-3, 4), (-4, 5), (-5, 6)])
+def test_hybrids(l, nmr):
+    (xyz, weights) = _sphere_quadrature()
+    hybrids = np.array([orbitals.angular(l, mr, xyz) for mr in range(1, nmr+1)])
+    assert np.allclose(np.dot(hybrids * weights, hybrids.T), np.eye(nmr))
+
+
+@pytest.mark.parametrize('ir', [1, 2, 3])
+def test_radial(ir):
+    (norm, _) = scipy.integrate.quad(lambda r: (r * orbitals.radial(r, 1.5, ir))**2, 0, np.inf)
+    assert np.isclose(norm, 1)
+
+
+def test_trial_orbital():
+    # a pz orbital along x is a px orbital
+    xyz = np.random.RandomState(0).randn(10, 3)
+    assert np.allclose(
+        orbitals.trial_orbital(xyz, 1, 1, z_axis=(1, 0, 0), x_axis=(0, 1, 0)),
+        orbitals.trial_orbital(xyz, 1, 2),
+    )
@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+
+from w90utils import interp
+from w90utils import plot
+from w90utils import io as w90io
+
+
+def test_wannier_functions(tmpdir):
+    os.chdir(str(tmpdir))
+
+    rng = np.random.RandomState(0)
+    (grid, supercell, nbnds, nwann) = ((4, 3, 5), (3, 2, 1), 4, 2)
+    kpoints = interp.grid_kpoints((2, 2, 1))
+    unk = rng.randn(len(kpoints), nbnds, *grid) + 1j*rng.randn(len(kpoints), nbnds, *grid)
+    umn = np.linalg.qr(rng.randn(len(kpoints), nbnds, nwann) + 1j*rng.randn(len(kpoints), nbnds, nwann))[0]
+    for ikpt in range(len(kpoints)):
+        w90io.write_unk('UNK%05d.1' % (ikpt+1), unk[ikpt], ikpt)
+
+    # the sum over k-points at each point of the supercell, with the points
+    # in crystal coordinates
+    points = np.stack(np.meshgrid(*[
+        (np.arange(n*m) - (n//2)*m) / m for (n, m) in zip(supercell, grid)
+    ], indexing='ij'), axis=-1)
+    wann_ref = 0
+    for ikpt in range(len(kpoints)):
+        cell = np.mod(np.rint(points * grid).astype(int), grid)
+        u = np.einsum('nm,nxyz->mxyz', umn[ikpt], unk[ikpt][:, cell[..., 0], cell[..., 1], cell[..., 2]])
+        wann_ref = wann_ref + np.exp(2j*np.pi*np.dot(points, kpoints[ikpt])) * u
+    wann_ref *= np.sqrt(np.prod(grid)) / len(kpoints)
+
+    wann = plot.wannier_functions('.', np.eye(nwann) * np.ones((len(kpoints), 1, 1)), umn, kpoints, supercell)
+    # the same up to the global phase of each Wannier function
+    phases = np.sum(wann_ref.conj() * wann, axis=(1, 2, 3))
+    assert np.allclose(np.abs(phases), np.sum(np.abs(wann_ref)**2, axis=(1, 2, 3)))
+    assert np.allclose(wann, wann_ref * (phases / np.abs(phases))[:, np.newaxis, np.newaxis, np.newaxis])
+
+    wann_1 = plot.wannier_functions('.', np.eye(nwann) * np.ones((len(kpoints), 1, 1)), umn, kpoints, supercell,
+                                    wann_idx=[1], workers=2)
+    assert np.allclose(wann_1, wann[[1]])
+
+    # a Wannier function that vanishes everywhere has no phase to fix
+    umn_0 = umn.copy()
+    umn_0[:, :, 0] = 0
+    with np.errstate(all='raise'):
+        wann_0 = plot.wannier_functions('.', np.eye(nwann) * np.ones((len(kpoints), 1, 1)), umn_0, kpoints, supercell)
+    assert np.all(wann_0[0] == 0)
+    assert np.allclose(wann_0[1], wann[1])
+
+    dlv = np.diag([2.0, 3.0, 4.0])
+    (origin, voxel) = plot.supercell_grid(dlv, grid, supercell)
+    assert np.allclose(origin, [-2, -3, 0])
+
+    w90io.write_cube('test.cube', wann[0], origin, voxel)
+    with open('test.cube', 'r') as f:
+        values = np.fromstring(''.join(f.readlines()[6:]), sep=' ')
+    assert np.allclose(values.reshape(wann[0].shape), wann[0].real, rtol=1e-5, atol=1e-5)
+
+    w90io.write_xsf('test.xsf', wann[0], origin, voxel, dlv=dlv)
+    with open('test.xsf', 'r') as f:
+        block = f.read().split('BEGIN_DATAGRID_3D_UNKNOWN')[1].split('END_DATAGRID_3D')[0]
+    values = np.fromstring(block, sep=' ')[3+3+9:]
+    assert np.allclose(values.reshape(wann[0].shape, order='F'), wann[0].real, rtol=1e-5, atol=1e-5)
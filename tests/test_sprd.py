@@ -2,6 +2,7 @@ import os
 
 import pytest
 import numpy as np
+import scipy.linalg
 
 import w90utils
 from w90utils import io as w90io
@@ -58,3 +59,97 @@ def test_omega(data_dir, example):
     assert np.allclose(spread_tot_1, spread_ref['TOT'][0])
     assert np.allclose(spread_tot_2, spread_ref['TOT'][0])
     assert np.allclose(spread_tot_3, spread_ref['TOT'][0])
+
+
+@pytest.mark.parametrize('example', ['example01', 'example02'])
+@pytest.mark.parametrize('chunk_size', [None, 1])
+def test_spread_components_from_mmn(data_dir, example, chunk_size):
+    os.chdir(os.path.join(data_dir, example))
+
+    spread_ref = w90io.wout.read_sprd('wannier.wout')
+
+    w90dat = w90io.read_data(eig=None)
+    umn = w90utils.unitarize(w90dat.amn)
+    mmn = w90utils.rotate_mmn(w90dat.mmn, umn, w90dat.kpb_kidx)
+
+    sprd = w90utils.sprd.spread_components_from_mmn('wannier.mmn', w90dat.bv, w90dat.bw, umn=umn, chunk_size=chunk_size)
+
+    assert np.allclose(sprd.centers, w90utils.sprd.wannier_centers(mmn, w90dat.bv, w90dat.bw))
+    assert np.allclose(sprd.omega_i, w90utils.sprd.omega_i(mmn, w90dat.bw))
+    assert np.allclose(sprd.omega_d, spread_ref['D'][0])
+    assert np.allclose(sprd.omega_od, spread_ref['OD'][0])
+    assert np.allclose(sprd.omega, spread_ref['TOT'][0])
+
+
+@pytest.mark.parametrize('example', ['example01', 'example02'])
+def test_spread_components(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    spread_ref = w90io.wout.read_sprd('wannier.wout')
+
+    w90dat = w90io.read_data(eig=None)
+    umn = w90utils.unitarize(w90dat.amn)
+    mmn = w90utils.rotate_mmn(w90dat.mmn, umn, w90dat.kpb_kidx)
+
+    calc = w90utils.sprd.SpreadCalculator(w90dat.bv, w90dat.bw)
+    sprd = calc.components(mmn)
+
+    assert np.allclose(sprd.omega_d, spread_ref['D'][0])
+    assert np.allclose(sprd.omega_od, spread_ref['OD'][0])
+    assert np.allclose(sprd.omega, spread_ref['TOT'][0])
+    assert np.allclose(np.sum(sprd.spreads), sprd.omega)
+    assert np.allclose(sprd.centers, calc.centers(mmn))
+
+    sprd_file = calc.components_from_mmn('wannier.mmn', umn=umn)
+    for (a, b) in zip(sprd, sprd_file):
+        assert np.allclose(a, b)
+
+
+@pytest.mark.parametrize('example', ['example01', 'example02'])
+def test_omega_gradient(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    w90dat = w90io.read_data(eig=None)
+    umn = w90utils.unitarize(w90dat.amn)
+    mmn = w90utils.rotate_mmn(w90dat.mmn, umn, w90dat.kpb_kidx)
+
+    g = w90utils.sprd.omega_gradient(mmn, w90dat.bv, w90dat.bw)
+    assert np.allclose(g, -g.conj().swapaxes(1, 2))
+
+    rng = np.random.RandomState(0)
+    x = rng.uniform(-1, 1, g.shape) + 1j*rng.uniform(-1, 1, g.shape)
+    dw = (x - x.conj().swapaxes(1, 2)) / 2
+
+    def omega(eps):
+        u = np.array([np.dot(u_k, scipy.linalg.expm(eps*dw_k)) for (u_k, dw_k) in zip(umn, dw)])
+        return w90utils.sprd.omega(w90utils.rotate_mmn(w90dat.mmn, u, w90dat.kpb_kidx), w90dat.bv, w90dat.bw)
+
+    h = 1e-5
+    domega_fd = (omega(h) - omega(-h)) / (2*h)
+    domega = np.sum(np.einsum('kij,kji->k', g, dw)).real
+
+    assert np.allclose(domega, domega_fd, rtol=1e-6, atol=1e-8)
+
+
+def test_components_from_mmn_synthetic(tmpdir):
+    os.chdir(str(tmpdir))
+
+    rng = np.random.RandomState(0)
+    (nkpts, nntot, nbnds, nwann) = (3, 2, 4, 2)
+    mmn = rng.randn(nkpts, nntot, nbnds, nbnds) + 1j*rng.randn(nkpts, nntot, nbnds, nbnds)
+    kpb_kidx = rng.randint(0, nkpts, (nkpts, nntot))
+    w90io.write_mmn('wannier.mmn', mmn, kpb_kidx, np.zeros((nkpts, nntot, 3), dtype=int))
+    umn = w90utils.unitarize(rng.randn(nkpts, nbnds, nwann) + 1j*rng.randn(nkpts, nbnds, nwann))
+
+    calc = w90utils.sprd.SpreadCalculator(rng.randn(nkpts, nntot, 3), rng.uniform(0.5, 1, nntot))
+    sprd = calc.components(w90utils.rotate_mmn(mmn, umn, kpb_kidx))
+    for chunk_size in [None, 1, 2]:
+        sprd_file = calc.components_from_mmn('wannier.mmn', umn=umn, chunk_size=chunk_size)
+        for (a, b) in zip(sprd, sprd_file):
+            assert np.allclose(a, b)
+
+    with open('empty.mmn', 'w') as f:
+        print('DUMMY HEADER', file=f)
+        print('%12d%12d%12d' % (nbnds, 0, nntot), file=f)
+    with pytest.raises(ValueError):
+        calc.components_from_mmn('empty.mmn')
@@ -21,3 +21,22 @@ def test_read_excluded_bands(data_dir, example):
     idx = w90io.nnkp.read_excluded_bands('wannier.nnkp')
 
     assert np.all(idx == idx_ref)
+
+
+@pytest.mark.parametrize('example', ['example01', 'example02', 'example03', 'example04'])
+def test_nnkp_file(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    nnkp = w90io.nnkp.NnkpFile('wannier.nnkp')
+
+    rlv = nnkp.rlv(units='angstrom')
+    dlv = nnkp.dlv(units='angstrom')
+    assert np.allclose(np.dot(dlv, rlv.T), 2*np.pi*np.eye(3))
+
+    kpoints = nnkp.kpoints()
+    kpb_kidx, kpb_g = nnkp.nnkpts()
+    assert kpb_kidx.shape == (len(kpoints), kpb_g.shape[1])
+    assert np.allclose(kpoints[kpb_kidx] + kpb_g - kpoints[:, np.newaxis, :], np.dot(nnkp.bvectors(units='angstrom'), np.linalg.inv(rlv)))
+
+    assert np.allclose(w90io.nnkp.read_kpoints('wannier.nnkp', units='bohr'), nnkp.kpoints(units='bohr'))
+    assert len(w90io.nnkp.read_projections('wannier.nnkp')) == len(nnkp.projections())
@@ -1,12 +1,18 @@
 import os
+import pickle
+import sys
 
 import pytest
 import numpy as np
+import scipy.io
 
 import w90utils
 from w90utils import io as w90io
 
 
+_requires_shared_memory = pytest.mark.skipif(sys.version_info < (3, 8), reason='shared memory requires Python 3.8')
+
+
 @pytest.mark.parametrize('example', ['example01', 'example02', 'example03', 'example04'])
 def test_read_data(data_dir, example):
     os.chdir(os.path.join(data_dir, example))
@@ -17,6 +23,122 @@ def test_read_data(data_dir, example):
         w90io.read_data()
 
 
+@pytest.mark.parametrize('example', ['example02', 'example03', 'example04'])
+def test_read_data_lazy(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    w90dat = w90io.read_data()
+    assert not any(w90dat.is_loaded(name) for name in ['amn', 'mmn', 'eig', 'bv'])
+
+    bw = w90dat.bw
+    assert w90dat.is_loaded('bv')
+    assert not w90dat.is_loaded('mmn')
+    assert np.allclose(bw, w90io._utils.bweights(w90io.nnkp.read_bvectors('wannier.nnkp', units='angstrom')))
+
+    (dlv, rlv, amn, mmn, eig, kpoints, kpb_kidx, kpb_g, bv, bw, length_unit, energy_unit) = w90dat
+    assert len(w90dat) == len(w90io.Wannier90Data._fields)
+    assert w90dat[3] is mmn
+    assert np.all(kpb_g == w90io.nnkp.read_nnkpts('wannier.nnkp')[1])
+
+    w90dat.release('mmn')
+    assert not w90dat.is_loaded('mmn')
+    assert np.allclose(w90dat.mmn, mmn)
+
+    w90dat = w90io.read_data(eig=None)
+    assert w90dat.eig is None
+
+
+def test_wannier90data_tuple():
+    w90dat = w90io.Wannier90Data._make(range(12))
+
+    (dlv, rlv, amn, mmn, eig, kpoints, kpb_kidx, kpb_g, bv, bw, length_unit, energy_unit) = w90dat
+    assert (dlv, mmn, energy_unit) == (0, 3, 11)
+    assert tuple(w90dat) == tuple(range(12))
+    assert w90dat[-1] == 11 and w90dat[2:4] == (2, 3)
+    assert w90dat.index(5) == 5 and 7 in w90dat
+    assert w90dat._asdict()['kpb_g'] == 7
+    assert w90dat._replace(eig=None).eig is None and w90dat.eig == 4
+
+    w90dat = pickle.loads(pickle.dumps(w90dat))
+    assert tuple(w90dat) == tuple(range(12))
+
+    with pytest.raises(TypeError):
+        w90io.Wannier90Data._make(range(11))
+
+
+def test_read_data_pickle(tmpdir):
+    os.chdir(str(tmpdir))
+
+    rng = np.random.RandomState(0)
+    amn = rng.randn(2, 4, 3) + 1j*rng.randn(2, 4, 3)
+    w90io.write_amn('wannier.amn', amn)
+
+    w90dat = pickle.loads(pickle.dumps(w90io.read_data(dlv=np.eye(3), mmn=None)))
+    assert not w90dat.is_loaded('amn')
+    assert np.allclose(w90dat.amn, amn)
+    assert np.allclose(pickle.loads(pickle.dumps(w90dat)).amn, amn)
+
+    # released fields are read from disk again, and given fields are not
+    w90io.write_amn('wannier.amn', 2*amn)
+    w90dat.release('amn', 'dlv')
+    assert np.allclose(w90dat.amn, 2*amn)
+    with pytest.raises(AttributeError):
+        w90dat.dlv
+
+
+@pytest.mark.parametrize('example', ['example03', 'example04'])
+@pytest.mark.parametrize('processes', [False, pytest.param(True, marks=_requires_shared_memory)])
+def test_read_data_workers(data_dir, example, processes):
+    os.chdir(os.path.join(data_dir, example))
+
+    w90dat = w90io.read_data(workers=2, processes=processes)
+    assert all(w90dat.is_loaded(name) for name in ['amn', 'mmn', 'eig', 'bv'])
+    assert np.allclose(w90dat.mmn, w90io.read_mmn('wannier.mmn'))
+    assert np.allclose(w90dat.amn, w90io.read_amn('wannier.amn'))
+    assert np.allclose(w90dat.eig, w90io.read_eig('wannier.eig'))
+    assert np.allclose(w90dat.kpoints, w90io.nnkp.read_kpoints('wannier.nnkp'))
+
+
+@pytest.mark.parametrize('processes', [False, pytest.param(True, marks=_requires_shared_memory)])
+def test_read_data_workers_failure(tmpdir, processes):
+    os.chdir(str(tmpdir))
+
+    rng = np.random.RandomState(0)
+    amn = rng.randn(2, 4, 3) + 1j*rng.randn(2, 4, 3)
+    mmn = rng.randn(2, 1, 4, 4) + 1j*rng.randn(2, 1, 4, 4)
+    eig = np.sort(rng.randn(2, 4), axis=1)
+    w90io.write_amn('wannier.amn', amn)
+    w90io.write_mmn('wannier.mmn', mmn, np.zeros((2, 1), dtype=int), np.zeros((2, 1, 3), dtype=int))
+    w90io.write_eig('wannier.eig', eig)
+    nnkp = {'dlv': np.eye(3), 'rlv': np.eye(3), 'kpoints': np.zeros((2, 3)), 'bv': np.zeros((1, 3)),
+            'kpb_kidx': np.zeros((2, 1), dtype=int), 'kpb_g': np.zeros((2, 1, 3), dtype=int)}
+
+    shm_dir = '/dev/shm'
+    blocks = set(os.listdir(shm_dir)) if os.path.isdir(shm_dir) else set()
+
+    w90dat = w90io.read_data(workers=3, processes=processes, **nnkp)
+    assert np.allclose(w90dat.amn, amn)
+    assert np.allclose(w90dat.mmn, mmn)
+    assert np.allclose(w90dat.eig, eig)
+
+    # the blocks of the files that were read are released when another fails
+    with open('wannier.mmn') as f:
+        text = f.read()
+    with open('wannier.mmn', 'w') as f:
+        f.write(text.replace('0.', '*.'))
+    with pytest.raises(ValueError):
+        w90io.read_data(workers=3, processes=processes, **nnkp)
+
+    if os.path.isdir(shm_dir):
+        assert set(os.listdir(shm_dir)) <= blocks
+
+
+def test_read_data_processes_python_version(monkeypatch):
+    monkeypatch.setattr(sys, 'version_info', (3, 7, 9))
+    with pytest.raises(RuntimeError):
+        w90io.read_data(workers=2, processes=True)
+
+
 @pytest.mark.parametrize('example', ['example03', 'example04'])
 def test_eig_io(data_dir, example):
     os.chdir(os.path.join(data_dir, example))
@@ -72,6 +194,78 @@ def test_read_mmn(data_dir, example):
     assert np.all(kpb_g == kpb_g_ref)
 
 
+@pytest.mark.parametrize('example', ['example01', 'example02', 'example04'])
+def test_iter_mmn_blocks(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    m_ref, kpb_kidx_ref, kpb_g_ref = w90io._mmn._process_mmn_file('wannier.mmn')
+
+    nblks = 0
+    for (ikpt, inn, kpb_kidx, kpb_g, block) in w90io.iter_mmn_blocks('wannier.mmn'):
+        assert kpb_kidx == kpb_kidx_ref[ikpt, inn]
+        assert np.all(kpb_g == kpb_g_ref[ikpt, inn])
+        assert np.allclose(block, m_ref[ikpt, inn])
+        nblks += 1
+    assert nblks == m_ref.shape[0] * m_ref.shape[1]
+
+    m = np.zeros_like(m_ref)
+    assert w90io.read_mmn('wannier.mmn', out=m) is m
+    assert np.allclose(m, m_ref)
+
+
+@pytest.mark.parametrize('example', ['example01', 'example02', 'example04'])
+def test_mmn_file(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    m_ref, kpb_kidx_ref, kpb_g_ref = w90io._mmn._process_mmn_file('wannier.mmn')
+
+    for mmn_file in [w90io.MmnFile('wannier.mmn'), w90io.MmnFile('wannier.mmn')]:
+        assert mmn_file.shape == m_ref.shape
+        assert np.all(mmn_file.kpb_kidx == kpb_kidx_ref)
+        assert np.all(mmn_file.kpb_g == kpb_g_ref)
+        assert np.allclose(mmn_file[1, 2], m_ref[1, 2])
+        assert np.allclose(mmn_file[-1], m_ref[-1])
+        assert np.allclose(mmn_file[::2, 1:3], m_ref[::2, 1:3])
+        assert np.allclose(mmn_file[[0, 3], [1, 0]], m_ref[np.ix_([0, 3], [1, 0])])
+    assert os.path.exists('wannier.mmn.idx')
+
+
+def test_mmn_file_index(tmpdir, monkeypatch):
+    os.chdir(str(tmpdir))
+
+    rng = np.random.RandomState(0)
+    mmn = rng.randn(7, 3, 2, 2) + 1j*rng.randn(7, 3, 2, 2)
+    kpb_kidx = rng.randint(0, 7, (7, 3))
+    kpb_g = rng.randint(-1, 2, (7, 3, 3))
+    w90io.write_mmn('test.mmn', mmn, kpb_kidx, kpb_g)
+
+    # chunks that end in the middle of blocks
+    monkeypatch.setattr(w90io._mmn, '_CHUNK_LINES', 3)
+    mmn_file = w90io.MmnFile('test.mmn')
+    assert mmn_file.offsets.shape == (7*3 + 1,)
+    assert mmn_file.offsets[-1] == os.path.getsize('test.mmn')
+    assert np.all(mmn_file.kpb_kidx == kpb_kidx)
+    assert np.all(mmn_file.kpb_g == kpb_g)
+    assert np.allclose(mmn_file[:], mmn)
+
+    # indices that cannot be read are rebuilt
+    with open('test.mmn.idx', 'rb') as f:
+        index = f.read()
+    for contents in [b'', b'garbage', index[:len(index)//2]]:
+        with open('test.mmn.idx', 'wb') as f:
+            f.write(contents)
+        mmn_file = w90io.MmnFile('test.mmn')
+        assert np.all(mmn_file.kpb_g == kpb_g)
+        assert np.allclose(mmn_file[:], mmn)
+
+    with open('test.mmn') as f:
+        text = f.read()
+    with open('truncated.mmn', 'w') as f:
+        f.write(text[:-100])
+    with pytest.raises(ValueError):
+        w90io.MmnFile('truncated.mmn')
+
+
 @pytest.mark.parametrize('example', ['example01', 'example02', 'example04'])
 def test_write_mmn(data_dir, example):
     os.chdir(os.path.join(data_dir, example))
@@ -100,6 +294,126 @@ def test_write_mmn(data_dir, example):
     #         raise
 
 
+def _mmn_text(mmn, fmt='%18.12f%18.12f', newline='\n'):
+    # an MMN file with the blocks at each k-point pointing to the k-point itself
+    (nkpts, nntot, nbnds) = mmn.shape[:3]
+    lines = ['header', '%12d%12d%12d' % (nbnds, nkpts, nntot)]
+    for ikpt in range(nkpts):
+        for inn in range(nntot):
+            lines.append('%5d%5d%5d%5d%5d' % (ikpt+1, ikpt+1, inn, 0, 0))
+            lines.extend(fmt % (z.real, z.imag) for z in mmn[ikpt, inn].ravel(order='F'))
+
+    return newline.join(lines) + newline
+
+
+def _parse_fixed_width(text):
+    # the blocks of an MMN file with the fixed-width parser, or None
+    lines = text.encode('ascii').splitlines(True)
+    (nbnds, nkpts, nntot) = map(int, lines[1].split())
+    layout = w90io._mmn._fixed_width_layout(lines[2], lines[3])
+    if layout is None:
+        return None
+
+    scratch = np.empty((11, nkpts*nntot*nbnds**2), dtype=np.uint64)
+    return w90io._mmn._parse_fixed_width_chunk(b''.join(lines[2:]), nkpts*nntot, nbnds, layout, scratch)
+
+
+def test_parse_fixed_width():
+    values = np.array([0.0, -0.0, 1.5, -1.5, 1234.000000000001, -0.000000000001, 0.999999999999, -9999.25])
+    mmn = np.empty((2, 1, 2, 2), dtype=complex)
+    (mmn.real.flat, mmn.imag.flat) = (values, values[::-1])
+
+    (header, re, im) = _parse_fixed_width(_mmn_text(mmn))
+    assert np.all(header[:, :2] == [[1, 1], [2, 2]])
+    assert np.array_equal(re.ravel(), mmn.real.transpose((0, 1, 3, 2)).ravel())
+    assert np.array_equal(im.ravel(), mmn.imag.transpose((0, 1, 3, 2)).ravel())
+    # the sign of zero
+    assert np.array_equal(np.signbit(re.ravel()), np.signbit(mmn.real.transpose((0, 1, 3, 2)).ravel()))
+    assert np.signbit(re[0, 2]) and not np.signbit(re[0, 0])
+    assert np.signbit(im[1, 1]) and not np.signbit(im[1, 3])
+
+    # leading blanks, and an explicit plus sign
+    (_, re, im) = _parse_fixed_width(_mmn_text(mmn, fmt='  %+18.12f %18.12f'))
+    assert np.array_equal(re.ravel(), mmn.real.transpose((0, 1, 3, 2)).ravel())
+
+    # layouts that are left to the tokenizer
+    assert _parse_fixed_width(_mmn_text(mmn, newline='\r\n')) is None
+    assert _parse_fixed_width(_mmn_text(mmn, fmt='%18.10E%18.10E')) is None
+    assert _parse_fixed_width(_mmn_text(mmn).replace('  -1.500000000000', '  1-.500000000000')) is None
+    assert _parse_fixed_width(_mmn_text(mmn).replace('  -1.500000000000', '***1.500000000000')) is None
+    for field in [' - 1.500000000000', ' +-1.500000000000', '  /1.500000000000', ' 1 1.500000000000',
+                  '  1-.500000000000', '   -.500000000000', '  \t1.500000000000', ' -\x7f1.500000000000']:
+        assert _parse_fixed_width(_mmn_text(mmn).replace('  -1.500000000000', field)) is None
+    assert _parse_fixed_width(_mmn_text(mmn).replace('  -1.500000000000', ' 1.5000000000E+00')) is None
+
+
+@pytest.mark.parametrize('fmt,newline', [
+    ('%18.12f%18.12f', '\n'), (' %17.12f %17.12f', '\n'), ('%18.12f%18.12f', '\r\n'), ('%18.10E%18.10E', '\n'),
+])
+def test_read_mmn_formats(tmpdir, fmt, newline):
+    os.chdir(str(tmpdir))
+
+    rng = np.random.RandomState(0)
+    mmn = rng.randn(5, 2, 3, 3) + 1j*rng.randn(5, 2, 3, 3)
+    mmn.real[0, 0, 0, 0] = -0.0
+    with open('test.mmn', 'w', newline='') as f:
+        f.write(_mmn_text(mmn, fmt=fmt, newline=newline))
+
+    # the last chunk is partial
+    for chunk_size in [None, 2]:
+        assert np.allclose(w90io.read_mmn('test.mmn', chunk_size=chunk_size), mmn, rtol=0, atol=1e-10)
+    chunks = list(w90io.iter_mmn_chunks('test.mmn', chunk_size=2))
+    assert [kstart for (kstart, _, _, _) in chunks] == [0, 2, 4]
+    assert np.allclose(np.concatenate([m for (_, m, _, _) in chunks]), mmn, rtol=0, atol=1e-10)
+
+    # a layout that changes after the first chunk
+    lines = _mmn_text(mmn, fmt=fmt, newline=newline).splitlines(True)
+    lines[-1] = '%18.10E%18.10E' % (1.0, 2.0) + newline
+    with open('test.mmn', 'w', newline='') as f:
+        f.writelines(lines)
+    mmn[-1, -1, -1, -1] = 1 + 2j
+    assert np.allclose(w90io.read_mmn('test.mmn', chunk_size=2), mmn, rtol=0, atol=1e-10)
+
+
+def test_read_mmn_overflow(tmpdir):
+    os.chdir(str(tmpdir))
+
+    mmn = np.ones((3, 1, 2, 2), dtype=complex)
+    lines = _mmn_text(mmn).splitlines(True)
+    lines[-1] = '*' * 18 + lines[-1][18:]
+    with open('test.mmn', 'w') as f:
+        f.writelines(lines)
+
+    with pytest.raises(ValueError):
+        w90io.read_mmn('test.mmn', chunk_size=1)
+
+
+@pytest.mark.parametrize('example', ['example01', 'example02', 'example03', 'example04'])
+def test_cache(data_dir, example, tmpdir):
+    os.chdir(os.path.join(data_dir, example))
+
+    w90dat_ref = w90io.read_data(eig=None)
+
+    w90io.cache.enable(str(tmpdir))
+    try:
+        for i in range(2):
+            a = w90io.read_amn('wannier.amn')
+            m = w90io.read_mmn('wannier.mmn')
+            bv = w90io.nnkp.read_bvectors('wannier.nnkp', units='angstrom')
+            assert np.allclose(a, w90dat_ref.amn)
+            assert np.allclose(m, w90dat_ref.mmn)
+            assert np.allclose(bv, w90dat_ref.bv)
+        assert isinstance(m, np.memmap)
+        assert w90io.cache.cache_size() > 0
+
+        w90io.cache.invalidate('wannier.mmn')
+        assert not isinstance(w90io.read_mmn('wannier.mmn'), np.memmap)
+        w90io.cache.invalidate()
+        assert w90io.cache.cache_size() == 0
+    finally:
+        w90io.cache.disable()
+
+
 @pytest.mark.parametrize('example', ['example02', 'example03', 'example04'])
 def test_read_hr(data_dir, example):
     os.chdir(os.path.join(data_dir, example))
@@ -155,6 +469,10 @@ def test_read_chkpt_mats(data_dir, example):
 
     assert np.allclose(mmn_chkpt, mmn)
 
+    out = np.empty_like(mmn)
+    assert w90utils.rotate_mmn(w90dat.mmn, umn, w90dat.kpb_kidx, out=out, chunk_size=3) is out
+    assert np.allclose(mmn_chkpt, out)
+
 
 @pytest.mark.parametrize('example', ['example03', 'example04'])
 def test_read_bands(data_dir, example):
@@ -167,3 +485,223 @@ def test_read_bands(data_dir, example):
     bands = w90io.read_bands('wannier_band.dat')
 
     assert np.allclose(bands, bands_ref, rtol=0, atol=1e-4)
+
+
+@pytest.mark.parametrize('example', ['example02', 'example03', 'example04'])
+def test_hr_io(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    (hr_ref, Rvectors_ref, Rweights_ref) = w90io.read_hr('wannier_hr.dat')
+
+    w90io.write_hr('test_hr.dat', hr_ref, Rvectors_ref, Rweights_ref)
+    (hr, Rvectors, Rweights) = w90io.read_hr('test_hr.dat')
+    assert np.allclose(hr, hr_ref, rtol=0, atol=1e-6)
+    assert np.all(Rvectors == Rvectors_ref)
+    assert np.allclose(Rweights, Rweights_ref)
+
+    w90io.save_hr('test_hr.npz', hr_ref, Rvectors_ref, Rweights_ref)
+    (hr, Rvectors, Rweights) = w90io.load_hr('test_hr.npz')
+    assert np.all(hr == hr_ref)
+    assert np.all(Rvectors == Rvectors_ref)
+    assert np.all(Rweights == Rweights_ref)
+
+
+@pytest.mark.parametrize('dtype', [float, np.complex64, complex])
+def test_write_hr_dtype(tmpdir, dtype):
+    os.chdir(str(tmpdir))
+
+    rng = np.random.RandomState(0)
+    Rvectors = np.array([[-1, 0, 0], [0, 0, 0], [1, 0, 0]])
+    Rweights = np.array([0.5, 1.0, 0.5])
+    hr_ref = rng.randn(3, 2, 2)
+    if dtype is not float:
+        hr_ref = hr_ref + 1j*rng.randn(3, 2, 2)
+    hr_ref = hr_ref.astype(dtype)
+
+    # a view that is not contiguous
+    w90io.write_hr('test_hr.dat', hr_ref[:, ::-1, ::-1], Rvectors, Rweights)
+    (hr, _, _) = w90io.read_hr('test_hr.dat')
+    assert np.allclose(hr, hr_ref[:, ::-1, ::-1], rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize('example', ['example03', 'example04'])
+def test_read_chkpt_windows(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    chkpt = w90io.CheckpointIO('wannier.chk')
+    assert chkpt.windows.dtype == bool
+    assert chkpt.windows.shape == (chkpt.nkpts, chkpt.nbnds)
+    assert np.all(np.sum(chkpt.windows, axis=1) == chkpt.ndimwin)
+
+
+@pytest.mark.parametrize('example', ['example01', 'example02', 'example03', 'example04'])
+def test_chkpt_io(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    with open('wannier.chk', 'rb') as f:
+        contents = f.read()
+
+    chkpt = w90io.CheckpointIO('wannier.chk')
+    assert 'mmat' not in vars(chkpt)
+    chkpt.to_file('test.chk')
+    with open('test.chk', 'rb') as f:
+        assert f.read() == contents
+
+    # the decoded records are encoded back to the same bytes
+    for name in ['windows', 'umat_opt', 'umat', 'mmat', 'wannier_centers', 'wannier_spreads']:
+        if chkpt.disentanglement or name not in ('windows', 'umat_opt'):
+            getattr(chkpt, name)
+    chkpt.to_file('test.chk')
+    with open('test.chk', 'rb') as f:
+        assert f.read() == contents
+
+    # in place, over the file that is memory-mapped
+    chkpt = w90io.CheckpointIO('test.chk')
+    chkpt.to_file('test.chk')
+    with open('test.chk', 'rb') as f:
+        assert f.read() == contents
+
+
+@pytest.mark.parametrize('disentanglement', [False, True])
+def test_chkpt_io_in_place(tmpdir, disentanglement):
+    os.chdir(str(tmpdir))
+
+    rng = np.random.RandomState(0)
+    (nkpts, nbnds, nwann, nntot) = (8, 6, 4, 6)
+    with scipy.io.FortranFile('test.chk', 'w') as f:
+        f.write_record(np.frombuffer(b' written on 18Oct2026 at 10:00:00', dtype='S1'))
+        for record in [np.int32(nbnds), np.int32(0), np.zeros(0, dtype=np.int32), rng.rand(9), rng.rand(9)]:
+            f.write_record(record)
+        for record in [np.int32(nkpts), np.array([2, 2, 2], dtype=np.int32), rng.rand(3*nkpts), np.int32(nntot)]:
+            f.write_record(record)
+        f.write_record(np.int32(nwann))
+        f.write_record(np.frombuffer(b'postwann'.ljust(20), dtype='S1'))
+        f.write_record(np.int32(disentanglement))
+        if disentanglement:
+            f.write_record(np.float64(1.5))
+            f.write_record(np.ones(nbnds*nkpts, dtype=np.int32))
+            f.write_record(np.full(nkpts, nbnds, dtype=np.int32))
+            f.write_record(rng.randn(2*nbnds*nwann*nkpts))
+        f.write_record(rng.randn(2*nwann*nwann*nkpts))
+        f.write_record(rng.randn(2*nwann*nwann*nntot*nkpts))
+        f.write_record(rng.randn(3*nwann))
+        f.write_record(rng.rand(nwann))
+    with open('test.chk', 'rb') as f:
+        contents = f.read()
+
+    chkpt = w90io.CheckpointIO('test.chk')
+    umat = chkpt.umat.copy()
+    chkpt.to_file('test.chk')
+    with open('test.chk', 'rb') as f:
+        assert f.read() == contents
+
+    chkpt = w90io.CheckpointIO('test.chk')
+    chkpt.umat[0] = 0
+    chkpt.to_file('test.chk')
+    chkpt = w90io.CheckpointIO('test.chk')
+    assert np.all(chkpt.umat[0] == 0)
+    assert np.all(chkpt.umat[1:] == umat[1:])
+    assert chkpt.header == ' written on 18Oct2026 at 10:00:00' and chkpt.chkpt == 'postwann'
+    assert os.listdir('.') == ['test.chk']
+
+
+def test_unk_io(tmpdir):
+    os.chdir(str(tmpdir))
+
+    rng = np.random.RandomState(0)
+    unk_ref = rng.randn(4, 3, 6, 5, 4) + 1j*rng.randn(4, 3, 6, 5, 4)
+    unk_ref /= np.linalg.norm(unk_ref.reshape((4, 3, -1)), axis=2)[:, :, np.newaxis, np.newaxis, np.newaxis]
+
+    for ikpt in range(len(unk_ref)):
+        w90io.write_unk('UNK%05d.1' % (ikpt+1), unk_ref[ikpt], ikpt)
+
+    assert np.allclose(w90io.read_unk('UNK00002.1'), unk_ref[1])
+    assert np.allclose(w90io.read_unk_all(workers=2), unk_ref)
+
+    unk_g = w90io.read_unk_all(gspace=True)
+    assert np.allclose(unk_g, np.fft.fftn(unk_ref, axes=(2, 3, 4), norm='ortho'))
+    assert np.allclose(w90io.read_unk('UNK00003.1', gspace=True), unk_g[2])
+
+    # a duplicate k-point, which leaves another one missing
+    w90io.write_unk('UNK00004.1', unk_ref[3], 1)
+    with pytest.raises(ValueError):
+        w90io.read_unk_all()
+    w90io.write_unk('UNK00004.1', unk_ref[3], 4)
+    with pytest.raises(ValueError):
+        w90io.read_unk_all()
+    os.remove('UNK00004.1')
+    w90io.write_unk('UNK00005.1', unk_ref[3], 4)
+    with pytest.raises(ValueError):
+        w90io.read_unk_all()
+
+
+def test_compute_mmn(tmpdir):
+    os.chdir(str(tmpdir))
+
+    rng = np.random.RandomState(0)
+    (grid, nbnds) = ((6, 5, 4), 3)
+    kpoints = np.array([[0, 0, 0], [0.5, 0, 0]])
+    unk = rng.randn(2, nbnds, *grid) + 1j*rng.randn(2, nbnds, *grid)
+    for ikpt in range(2):
+        w90io.write_unk('UNK%05d.1' % (ikpt+1), unk[ikpt], ikpt)
+
+    # the neighbors at k+b and k-b, with b = (0.5, 0, 0)
+    kpb_kidx = np.array([[1, 1], [0, 0]])
+    kpb_g = np.array([[[0, 0, 0], [-1, 0, 0]], [[1, 0, 0], [0, 0, 0]]])
+
+    x = np.arange(grid[0]) / grid[0]
+    mmn_ref = np.empty((2, 2, nbnds, nbnds), dtype=complex)
+    for ikpt in range(2):
+        for inn in range(2):
+            phase = np.exp(-2j*np.pi*kpb_g[ikpt, inn, 0]*x)[:, np.newaxis, np.newaxis]
+            mmn_ref[ikpt, inn] = np.einsum('mxyz,nxyz->mn', unk[ikpt].conj(), unk[kpb_kidx[ikpt, inn]] * phase)
+
+    assert np.allclose(np.dot(kpoints[kpb_kidx] + kpb_g - kpoints[:, np.newaxis], [1, 0, 0]), [[0.5, -0.5]]*2)
+    assert np.allclose(w90io.compute_mmn('.', kpb_kidx, kpb_g), mmn_ref)
+    assert np.allclose(w90io.compute_mmn('.', kpb_kidx, kpb_g, cache_size=1), mmn_ref)
+
+    w90io.compute_mmn('.', kpb_kidx, kpb_g, fname='test.mmn')
+    assert np.allclose(w90io.read_mmn('test.mmn'), mmn_ref)
+
+
+def test_compute_amn(tmpdir, monkeypatch):
+    os.chdir(str(tmpdir))
+
+    rng = np.random.RandomState(0)
+    (grid, nbnds) = ((8, 8, 8), 3)
+    dlv = np.diag([2.0, 2.5, 3.0])
+    kpoints = np.array([[0, 0, 0], [0.5, 0, 0.5]])
+    projections = [
+        {'center': np.array([0.1, 0.2, 0.3]), 'l': 0, 'mr': 1, 'r': 1, 'zona': 2.0,
+         'z-axis': np.array([0, 0, 1]), 'x-axis': np.array([1, 0, 0]), 'spin': None},
+        {'center': np.array([0.5, 0.5, 0.5]), 'l': -3, 'mr': 3, 'r': 2, 'zona': 3.0,
+         'z-axis': np.array([0, 1, 1]), 'x-axis': np.array([1, 0, 0]), 'spin': None},
+    ]
+    unk = rng.randn(2, nbnds, *grid) + 1j*rng.randn(2, nbnds, *grid)
+    for ikpt in range(2):
+        w90io.write_unk('UNK%05d.1' % (ikpt+1), unk[ikpt], ikpt)
+
+    # the Bloch sums of the trial orbitals over a range of unit cells
+    points = np.indices(grid).reshape((3, -1)).T / grid
+    cells = np.indices((13, 13, 13)).reshape((3, -1)).T - 6
+    dv = np.linalg.det(dlv) / np.prod(grid)
+    amn_ref = np.empty((2, nbnds, 2), dtype=complex)
+    for ikpt in range(2):
+        for (iproj, proj) in enumerate(projections):
+            xyz = np.dot(points[np.newaxis] + cells[:, np.newaxis] - proj['center'], dlv)
+            g = w90utils.orbitals.trial_orbital(
+                xyz, proj['l'], proj['mr'], proj['r'], proj['zona'], proj['z-axis'], proj['x-axis'])
+            bloch = np.sum(np.exp(-2j*np.pi*np.dot(points[np.newaxis] + cells[:, np.newaxis], kpoints[ikpt])) * g, axis=0)
+            amn_ref[ikpt, :, iproj] = np.sqrt(dv) * np.dot(unk[ikpt].reshape((nbnds, -1)).conj(), bloch)
+
+    amn = w90io.compute_amn('.', projections, kpoints, dlv, fname='test.amn', workers=2)
+    assert np.allclose(amn, amn_ref, rtol=0, atol=1e-5)
+    assert np.allclose(w90io.read_amn('test.amn'), amn)
+
+    # one k-point at a time, and one unit cell at a time
+    monkeypatch.setattr(w90io._amn, '_CHUNK_VALUES', 1)
+    assert np.allclose(w90io.compute_amn('.', projections, kpoints, dlv, memory=1), amn)
+
+    for (key, value) in [('spin', 1), ('l', 4), ('mr', 0), ('mr', 6), ('r', 4), ('zona', 0.0)]:
+        with pytest.raises(ValueError):
+            w90io.compute_amn('.', [dict(projections[0], **{key: value})], kpoints, dlv)
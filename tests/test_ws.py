@@ -0,0 +1,57 @@
+import os
+
+import pytest
+import numpy as np
+
+from w90utils import interp
+from w90utils import ws
+from w90utils import io as w90io
+
+
+@pytest.mark.parametrize('example', ['example02', 'example03', 'example04'])
+def test_wigner_seitz(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    dlv = w90io.nnkp.read_dlv('wannier.nnkp', units='angstrom')
+    grid = w90io.win.read_kgrid('wannier.win')
+    (_, Rvectors_ref, Rweights_ref) = w90io.read_hr('wannier_hr.dat')
+
+    (Rvectors, ndegen) = ws.wigner_seitz(grid, dlv)
+    assert np.all(Rvectors == Rvectors_ref)
+    assert np.allclose(1 / ndegen, Rweights_ref)
+
+    # the results are cached, and cannot be modified
+    assert ws.wigner_seitz(list(grid), dlv.tolist())[0] is Rvectors
+    with pytest.raises(ValueError):
+        ndegen[0] = 1
+
+
+def test_wigner_seitz_sum_rule():
+    # a sheared lattice, for which the images of the vectors at the edge of
+    # the search range are beyond it
+    dlv = np.array([[1.0, 1.5, 0.5], [0.0, 1.0, -0.9], [0.0, 0.0, 1.0]])
+    grid = (3, 2, 3)
+    (Rvectors, ndegen) = ws.wigner_seitz(grid, dlv)
+    assert np.isclose(np.sum(1 / ndegen), np.prod(grid))
+    assert len(np.unique(Rvectors, axis=0)) == len(Rvectors)
+
+    with pytest.raises(ValueError, match='search_size'):
+        ws.wigner_seitz(grid, dlv, search_size=0)
+
+
+@pytest.mark.parametrize('example', ['example03', 'example04'])
+def test_ws_distance(data_dir, example):
+    os.chdir(os.path.join(data_dir, example))
+
+    dlv = w90io.nnkp.read_dlv('wannier.nnkp', units='angstrom')
+    grid = w90io.win.read_kgrid('wannier.win')
+    centers = w90io.CheckpointIO('wannier.chk').wannier_centers
+    (hr, Rvectors, Rweights) = w90io.read_hr('wannier_hr.dat')
+
+    (hr_ws, Rvectors_ws, Rweights_ws) = ws.ws_distance(hr, Rvectors, Rweights, centers, grid, dlv)
+    assert np.allclose(np.sum(hr_ws, axis=0), np.sum(hr * Rweights[:, np.newaxis, np.newaxis], axis=0))
+
+    # the Hamiltonian is unchanged on the k-point grid
+    hk = interp.hamiltonian_grid(hr, Rvectors, Rweights, grid)
+    hk_ws = interp.hamiltonian_grid(hr_ws, Rvectors_ws, Rweights_ws, grid)
+    assert np.allclose(hk_ws, hk)